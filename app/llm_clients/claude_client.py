@@ -1,17 +1,94 @@
 import os
 from dotenv import load_dotenv
 from anthropic import AsyncAnthropic
-from backend.conversation_store import get_history, add_message
+from backend.async_store import add_message
+from backend.conversation_store import estimate_tokens
+from app.llm_clients import fake_providers
+from app.utils.context_window import budget_from_env, build_context
+from app.utils.conversion_cache import ConversionCache
+from app.utils.metrics import record_tokens
+from app.utils.prompt_cache import AnthropicPromptCache
+from app.utils.provider_health import tracked
+from app.utils.rate_limiter import ProviderBusy, limited
+from app.utils.response_cache import cached_completion
 
 load_dotenv()
 
+PROVIDER = "claude"
+
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-latest")
 
-client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+if fake_providers.enabled(PROVIDER):
+    client = fake_providers.FakeAsyncAnthropic(PROVIDER)
+    ANTHROPIC_API_KEY = ANTHROPIC_API_KEY or client.api_key
+else:
+    client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+
+# Generation parameters sent with every request (part of the response cache key)
+GENERATION_PARAMS = {"max_tokens": 512}
+
+# Token budget for conversation history in each request
+CONTEXT_BUDGET = budget_from_env("CLAUDE_CONTEXT_BUDGET")
+
+
+def _to_anthropic(role: str, text: str) -> dict:
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+# Anthropic-format messages, reused across turns of the same conversation
+converter = ConversionCache(_to_anthropic)
+
+# Cache breakpoints on each conversation's history
+prompt_cache = AnthropicPromptCache()
+
+
+def _prepare(model: str, messages: list[dict], conversation_id: str | None, tail: int = 1) -> list[dict]:
+    """Anthropic-format messages, with the history before the last `tail` messages marked for caching."""
+    anthro_messages = converter.convert(messages, conversation_id)
+    history_tokens = sum(estimate_tokens(msg["content"]) for msg in messages[:-tail]
+                         if isinstance(msg.get("content"), str))
+    return prompt_cache.prepare(model, anthro_messages, len(anthro_messages) - tail, history_tokens,
+                                conversation_id)
+
+
+def _usage_counts(usage) -> tuple[int, int, int]:
+    """(all input tokens, read from cache, written to cache); Anthropic's input_tokens excludes both."""
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return usage.input_tokens + cache_read + cache_write, cache_read, cache_write
+
+
+@limited(PROVIDER)
+@tracked(PROVIDER)
+async def _complete(model: str, anthro_messages: list[dict], timeout: float | None = None) -> str:
+    """
+    Single upstream call. Raises on API errors (and after `timeout` seconds, if given).
+    Returns the first text block, or "" if Claude sent none.
+    """
+    message = await client.messages.create(
+        model=model,
+        messages=anthro_messages,
+        **GENERATION_PARAMS,
+        **({"timeout": timeout} if timeout else {})
+    )
+    input_tokens, cache_read, cache_write = _usage_counts(message.usage)
+    record_tokens(PROVIDER, model, input_tokens, message.usage.output_tokens, cache_read, cache_write)
+    prompt_cache.observe(input_tokens, cache_read, cache_write)
+
+    for block in message.content:
+        if block.type == "text":
+            return block.text
+    return ""
+
 
+async def summarize(text: str) -> str:
+    """One-shot completion used to maintain rolling conversation summaries. Raises on API errors."""
+    return await _complete(CLAUDE_MODEL, [_to_anthropic("user", text)])
 
-async def ask_claude(prompt: str, conversation_id: str | None = None) -> str:
+
+async def ask_claude(prompt: str, conversation_id: str | None = None, model: str = CLAUDE_MODEL,
+                     use_cache: bool = True) -> str:
     """
     Send a prompt to Claude and return the text response (async version).
     """
@@ -24,100 +101,108 @@ async def ask_claude(prompt: str, conversation_id: str | None = None) -> str:
     # Build the logical history in our internal format
     history_messages: list[dict] = []
     if conversation_id:
-        history_messages = get_history(conversation_id)
+        history_messages = await build_context(conversation_id, prompt, CONTEXT_BUDGET, summarize)
 
     # Add the new user message
     history_messages.append({"role": "user", "content": prompt})
 
-    # Now adapt to Anthropic's expected format
-    anthro_messages: list[dict] = []
-    for msg in history_messages:
-        if not isinstance(msg.get("content"), str):
-            continue
-        if not msg.get("content"):
-            continue
-
-        anthro_messages.append({
-            "role": msg["role"],
-            "content": [
-                {"type": "text", "text": msg["content"]}
-            ],
-        })
-
     try:
-        message = await client.messages.create(
-            model=CLAUDE_MODEL,
-            max_tokens=512,
-            messages=anthro_messages,
+        # Conversion to Anthropic's format happens inside fetch, so cache hits skip it
+        answer = await cached_completion(
+            model, GENERATION_PARAMS, history_messages,
+            lambda: _complete(model, _prepare(model, history_messages, conversation_id)), use_cache
         )
 
-        # Extract the first text block from Claude's response
-        answer = ""
-        for block in message.content:
-            if block.type == "text":
-                answer = block.text
-                break
-
         if not answer:
             answer = "Claude did not return any text content."
 
         # Save back into our shared conversation store
         if conversation_id:
-            add_message(conversation_id, "user", prompt)
-            add_message(conversation_id, "assistant", answer, model=CLAUDE_MODEL)
+            await add_message(conversation_id, "user", prompt)
+            await add_message(conversation_id, "assistant", answer, model=model)
 
         return answer
 
     except Exception as e:
-        # log the full error for debugging
-        error_str = repr(e)
-        print("Error calling Claude:", error_str)
+        return friendly_error(e)
+
+
+def friendly_error(e: Exception) -> str:
+    """Log a Claude error and turn it into a message we can show the user."""
+    # log the full error for debugging
+    error_str = repr(e)
+    print("Error calling Claude:", error_str)
+
+    if isinstance(e, ProviderBusy):
+        return "Claude is busy right now. Please try again in a moment."
+
+    # Friendly messages for common cases
+    if "authentication_error" in error_str or "invalid x-api-key" in error_str:
+        return "Claude is not available right now (invalid or missing API key)."
 
-        # Friendly messages for common cases
-        if "authentication_error" in error_str or "invalid x-api-key" in error_str:
-            return "Claude is not available right now (invalid or missing API key)."
+    return "Claude is currently unavailable due to an internal error. Please try again later."
 
-        return "Claude is currently unavailable due to an internal error. Please try again later."
 
+async def complete_chat(user_message: str, conversation_history: list = None, model: str = CLAUDE_MODEL,
+                        use_cache: bool = True, conversation_id: str | None = None,
+                        timeout: float | None = None) -> str:
+    """Like chat(), but raises on API errors (used for failover)."""
+    messages = (conversation_history or []) + [{"role": "user", "content": user_message}]
+    answer = await cached_completion(
+        model, GENERATION_PARAMS, messages,
+        lambda: _complete(model, _prepare(model, messages, conversation_id), timeout), use_cache, timeout
+    )
+    return answer or "Claude did not return any text content."
 
-async def chat(user_message: str, conversation_history: list = None, model: str = CLAUDE_MODEL) -> str:
+
+async def chat(user_message: str, conversation_history: list = None, model: str = CLAUDE_MODEL,
+               use_cache: bool = True, conversation_id: str | None = None, timeout: float | None = None) -> str:
     """
     Simpler async function for comparison mode.
     Takes history directly instead of fetching from DB.
     """
-    # Build Anthropic-formatted messages
-    anthro_messages = []
-
-    # Add conversation history if provided
-    if conversation_history:
-        for msg in conversation_history:
-            if isinstance(msg.get("content"), str) and msg.get("content"):
-                anthro_messages.append({
-                    "role": msg["role"],
-                    "content": [{"type": "text", "text": msg["content"]}]
-                })
-
-    # Add current user message
-    anthro_messages.append({
-        "role": "user",
-        "content": [{"type": "text", "text": user_message}]
-    })
-
     try:
-        message = await client.messages.create(
-            model=model,
-            max_tokens=512,
-            messages=anthro_messages
-        )
-
-        # Extract text from response
-        for block in message.content:
-            if block.type == "text":
-                return block.text
-
-        return "Claude did not return any text content."
+        return await complete_chat(user_message, conversation_history, model, use_cache, conversation_id, timeout)
 
     except Exception as e:
         error_str = repr(e)
         print("Error calling Claude:", error_str)
-        return "Claude error"
\ No newline at end of file
+        return "Claude error"
+
+
+async def stream_chat(user_message: str, conversation_history: list = None, model: str = CLAUDE_MODEL,
+                      usage: dict | None = None, conversation_id: str | None = None, prefill: str | None = None):
+    """
+    Stream the answer as text deltas.
+    Errors are raised to the caller; token counts are written into `usage` when given.
+    With `prefill` (a partial answer), Claude continues it as its own reply and only the rest is streamed.
+    """
+    messages = (conversation_history or []) + [{"role": "user", "content": user_message}]
+    # The API rejects a final assistant message ending in whitespace
+    trimmed = prefill.rstrip() if prefill else ""
+    if trimmed:
+        messages.append({"role": "assistant", "content": trimmed})
+    anthro_messages = _prepare(model, messages, conversation_id, tail=2 if trimmed else 1)
+
+    async with client.messages.stream(
+        model=model,
+        messages=anthro_messages,
+        **GENERATION_PARAMS
+    ) as stream:
+        first = True
+        async for text in stream.text_stream:
+            if first and prefill and trimmed != prefill:
+                # We already sent the whitespace that was trimmed off
+                text = text.lstrip()
+            first = False
+            if text:
+                yield text
+
+        final = await stream.get_final_message()
+        input_tokens, cache_read, cache_write = _usage_counts(final.usage)
+        prompt_cache.observe(input_tokens, cache_read, cache_write)
+        if usage is not None:
+            usage["input_tokens"] = input_tokens
+            usage["output_tokens"] = final.usage.output_tokens
+            usage["cache_read_tokens"] = cache_read
+            usage["cache_write_tokens"] = cache_write
@@ -0,0 +1,447 @@
+"""
+Local stand-ins for the OpenAI, Anthropic and Gemini SDK clients, for load
+testing the relay without calling (or paying for) a real API.
+
+Enable with FAKE_PROVIDERS=1 (every provider) or a list such as
+FAKE_PROVIDERS=openai,gemini. Each fake answers with the same object shapes
+the client modules read from the real SDK, after a simulated delay:
+
+    FAKE_LATENCY_MS       mean time to first token (default 300)
+    FAKE_LATENCY_DIST     fixed | uniform | exponential | lognormal (default lognormal)
+    FAKE_LATENCY_JITTER   spread for uniform/lognormal, as a fraction of the mean (default 0.3)
+    FAKE_TOKENS_PER_SECOND output rate after the first token; 0 = all at once (default 0)
+    FAKE_OUTPUT_TOKENS    answer length in tokens (default 50)
+    FAKE_ERROR_RATE       fraction of calls that fail (default 0)
+    FAKE_ERROR_STATUS     HTTP status of injected failures: 429, 500, 529, ... (default 500)
+    FAKE_INPUT_TOKENS_PER_SECOND  prompt processing rate: uncached input tokens add
+                          to the time to first token; 0 = free (default 0)
+
+Every setting can be overridden per provider, e.g. FAKE_CLAUDE_LATENCY_MS=800.
+
+Prompt caching is simulated and its payloads are checked the way the APIs do:
+Anthropic `cache_control` breakpoints (at most 4, "ephemeral", 1h before 5m
+TTLs, 20-block lookback, 1024-token minimum) and Gemini cached contents
+(client.aio.caches.create/get/update/delete, `cached_content=` on generate
+calls, 403 once a cache has expired). Invalid payloads raise a 400.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FAKE_PROVIDERS = os.getenv("FAKE_PROVIDERS", "")
+
+# Upstream time spent by fake calls, for the benchmarks: set to a list and each
+# call made in that context (including tasks it spawns) appends (start, end).
+upstream_spans: contextvars.ContextVar[list | None] = contextvars.ContextVar("upstream_spans", default=None)
+
+_WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "relay", "model", "token", "answer", "fake")
+
+# Prompt caching limits, as documented by the providers
+_MIN_CACHE_TOKENS = 1024
+_ANTHROPIC_MAX_BREAKPOINTS = 4
+_ANTHROPIC_LOOKBACK = 20
+_ANTHROPIC_TTLS = {"5m": 300, "1h": 3600}
+
+
+def enabled(provider: str) -> bool:
+    selected = {name.strip().lower() for name in FAKE_PROVIDERS.split(",") if name.strip()}
+    return bool(selected & {"1", "true", "all", provider})
+
+
+class FakeAPIError(Exception):
+    """Injected failure; carries status_code like the SDKs' API errors."""
+
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeSettings:
+    def __init__(self, provider: str):
+        def setting(name: str, default: str) -> str:
+            return os.getenv(f"FAKE_{provider.upper()}_{name}", os.getenv(f"FAKE_{name}", default))
+
+        self.latency = float(setting("LATENCY_MS", "300")) / 1000
+        self.distribution = setting("LATENCY_DIST", "lognormal")
+        self.jitter = float(setting("LATENCY_JITTER", "0.3"))
+        self.tokens_per_second = float(setting("TOKENS_PER_SECOND", "0"))
+        self.output_tokens = int(setting("OUTPUT_TOKENS", "50"))
+        self.error_rate = float(setting("ERROR_RATE", "0"))
+        self.error_status = int(setting("ERROR_STATUS", "500"))
+        self.input_tokens_per_second = float(setting("INPUT_TOKENS_PER_SECOND", "0"))
+
+    def first_token_delay(self) -> float:
+        if self.distribution == "fixed" or self.latency <= 0:
+            return self.latency
+        if self.distribution == "uniform":
+            return max(0.0, random.uniform(self.latency * (1 - self.jitter), self.latency * (1 + self.jitter)))
+        if self.distribution == "exponential":
+            return random.expovariate(1 / self.latency)
+        # lognormal with the configured mean
+        sigma = math.sqrt(math.log(1 + self.jitter ** 2))
+        return random.lognormvariate(math.log(self.latency) - sigma ** 2 / 2, sigma)
+
+
+class _FakeCall:
+    """One simulated request: delays, token stream and injected errors."""
+
+    def __init__(self, settings: FakeSettings, prompt_chars: int, timeout: float | None,
+                 cache_read_tokens: int = 0, cache_write_tokens: int = 0):
+        self.settings = settings
+        self.input_tokens = max(1, prompt_chars // 4)  # all input, cached or not
+        self.cache_read_tokens = cache_read_tokens
+        self.cache_write_tokens = cache_write_tokens
+        self.output_tokens = settings.output_tokens
+        self.timeout = timeout
+        self._started = time.perf_counter()
+        self._spans = upstream_spans.get()
+
+    def _finish(self):
+        if self._spans is not None:
+            self._spans.append((self._started, time.perf_counter()))
+            self._spans = None
+
+    async def _sleep(self, seconds: float):
+        if self.timeout and time.perf_counter() - self._started + seconds > self.timeout:
+            await asyncio.sleep(max(0.0, self.timeout - (time.perf_counter() - self._started)))
+            self._finish()
+            raise FakeAPIError("Request timed out.", 408)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    async def start(self):
+        """Wait for the first token; may raise an injected error instead."""
+        delay = self.settings.first_token_delay()
+        if self.settings.input_tokens_per_second:
+            delay += (self.input_tokens - self.cache_read_tokens) / self.settings.input_tokens_per_second
+        try:
+            await self._sleep(delay)
+        except asyncio.CancelledError:
+            self._finish()
+            raise
+        if random.random() < self.settings.error_rate:
+            self._finish()
+            status = self.settings.error_status
+            kind = {429: "rate_limit_error", 529: "overloaded_error"}.get(status, "api_error")
+            raise FakeAPIError(f"Error code: {status} - {{'type': '{kind}', 'message': 'Injected fake error'}}",
+                               status)
+
+    async def tokens(self):
+        """Output tokens at the configured rate (the first one is due right after start())."""
+        interval = 1 / self.settings.tokens_per_second if self.settings.tokens_per_second else 0
+        try:
+            for index in range(self.output_tokens):
+                if index and interval:
+                    await self._sleep(interval)
+                yield ("" if index == 0 else " ") + _WORDS[index % len(_WORDS)]
+        finally:
+            self._finish()
+
+    async def text(self) -> str:
+        return "".join([token async for token in self.tokens()])
+
+
+def _chars(value) -> int:
+    """Rough size of a provider-format message list (dicts, SDK objects or strings)."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_chars(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_chars(item) for item in value)
+    text = getattr(value, "text", None)
+    if isinstance(text, str):
+        return len(text)
+    parts = getattr(value, "parts", None)
+    return _chars(parts) if parts else 0
+
+
+# --- OpenAI: client.chat.completions.create(...) -----------------------------------
+
+class _OpenAICompletions:
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+
+    async def create(self, model: str, messages: list, stream: bool = False, stream_options=None,
+                     timeout: float | None = None, **kwargs):
+        call = _FakeCall(self.settings, _chars(messages), timeout)
+        await call.start()
+        usage = SimpleNamespace(prompt_tokens=call.input_tokens, completion_tokens=call.output_tokens)
+        if not stream:
+            message = SimpleNamespace(role="assistant", content=await call.text())
+            return SimpleNamespace(model=model, choices=[SimpleNamespace(message=message)], usage=usage)
+        return self._chunks(call, usage if stream_options and stream_options.get("include_usage") else None)
+
+    @staticmethod
+    async def _chunks(call: _FakeCall, usage):
+        async for token in call.tokens():
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))], usage=None)
+        if usage is not None:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, provider: str = "openai"):
+        self.api_key = "fake"
+        self.chat = SimpleNamespace(completions=_OpenAICompletions(FakeSettings(provider)))
+
+
+# --- Anthropic: client.messages.create(...) / client.messages.stream(...) ----------
+
+def _invalid_request(message: str) -> FakeAPIError:
+    return FakeAPIError(f"Error code: 400 - {{'type': 'invalid_request_error', 'message': '{message}'}}", 400)
+
+
+def _anthropic_blocks(messages: list, system) -> list[tuple[str, dict]]:
+    """(role, content block) pairs in the order the cache prefix covers them: system, then messages."""
+    blocks = []
+    for role, content in [("system", system or [])] + [(msg["role"], msg["content"]) for msg in messages]:
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        blocks.extend((role, block) for block in content)
+    return blocks
+
+
+class _AnthropicPromptCache:
+    """Cached prefixes of one fake client: prefix hash -> (expires_at, TTL seconds)."""
+
+    def __init__(self):
+        self._entries: dict[bytes, tuple[float, int]] = {}
+
+    @staticmethod
+    def _ttl(control) -> int:
+        if not isinstance(control, dict) or control.get("type") != "ephemeral":
+            raise _invalid_request("cache_control.type: Input should be ephemeral")
+        ttl = control.get("ttl", "5m")
+        if ttl not in _ANTHROPIC_TTLS:
+            raise _invalid_request("cache_control.ttl: Input should be 5m or 1h")
+        return _ANTHROPIC_TTLS[ttl]
+
+    def lookup(self, model: str, messages: list, system) -> tuple[int, int, int]:
+        """Check the cache_control breakpoints; (prompt chars, tokens read from cache, tokens written)."""
+        digest = hashlib.sha256(model.encode())
+        keys, tokens, breakpoints = [], [], []
+        chars = 0
+        for index, (role, block) in enumerate(_anthropic_blocks(messages, system)):
+            plain = {key: value for key, value in block.items() if key != "cache_control"}
+            chars += len(role) + _chars(plain)
+            digest.update(json.dumps([role, plain], sort_keys=True).encode())
+            keys.append(digest.digest())
+            tokens.append(chars // 4)
+            if "cache_control" in block:
+                ttl = self._ttl(block["cache_control"])
+                if breakpoints and ttl > breakpoints[-1][1]:
+                    raise _invalid_request("A ttl=1h cache_control block must not come after a ttl=5m one")
+                breakpoints.append((index, ttl))
+        if len(breakpoints) > _ANTHROPIC_MAX_BREAKPOINTS:
+            raise _invalid_request(f"A maximum of {_ANTHROPIC_MAX_BREAKPOINTS} blocks with cache_control may "
+                                   f"be provided. Found {len(breakpoints)}.")
+
+        now = time.monotonic()
+        read = 0
+        for index, _ in breakpoints:
+            # Each breakpoint also hits entries up to 20 blocks before it
+            for candidate in range(index, max(-1, index - _ANTHROPIC_LOOKBACK), -1):
+                entry = self._entries.get(keys[candidate])
+                if entry is not None and entry[0] > now:
+                    self._entries[keys[candidate]] = (now + entry[1], entry[1])
+                    read = max(read, tokens[candidate])
+                    break
+        written = read
+        for index, ttl in breakpoints:
+            if tokens[index] >= _MIN_CACHE_TOKENS and tokens[index] > read:
+                self._entries[keys[index]] = (now + ttl, ttl)
+                written = max(written, tokens[index])
+
+        if len(self._entries) > 100_000:
+            self._entries = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+        return chars, read, written - read
+
+
+class _AnthropicStream:
+    def __init__(self, call: _FakeCall, model: str):
+        self.call = call
+        self.model = model
+        self._parts = []
+
+    async def __aenter__(self):
+        await self.call.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        async for token in self.call.tokens():
+            self._parts.append(token)
+            yield token
+
+    async def get_final_message(self):
+        return _anthropic_message(self.model, "".join(self._parts), self.call)
+
+
+def _anthropic_message(model: str, text: str, call: _FakeCall):
+    return SimpleNamespace(
+        model=model,
+        role="assistant",
+        content=[SimpleNamespace(type="text", text=text)],
+        usage=SimpleNamespace(
+            # Like the API: input_tokens leaves out what was read from or written to the cache
+            input_tokens=max(0, call.input_tokens - call.cache_read_tokens - call.cache_write_tokens),
+            output_tokens=call.output_tokens,
+            cache_read_input_tokens=call.cache_read_tokens,
+            cache_creation_input_tokens=call.cache_write_tokens,
+        ),
+    )
+
+
+class _AnthropicMessages:
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self.cache = _AnthropicPromptCache()
+
+    def _call(self, model: str, messages: list, timeout: float | None, kwargs: dict) -> _FakeCall:
+        chars, cache_read, cache_write = self.cache.lookup(model, messages, kwargs.get("system"))
+        return _FakeCall(self.settings, chars, timeout, cache_read, cache_write)
+
+    async def create(self, model: str, messages: list, timeout: float | None = None, **kwargs):
+        call = self._call(model, messages, timeout, kwargs)
+        await call.start()
+        return _anthropic_message(model, await call.text(), call)
+
+    def stream(self, model: str, messages: list, timeout: float | None = None, **kwargs):
+        return _AnthropicStream(self._call(model, messages, timeout, kwargs), model)
+
+
+class FakeAsyncAnthropic:
+    def __init__(self, provider: str = "claude"):
+        self.api_key = "fake"
+        self.messages = _AnthropicMessages(FakeSettings(provider))
+
+
+# --- Gemini: client.aio.models.generate_content(...) / generate_content_stream(...),
+#     client.aio.caches.create/get/update/delete(...) ---------------------------------
+
+def _config_field(config, name: str):
+    """A field of an SDK config given as a pydantic object or a plain dict."""
+    return config.get(name) if isinstance(config, dict) else getattr(config, name, None)
+
+
+def _gemini_usage(call: _FakeCall):
+    return SimpleNamespace(prompt_token_count=call.input_tokens, candidates_token_count=call.output_tokens,
+                           cached_content_token_count=call.cache_read_tokens or None)
+
+
+class _GeminiCaches:
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self._caches: dict[str, SimpleNamespace] = {}
+        self._created = 0
+
+    @staticmethod
+    def _ttl(config) -> timedelta:
+        ttl = _config_field(config, "ttl") or "3600s"  # the API's default
+        if not isinstance(ttl, str) or not ttl.endswith("s"):
+            raise FakeAPIError("400 INVALID_ARGUMENT. ttl must be a duration in seconds, e.g. '600s'", 400)
+        return timedelta(seconds=float(ttl[:-1]))
+
+    def lookup(self, name: str) -> SimpleNamespace:
+        cache = self._caches.get(name)
+        if cache is not None and cache.expire_time <= datetime.now(timezone.utc):
+            del self._caches[name]
+            cache = None
+        if cache is None:
+            raise FakeAPIError("403 PERMISSION_DENIED. CachedContent not found (or permission denied)", 403)
+        return cache
+
+    async def create(self, model: str, config=None):
+        contents = _config_field(config, "contents") or []
+        tokens = _chars(contents) // 4
+        if tokens < _MIN_CACHE_TOKENS:
+            raise FakeAPIError(f"400 INVALID_ARGUMENT. Cached content is too small. total_token_count={tokens}, "
+                               f"min_total_token_count={_MIN_CACHE_TOKENS}", 400)
+        call = _FakeCall(self.settings, tokens * 4, None)
+        await call.start()
+        call._finish()
+        self._created += 1
+        now = datetime.now(timezone.utc)
+        cache = SimpleNamespace(
+            name=f"cachedContents/fake-{self._created}", model=model, create_time=now, update_time=now,
+            expire_time=now + self._ttl(config), usage_metadata=SimpleNamespace(total_token_count=tokens),
+        )
+        self._caches[cache.name] = cache
+        return cache
+
+    async def get(self, name: str, config=None):
+        return self.lookup(name)
+
+    async def update(self, name: str, config=None):
+        cache = self.lookup(name)
+        cache.update_time = datetime.now(timezone.utc)
+        cache.expire_time = cache.update_time + self._ttl(config)
+        return cache
+
+    async def delete(self, name: str, config=None):
+        self.lookup(name)
+        del self._caches[name]
+        return SimpleNamespace()
+
+    def __len__(self):
+        return len(self._caches)
+
+
+class _GeminiModels:
+    def __init__(self, settings: FakeSettings, caches: _GeminiCaches):
+        self.settings = settings
+        self.caches = caches
+
+    @staticmethod
+    def _timeout(config) -> float | None:
+        http_options = getattr(config, "http_options", None)
+        timeout_ms = getattr(http_options, "timeout", None)
+        return timeout_ms / 1000 if timeout_ms else None
+
+    def _call(self, model: str, contents: list, config) -> _FakeCall:
+        cached_tokens = 0
+        name = _config_field(config, "cached_content")
+        if name:
+            cache = self.caches.lookup(name)
+            if cache.model != model:
+                raise FakeAPIError(f"400 INVALID_ARGUMENT. Model used by GenerateContent request ({model}) and "
+                                   f"CachedContent ({cache.model}) has to be the same.", 400)
+            cached_tokens = cache.usage_metadata.total_token_count
+        return _FakeCall(self.settings, _chars(contents) + cached_tokens * 4, self._timeout(config), cached_tokens)
+
+    async def generate_content(self, model: str, contents: list, config=None):
+        call = self._call(model, contents, config)
+        await call.start()
+        return SimpleNamespace(text=await call.text(), usage_metadata=_gemini_usage(call))
+
+    async def generate_content_stream(self, model: str, contents: list, config=None):
+        call = self._call(model, contents, config)
+        await call.start()
+        return self._chunks(call)
+
+    @staticmethod
+    async def _chunks(call: _FakeCall):
+        async for token in call.tokens():
+            yield SimpleNamespace(text=token, usage_metadata=_gemini_usage(call))
+
+
+class FakeGeminiClient:
+    def __init__(self, provider: str = "gemini"):
+        settings = FakeSettings(provider)
+        caches = _GeminiCaches(settings)
+        self.aio = SimpleNamespace(models=_GeminiModels(settings, caches), caches=caches)
@@ -1,35 +1,130 @@
+import logging
 import os
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
-from backend.conversation_store import get_history, add_message
+from backend.async_store import add_message
+from backend.conversation_store import estimate_tokens
+from app.llm_clients import fake_providers
+from app.utils.context_window import budget_from_env, build_context
+from app.utils.conversion_cache import ConversionCache
+from app.utils.metrics import record_tokens
+from app.utils.prompt_cache import GeminiContextCache
+from app.utils.provider_health import tracked
+from app.utils.rate_limiter import ProviderBusy, limited
+from app.utils.response_cache import cached_completion
+from app.utils.streaming import CONTINUE_PROMPT
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+PROVIDER = "gemini"
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 
-client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
+if fake_providers.enabled(PROVIDER):
+    client = fake_providers.FakeGeminiClient(PROVIDER)
+else:
+    client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
+
+# Generation parameters sent with every request (part of the response cache key)
+GENERATION_PARAMS = {}
+
+# Token budget for conversation history in each request
+CONTEXT_BUDGET = budget_from_env("GEMINI_CONTEXT_BUDGET")
+
+
+def _to_content(role: str, text: str) -> types.Content:
+    """Convert one internal message to Gemini's Content format."""
+    # Gemini uses "model" instead of "assistant"
+    return types.Content(
+        role="model" if role == "assistant" else role,
+        parts=[types.Part.from_text(text=text)]
+    )
+
 
+# Content objects, reused across turns of the same conversation
+converter = ConversionCache(_to_content)
 
-def _build_contents(messages: list[dict]) -> list[types.Content]:
+
+def _build_contents(messages: list[dict], conversation_id: str | None = None) -> list[types.Content]:
     """Convert internal message format to Gemini's Content format."""
-    contents = []
-    for msg in messages:
-        if not isinstance(msg.get("content"), str) or not msg.get("content"):
-            continue
-        # Gemini uses "model" instead of "assistant"
-        role = "model" if msg["role"] == "assistant" else msg["role"]
-        contents.append(
-            types.Content(
-                role=role,
-                parts=[types.Part.from_text(text=msg["content"])]
-            )
+    return converter.convert(messages, conversation_id)
+
+
+# Cached contents holding the history of long conversations
+prompt_cache = GeminiContextCache(PROVIDER, client)
+
+
+def _prepare(model: str, messages: list[dict], conversation_id: str | None,
+             tail: int = 1) -> tuple[list[types.Content], str | None]:
+    """
+    (contents, cached content name or None): with a cache, contents are only
+    the messages after the cached history. The last `tail` messages are never cached.
+    """
+    contents = _build_contents(messages, conversation_id)
+    history_tokens = sum(estimate_tokens(msg["content"]) for msg in messages[:-tail]
+                         if isinstance(msg.get("content"), str))
+    return prompt_cache.prepare(model, contents, len(contents) - tail, history_tokens, conversation_id)
+
+
+def _cache_missing(e: Exception) -> bool:
+    """Whether a call failed because its cached content is gone (expired or deleted)."""
+    return (getattr(e, "code", None) or getattr(e, "status_code", None)) in (403, 404)
+
+
+def _record_usage(model: str, usage_metadata):
+    cached = usage_metadata.cached_content_token_count
+    record_tokens(PROVIDER, model, usage_metadata.prompt_token_count, usage_metadata.candidates_token_count, cached)
+    prompt_cache.observe(usage_metadata.prompt_token_count, cached, 0)
+
+
+@limited(PROVIDER)
+@tracked(PROVIDER)
+async def _complete(model: str, contents: list[types.Content], timeout: float | None = None,
+                    cached_content: str | None = None) -> str:
+    """Single upstream call. Raises on API errors (and after `timeout` seconds, if given)."""
+    config = None
+    if timeout or cached_content:
+        config = types.GenerateContentConfig(
+            cached_content=cached_content,
+            http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
         )
-    return contents
+    response = await client.aio.models.generate_content(
+        model=model,
+        contents=contents,
+        config=config
+    )
+    if response.usage_metadata:
+        _record_usage(model, response.usage_metadata)
+    return response.text
+
+
+async def _generate(model: str, messages: list[dict], conversation_id: str | None = None,
+                    timeout: float | None = None) -> str:
+    """_complete, with the history served from the conversation's context cache when it has one."""
+    contents, cached_content = _prepare(model, messages, conversation_id)
+    if cached_content is None:
+        return await _complete(model, contents, timeout)
+    try:
+        return await _complete(model, contents, timeout, cached_content)
+    except Exception as e:
+        if not _cache_missing(e):
+            raise
+        logger.warning("Gemini context cache unavailable, resending the whole history: %r", e)
+        prompt_cache.forget(conversation_id)
+        return await _complete(model, _build_contents(messages, conversation_id), timeout)
+
+
+async def summarize(text: str) -> str:
+    """One-shot completion used to maintain rolling conversation summaries. Raises on API errors."""
+    return await _complete(DEFAULT_MODEL, _build_contents([{"role": "user", "content": text}]))
 
 
-async def ask_gemini(prompt: str, conversation_id: str | None = None, model: str = DEFAULT_MODEL) -> str:
+async def ask_gemini(prompt: str, conversation_id: str | None = None, model: str = DEFAULT_MODEL,
+                     use_cache: bool = True) -> str:
     if not prompt:
         return "Prompt was empty."
 
@@ -39,54 +134,114 @@ async def ask_gemini(prompt: str, conversation_id: str | None = None, model: str
     # Build messages list with history
     messages = []
     if conversation_id:
-        messages = get_history(conversation_id)
+        messages = await build_context(conversation_id, prompt, CONTEXT_BUDGET, summarize)
     messages.append({"role": "user", "content": prompt})
 
-    contents = _build_contents(messages)
-
     try:
-        response = await client.aio.models.generate_content(
-            model=model,
-            contents=contents
+        # Conversion happens inside fetch, so cache hits skip it
+        answer = await cached_completion(
+            model, GENERATION_PARAMS, messages,
+            lambda: _generate(model, messages, conversation_id), use_cache
         )
 
-        answer = response.text
-
         if not answer:
             answer = "Gemini did not return any text content."
 
         # Save messages to conversation store
         if conversation_id:
-            add_message(conversation_id, "user", prompt)
-            add_message(conversation_id, "assistant", answer, model=model)
+            await add_message(conversation_id, "user", prompt)
+            await add_message(conversation_id, "assistant", answer, model=model)
 
         return answer
 
     except Exception as e:
-        error_str = repr(e)
-        print("Error calling Gemini:", error_str)
+        return friendly_error(e)
+
+
+def friendly_error(e: Exception) -> str:
+    """Log a Gemini error and turn it into a message we can show the user."""
+    error_str = repr(e)
+    print("Error calling Gemini:", error_str)
 
-        if "API_KEY_INVALID" in error_str or "invalid" in error_str.lower() and "key" in error_str.lower():
-            return "Gemini is not available right now (invalid or missing API key)."
+    if isinstance(e, ProviderBusy):
+        return "Gemini is busy right now. Please try again in a moment."
 
-        return "Gemini is currently unavailable due to an internal error."
+    if "API_KEY_INVALID" in error_str or "not configured" in error_str or \
+            "invalid" in error_str.lower() and "key" in error_str.lower():
+        return "Gemini is not available right now (invalid or missing API key)."
 
+    return "Gemini is currently unavailable due to an internal error."
+
+
+async def complete_chat(message: str, history: list, model: str = DEFAULT_MODEL, use_cache: bool = True,
+                        conversation_id: str | None = None, timeout: float | None = None) -> str:
+    """Like chat(), but raises on API errors (used for failover)."""
+    if not client:
+        raise RuntimeError("Gemini API key not configured.")
 
-async def chat(message: str, history: list, model: str = DEFAULT_MODEL) -> str:
+    messages = history + [{"role": "user", "content": message}]
+    answer = await cached_completion(
+        model, GENERATION_PARAMS, messages,
+        lambda: _generate(model, messages, conversation_id, timeout), use_cache, timeout
+    )
+    return answer or "Gemini did not return any text content."
+
+
+async def chat(message: str, history: list, model: str = DEFAULT_MODEL, use_cache: bool = True,
+               conversation_id: str | None = None, timeout: float | None = None) -> str:
     """Simpler interface for comparison mode."""
     if not client:
         return "Gemini API key not configured."
 
+    try:
+        return await complete_chat(message, history, model, use_cache, conversation_id, timeout)
+    except Exception as e:
+        error_str = repr(e)
+        print("Error calling Gemini:", error_str)
+        return "Gemini error"
+
+
+async def stream_chat(message: str, history: list, model: str = DEFAULT_MODEL, usage: dict | None = None,
+                      conversation_id: str | None = None, prefill: str | None = None):
+    """
+    Stream the answer as text deltas.
+    Errors are raised to the caller; token counts are written into `usage` when given.
+    With `prefill` (a partial answer), the model is asked to continue it and only the rest is streamed.
+    """
+    if not client:
+        raise RuntimeError("Gemini API key not configured.")
+
     messages = history + [{"role": "user", "content": message}]
-    contents = _build_contents(messages)
+    if prefill:
+        messages += [{"role": "assistant", "content": prefill}, {"role": "user", "content": CONTINUE_PROMPT}]
+    contents, cached_content = _prepare(model, messages, conversation_id, tail=3 if prefill else 1)
 
     try:
-        response = await client.aio.models.generate_content(
+        stream = await client.aio.models.generate_content_stream(
             model=model,
-            contents=contents
+            contents=contents,
+            config=types.GenerateContentConfig(cached_content=cached_content) if cached_content else None
         )
-        return response.text or "Gemini did not return any text content."
     except Exception as e:
-        error_str = repr(e)
-        print("Error calling Gemini:", error_str)
-        return "Gemini error"
+        if cached_content is None or not _cache_missing(e):
+            raise
+        logger.warning("Gemini context cache unavailable, resending the whole history: %r", e)
+        prompt_cache.forget(conversation_id)
+        stream = await client.aio.models.generate_content_stream(
+            model=model,
+            contents=_build_contents(messages, conversation_id)
+        )
+
+    usage_metadata = None
+    async for chunk in stream:
+        # Usage metadata is cumulative, so the last chunk wins
+        if chunk.usage_metadata:
+            usage_metadata = chunk.usage_metadata
+            if usage is not None:
+                usage["input_tokens"] = usage_metadata.prompt_token_count
+                usage["output_tokens"] = usage_metadata.candidates_token_count
+                usage["cache_read_tokens"] = usage_metadata.cached_content_token_count
+        if chunk.text:
+            yield chunk.text
+    if usage_metadata is not None:
+        prompt_cache.observe(usage_metadata.prompt_token_count, usage_metadata.cached_content_token_count, 0)
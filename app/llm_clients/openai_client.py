@@ -1,25 +1,71 @@
 from openai import AsyncOpenAI
 import os
 from dotenv import load_dotenv
-from backend.conversation_store import get_history, add_message
+from backend.async_store import add_message
+from app.llm_clients import fake_providers
+from app.utils.context_window import budget_from_env, build_context
+from app.utils.metrics import record_tokens
+from app.utils.provider_health import tracked
+from app.utils.rate_limiter import ProviderBusy, limited
+from app.utils.response_cache import cached_completion
+from app.utils.streaming import CONTINUE_PROMPT
 
 # Load variables from .env
 load_dotenv()
 
-# Create a single OpenAI client instance
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+PROVIDER = "openai"
+
+# Create a single OpenAI client instance (a local fake when FAKE_PROVIDERS selects it)
+if fake_providers.enabled(PROVIDER):
+    client = fake_providers.FakeAsyncOpenAI(PROVIDER)
+else:
+    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # Use OPENAI_MODEL env var if set, otherwise default to gpt-4.1-mini
 DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 
+# Generation parameters sent with every request (part of the response cache key)
+GENERATION_PARAMS = {}
+
+# Token budget for conversation history in each request
+CONTEXT_BUDGET = budget_from_env("OPENAI_CONTEXT_BUDGET")
+
+
+@limited(PROVIDER)
+@tracked(PROVIDER)
+async def _complete(model: str, messages: list[dict], timeout: float | None = None) -> str:
+    """Single upstream call. Raises on API errors (and after `timeout` seconds, if given)."""
+    completion = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        **GENERATION_PARAMS,
+        **({"timeout": timeout} if timeout else {})
+    )
+    if completion.usage:
+        record_tokens(PROVIDER, model, completion.usage.prompt_tokens, completion.usage.completion_tokens,
+                      _cached_tokens(completion.usage))
+    return completion.choices[0].message.content
+
 
-async def ask_openai(prompt: str, conversation_id: str | None = None, model: str = DEFAULT_MODEL) -> str:
+def _cached_tokens(usage) -> int | None:
+    """Prompt tokens OpenAI served from its automatic prompt cache (prefixes of 1024+ tokens)."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None)
+
+
+async def summarize(text: str) -> str:
+    """One-shot completion used to maintain rolling conversation summaries. Raises on API errors."""
+    return await _complete(DEFAULT_MODEL, [{"role": "user", "content": text}])
+
+
+async def ask_openai(prompt: str, conversation_id: str | None = None, model: str = DEFAULT_MODEL,
+                     use_cache: bool = True) -> str:
     # Build messages list with history
     messages = []
 
-    # Add historical messages
+    # Add as much recent history as fits the context budget
     if conversation_id:
-        history = get_history(conversation_id)
+        history = await build_context(conversation_id, prompt, CONTEXT_BUDGET, summarize)
         for msg in history:
             messages.append(msg)
 
@@ -27,49 +73,85 @@ async def ask_openai(prompt: str, conversation_id: str | None = None, model: str
     messages.append({"role": "user", "content": prompt})
 
     try:
-        completion = await client.chat.completions.create(
-            model=model,
-            messages=messages
+        answer = await cached_completion(
+            model, GENERATION_PARAMS, messages, lambda: _complete(model, messages), use_cache
         )
 
-        answer = completion.choices[0].message.content
-
         # Save messages back into memory store
         if conversation_id:
-            add_message(conversation_id, "user", prompt)
-            add_message(conversation_id, "assistant", answer, model=model)
+            await add_message(conversation_id, "user", prompt)
+            await add_message(conversation_id, "assistant", answer, model=model)
 
         return answer
 
     except Exception as e:
-        # Log full error for debugging
-        error_str = repr(e)
-        print("Error calling OpenAI:", error_str)
+        return friendly_error(e)
 
-        # Handle common cases with friendly messages
-        if "invalid_api_key" in error_str or "Incorrect API key" in error_str:
-            return "OpenAI is not available right now (invalid or missing API key)."
 
-        if "insufficient_quota" in error_str or "You exceeded your current quota" in error_str:
-            return "OpenAI is not available right now (insufficient quota on the backend)."
+def friendly_error(e: Exception) -> str:
+    """Log an OpenAI error and turn it into a message we can show the user."""
+    # Log full error for debugging
+    error_str = repr(e)
+    print("Error calling OpenAI:", error_str)
 
-        # Fallback generic message
-        return "OpenAI is currently unavailable due to an internal error."
+    if isinstance(e, ProviderBusy):
+        return "OpenAI is busy right now. Please try again in a moment."
 
+    # Handle common cases with friendly messages
+    if "invalid_api_key" in error_str or "Incorrect API key" in error_str:
+        return "OpenAI is not available right now (invalid or missing API key)."
 
-async def chat(message: str, history: list, model: str = DEFAULT_MODEL) -> str:
-    """Simpler interface for comparison mode."""
+    if "insufficient_quota" in error_str or "You exceeded your current quota" in error_str:
+        return "OpenAI is not available right now (insufficient quota on the backend)."
+
+    # Fallback generic message
+    return "OpenAI is currently unavailable due to an internal error."
+
+
+async def complete_chat(message: str, history: list, model: str = DEFAULT_MODEL, use_cache: bool = True,
+                        conversation_id: str | None = None, timeout: float | None = None) -> str:
+    """Like chat(), but raises on API errors (used for failover)."""
     messages = history + [{"role": "user", "content": message}]
+    return await cached_completion(
+        model, GENERATION_PARAMS, messages, lambda: _complete(model, messages, timeout), use_cache, timeout
+    )
+
 
+async def chat(message: str, history: list, model: str = DEFAULT_MODEL, use_cache: bool = True,
+               conversation_id: str | None = None, timeout: float | None = None) -> str:
+    """Simpler interface for comparison mode."""
     try:
-        completion = await client.chat.completions.create(
-            model=model,
-            messages=messages
-        )
-        return completion.choices[0].message.content
+        return await complete_chat(message, history, model, use_cache, conversation_id, timeout)
     except Exception as e:
         error_str = repr(e)
         print("Error calling OpenAI:", error_str)
         return "OpenAI error"
 
 
+async def stream_chat(message: str, history: list, model: str = DEFAULT_MODEL, usage: dict | None = None,
+                      conversation_id: str | None = None, prefill: str | None = None):
+    """
+    Stream the answer as text deltas.
+    Errors are raised to the caller; token counts are written into `usage` when given.
+    With `prefill` (a partial answer), the model is asked to continue it and only the rest is streamed.
+    """
+    messages = history + [{"role": "user", "content": message}]
+    if prefill:
+        # No native prefill: show the partial reply and ask for the rest
+        messages += [{"role": "assistant", "content": prefill}, {"role": "user", "content": CONTINUE_PROMPT}]
+
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **GENERATION_PARAMS
+    )
+    async for chunk in stream:
+        # The last chunk carries usage and no choices
+        if chunk.usage and usage is not None:
+            usage["input_tokens"] = chunk.usage.prompt_tokens
+            usage["output_tokens"] = chunk.usage.completion_tokens
+            usage["cache_read_tokens"] = _cached_tokens(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
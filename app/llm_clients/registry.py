@@ -0,0 +1,111 @@
+import os
+
+from dotenv import load_dotenv
+
+from app.llm_clients import openai_client, claude_client, gemini_client
+
+load_dotenv()
+
+# Logical model names that fail over between providers, in preference order, e.g.
+# MODEL_FALLBACKS="fast=gpt-4.1-nano,gemini-2.0-flash;smart=claude-3-5-sonnet-latest,gpt-4.1"
+# "auto" is always defined: every configured provider's default model, fastest first.
+MODEL_FALLBACKS = os.getenv("MODEL_FALLBACKS", "")
+AUTO_MODEL = "auto"
+
+
+def parse_fallbacks(spec: str) -> dict[str, list[str]]:
+    chains = {}
+    for entry in spec.split(";"):
+        name, _, models = entry.partition("=")
+        models = [model.strip() for model in models.split(",") if model.strip()]
+        if name.strip() and models:
+            chains[name.strip().lower()] = models
+    return chains
+
+
+class Adapter:
+    """One provider: its client module, default model and the names that route to it."""
+
+    def __init__(self, client, default_model: str, ask, configured, aliases: tuple = (), families: tuple = ()):
+        self.name = client.PROVIDER
+        self.client = client  # module with chat(), complete_chat(), stream_chat(), friendly_error(), ...
+        self.default_model = default_model
+        self.ask = ask        # ask_<provider>(prompt, conversation_id, model=..., use_cache=...)
+        self.configured = configured  # () -> bool: has credentials
+        self.aliases = aliases
+        self.families = families
+
+
+class ProviderRegistry:
+    """
+    Model name -> adapter lookup.
+
+    Generic aliases ("gpt", "claude") that name a provider rather than a model
+    map to the provider's default model. Any other name, including concrete
+    ones like "gpt-4.1", is routed by its family, the part before the first
+    "-" ("claude-3-5-sonnet-20241022" -> "claude"), and sent upstream as-is.
+    Both are plain dict lookups.
+    """
+
+    def __init__(self, fallbacks: dict[str, list[str]] | None = None):
+        self.adapters: dict[str, Adapter] = {}
+        self._aliases: dict[str, Adapter] = {}
+        self._families: dict[str, Adapter] = {}
+        self.fallbacks = fallbacks or {}
+
+    def register(self, adapter: Adapter):
+        self.adapters[adapter.name] = adapter
+        for alias in adapter.aliases:
+            self._aliases[alias] = adapter
+        for family in adapter.families:
+            self._families[family] = adapter
+
+    def resolve(self, model_name: str):
+        """(adapter, concrete model) for a model name or alias, or (None, None)."""
+        name = model_name.lower()
+
+        adapter = self._aliases.get(name)
+        if adapter is not None:
+            return adapter, adapter.default_model
+
+        adapter = self._families.get(name.split("-", 1)[0])
+        if adapter is not None:
+            return adapter, model_name
+        return None, None
+
+    def candidates(self, model_name: str) -> list[tuple[Adapter, str]] | None:
+        """
+        (adapter, model) pairs behind a logical model name ("auto" or a fallback
+        chain), in preference order; None if the name is not a logical model.
+        """
+        name = model_name.lower()
+        if name == AUTO_MODEL:
+            return [(adapter, adapter.default_model) for adapter in self.adapters.values() if adapter.configured()]
+
+        chain = self.fallbacks.get(name)
+        if chain is None:
+            return None
+        resolved = [self.resolve(model) for model in chain]
+        return [(adapter, model) for adapter, model in resolved if adapter is not None and adapter.configured()]
+
+
+registry = ProviderRegistry(parse_fallbacks(MODEL_FALLBACKS))
+
+registry.register(Adapter(
+    openai_client, openai_client.DEFAULT_MODEL, openai_client.ask_openai,
+    configured=lambda: bool(openai_client.client.api_key),
+    aliases=("openai", "gpt"),
+    families=("gpt", "chatgpt", "o1", "o3", "o4"),
+))
+registry.register(Adapter(
+    claude_client, claude_client.CLAUDE_MODEL, claude_client.ask_claude,
+    configured=lambda: bool(claude_client.ANTHROPIC_API_KEY),
+    aliases=("claude", "claude-3", "claude-3-5"),
+    families=("claude",),
+))
+registry.register(Adapter(
+    gemini_client, gemini_client.DEFAULT_MODEL, gemini_client.ask_gemini,
+    configured=lambda: gemini_client.client is not None,
+    aliases=("gemini", "gemini-2"),
+    families=("gemini",),
+))
@@ -1,19 +1,329 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from app.llm_clients.registry import registry
+from app.utils.router import continue_stream, stream_to_model
+from backend import async_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAX_BUFFER_CHARS = int(os.getenv("RELAY_BUFFER_MAX_CHARS", "262144"))  # streamed text kept in memory per task
+PERSIST_INTERVAL = float(os.getenv("RELAY_PERSIST_INTERVAL", "1"))  # seconds between saves of new text
+MAX_TASKS = int(os.getenv("RELAY_MAX_TASKS", "1000"))  # finished tasks kept in memory
+TASK_TTL = float(os.getenv("RELAY_TASK_TTL", "600"))  # seconds a finished task can still be replayed
+# What a client disconnect does to a generation nobody else is reading:
+# "continue" finishes it so a reconnect can pick up the answer, "pause" stops the upstream call.
+ON_DISCONNECT = os.getenv("RELAY_ON_DISCONNECT", "continue")
+
+RUNNING, PAUSED, DONE, ERROR = "running", "paused", "done", "error"
+
+
+class Generation:
+    """
+    One streamed answer. The upstream call runs in its own task and appends to
+    a buffer; clients read from any offset and wait for more, so a client that
+    disconnects doesn't stop (or waste) the generation.
+
+    The in-memory buffer keeps the last MAX_BUFFER_CHARS; new text is saved every
+    PERSIST_INTERVAL seconds, and older offsets are read back from the database.
+    """
+
+    def __init__(self, task_id: str, model_name: str, prompt: str, conversation_id: str | None,
+                 use_cache: bool = True, hedge: bool | None = None, status: str = RUNNING, text: str = ""):
+        self.task_id = task_id
+        self.model_name = model_name
+        self.prompt = prompt
+        self.conversation_id = conversation_id
+        self.use_cache = use_cache
+        self.hedge = hedge
+
+        self.status = status
+        self.error = None
+        self.usage = {}
+        self.response = None  # the whole answer, once done
+        self.route = {}  # {"adapter", "model"} once the upstream is chosen
+        self.finished_at = None
+        self.subscribers = 0
+
+        # Buffer as chunks with their start offsets; chunks before `base` have been dropped
+        self._chunks = [text] if text else []
+        self._starts = [0] if text else []
+        self.base = 0
+        self.length = len(text)
+        self._persisted = len(text)
+        self._saved = bool(text)  # has a database row
+        self._persisted_at = time.monotonic()
+        self._persist_lock = asyncio.Lock()
+        self._persisting = None
+        self._changed = asyncio.Event()
+        self._task = None
+
+    def info(self) -> dict:
+        adapter = self.route.get("adapter")
+        return {
+            "task_id": self.task_id,
+            "status": self.status,
+            "model": self.model_name,
+            "provider": adapter.name if adapter else None,
+            "concrete_model": self.route.get("model"),
+            "conversation_id": self.conversation_id,
+            "length": self.length,
+            "error": self.error,
+        }
+
+    def start(self, events):
+        """Run an event stream (stream_to_model / continue_stream) into this generation."""
+        self.status = RUNNING
+        self.finished_at = None
+        self._task = asyncio.create_task(self._run(events))
+        self._task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        # A resume may already have started the next task; only the current one's end counts
+        if task is self._task and self.status == RUNNING:
+            # Cancelled before it got to run
+            self.status = PAUSED
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def pause(self):
+        """Stop the upstream call, keeping what was generated for resume()."""
+        if self.status == RUNNING and self._task is not None:
+            self._task.cancel()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _append(self, text: str):
+        if not text:
+            return
+        self._chunks.append(text)
+        self._starts.append(self.length)
+        self.length += len(text)
+
+        # Drop the oldest saved chunks once well over the limit; reads before `base` go to the database
+        if self.length - self.base > MAX_BUFFER_CHARS * 1.25:
+            drop = 0
+            while drop < len(self._chunks) - 1 and self.length - self._starts[drop + 1] > MAX_BUFFER_CHARS \
+                    and self._starts[drop + 1] <= self._persisted:
+                drop += 1
+            if drop:
+                del self._chunks[:drop], self._starts[:drop]
+                self.base = self._starts[0]
+
+        self._notify()
+        if time.monotonic() - self._persisted_at >= PERSIST_INTERVAL and self._persisting is None:
+            self._persisting = asyncio.create_task(self.persist())
+
+    def text_since(self, offset: int) -> str:
+        """Buffered text from `offset` (>= base) to the end."""
+        if offset >= self.length:
+            return ""
+        index = bisect_right(self._starts, offset) - 1
+        first = self._chunks[index][offset - self._starts[index]:]
+        return first + "".join(self._chunks[index + 1:])
+
+    async def text(self, offset: int = 0) -> str:
+        """Text from `offset` to the end, reading back dropped text from the database."""
+        if offset >= self.base:
+            return self.text_since(offset)
+        await self.persist()
+        end = self.length
+        row = await async_store.get_generation(self.task_id)
+        saved = row["text"] if row else ""
+        return saved[offset:self.base] + self.text_since(self.base)[:end - self.base]
+
+    async def persist(self):
+        """Save text generated since the last save, with the current status."""
+        async with self._persist_lock:
+            end = self.length
+            text = self.text_since(self._persisted)
+            adapter = self.route.get("adapter")
+            row = {
+                "task_id": self.task_id,
+                "conversation_id": self.conversation_id,
+                "model": self.model_name,
+                "prompt": self.prompt,
+                "status": self.status,
+                "provider": adapter.name if adapter else None,
+                "concrete_model": self.route.get("model"),
+                "error": self.error,
+            }
+            try:
+                await async_store.append_generation(row, text)
+            except Exception as e:
+                logger.error("Error saving generation %s: %r", self.task_id, e)
+                return
+            finally:
+                self._persisting = None
+            self._saved = True
+            self._persisted = end
+            self._persisted_at = time.monotonic()
+
+    async def _run(self, events):
+        try:
+            async for event in events:
+                if event["type"] == "delta":
+                    self._append(event["text"])
+                elif event["type"] == "done":
+                    self.status = DONE
+                    self.response = event.get("response")
+                    self.usage = event.get("usage") or {}
+                    self.route.setdefault("model", event.get("model"))
+                elif event["type"] == "error":
+                    self.status = ERROR
+                    self.error = event["error"]
+        except asyncio.CancelledError:
+            self.status = PAUSED
+        except Exception as e:
+            logger.error("Error in generation %s: %r", self.task_id, e)
+            self.status = ERROR
+            self.error = "Generation failed."
+        finally:
+            if self.status == RUNNING:
+                self.status = ERROR
+                self.error = "Generation ended without an answer."
+            self.finished_at = time.monotonic()
+            self._notify()
+            # A finished answer is in the conversation; only save it if part of it already was
+            if self.status != DONE or self._saved:
+                await asyncio.shield(self.persist())
+
+    async def events(self, offset: int = 0):
+        """
+        Events from `offset` on: {"type": "delta", "text", "offset"} with the text
+        generated so far, then live deltas, then one of "done", "error" or
+        "paused". "offset" is the end of the delta; reconnect with it to continue.
+        """
+        self.subscribers += 1
+        try:
+            offset = max(0, min(offset, self.length))
+            while True:
+                changed = self._changed
+                if offset < self.length:
+                    text = await self.text(offset)
+                    if not text:
+                        # Dropped from memory and not in the database: skip to what we still have
+                        offset = self.base
+                        continue
+                    offset += len(text)
+                    yield {"type": "delta", "text": text, "offset": offset}
+                    continue
+                if self.status == RUNNING:
+                    await changed.wait()
+                    continue
+
+                if self.status == DONE:
+                    response = self.response if self.response is not None else await self.text(0)
+                    yield {"type": "done", "task_id": self.task_id, "model": self.route.get("model"),
+                           "response": response, "usage": self.usage}
+                elif self.status == ERROR:
+                    yield {"type": "error", "task_id": self.task_id, "error": self.error}
+                else:
+                    yield {"type": "paused", "task_id": self.task_id, "offset": self.length}
+                return
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and ON_DISCONNECT == "pause":
+                self.pause()
+
+
 class RelayManager:
+    """
+    Registry of streamed generations by task id. Running generations stay until
+    they finish; finished ones are kept for replay for TASK_TTL seconds (at most
+    MAX_TASKS of them), and paused ones can be resumed from the database even
+    after a restart.
+    """
+
     def __init__(self):
-        self.paused = False
-        self.active_task = None
-        self.buffer = ""
+        self._tasks: OrderedDict[str, Generation] = OrderedDict()
+        self._background: set[asyncio.Task] = set()
 
-    def start_task(self, task_id):
-        self.active_task = task_id
-        self.buffer = ""
-        self.paused = False
+    async def start(self, model_name: str, prompt: str, conversation_id: str | None, use_cache: bool = True,
+                    hedge: bool | None = None) -> Generation:
+        self._evict()
+        generation = Generation(str(uuid.uuid4()), model_name, prompt, conversation_id, use_cache, hedge)
+        self._tasks[generation.task_id] = generation
+        generation.start(stream_to_model(model_name, prompt, conversation_id, use_cache, hedge,
+                                         route=generation.route))
+        return generation
 
-    def pause(self):
-        self.paused = True
+    async def get(self, task_id: str) -> Generation | None:
+        """A generation from memory, or reloaded from the database (a running one counts as paused there)."""
+        generation = self._tasks.get(task_id)
+        if generation is not None:
+            return generation
+
+        row = await async_store.get_generation(task_id)
+        if row is None:
+            return None
+        status = PAUSED if row["status"] == RUNNING else row["status"]
+        generation = Generation(task_id, row["model"], row["prompt"], row["conversation_id"], status=status,
+                                text=row["text"])
+        generation.error = row["error"]
+        generation.finished_at = time.monotonic()
+        generation._saved = True
+        adapter = registry.adapters.get(row["provider"])
+        if adapter is not None:
+            generation.route.update(adapter=adapter, model=row["concrete_model"])
+        self._tasks[task_id] = generation
+        return generation
+
+    async def resume(self, generation: Generation):
+        """
+        Continue a paused generation. The text so far is sent to the same model
+        as the start of its answer (assistant prefill), so nothing is regenerated.
+        """
+        if generation.status != PAUSED:
+            return
+        adapter, model = generation.route.get("adapter"), generation.route.get("model")
+        if not generation.length or adapter is None:
+            # Paused before any output: just start over
+            generation.start(stream_to_model(generation.model_name, generation.prompt, generation.conversation_id,
+                                             generation.use_cache, generation.hedge, route=generation.route))
+            return
+        # Claim it before awaiting, so an overlapping resume() sees it running and just reconnects
+        generation.status = RUNNING
+        try:
+            prefill = await generation.text(0)
+        except BaseException:
+            generation.status = PAUSED
+            raise
+        generation.start(continue_stream(adapter, model, generation.prompt, generation.conversation_id, prefill))
+
+    def _evict(self):
+        now = time.monotonic()
+        finished = [generation for generation in self._tasks.values() if generation.status != RUNNING]
+        excess = len(self._tasks) - MAX_TASKS
+        for generation in finished:
+            if excess <= 0 and now - generation.finished_at < TASK_TTL:
+                continue
+            excess -= 1
+            del self._tasks[generation.task_id]
+            if generation.status in (DONE, ERROR) and generation._saved and not generation.subscribers:
+                # Its answer is in the conversation; paused ones stay resumable
+                task = asyncio.create_task(async_store.delete_generation(generation.task_id))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+
+    async def shutdown(self):
+        """Pause (and save) everything still running, so it can be resumed after a restart."""
+        running = [generation for generation in self._tasks.values() if generation.status == RUNNING]
+        for generation in running:
+            generation.pause()
+        await asyncio.gather(*(generation._task for generation in running), return_exceptions=True)
+        await asyncio.gather(*(generation.persist() for generation in running))
 
-    def resume(self):
-        self.paused = False
-        return self.buffer # Use existing context to continue
 
-relay_manager = RelayManager()
\ No newline at end of file
+relay_manager = RelayManager()
@@ -1,25 +1,57 @@
+import json
 import logging
+import math
+import os
+import sqlite3
 import uuid
 import asyncio
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+import time
+from contextlib import aclosing
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict
 
-from app.utils.router import route_to_model
-from backend import conversation_store
-from app.llm_clients import openai_client, claude_client, gemini_client
+from app.relay_manager import relay_manager
+from app.utils import batch
+from app.utils.router import route_to_model, stream_cached
+from app.utils.context_window import build_context
+from app.utils.response_cache import response_cache
+from app.utils.singleflight import provider_calls
+from app.utils.metrics import metrics
+from app.utils.provider_health import health
+from app.utils.tracing import exporter, span
+from app.utils.rate_limiter import limits
+from app.utils.streaming import sse_event, merge_streams
+from backend import async_store
+from backend.history_cache import history_cache
+from app.llm_clients.registry import registry
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Default time budget for /compare; requests can lower it with "deadline"
+COMPARE_DEADLINE_SECONDS = float(os.getenv("COMPARE_DEADLINE", "60"))
+
+# /compare model calls still running after their response was sent (strong refs keep them alive)
+_background_compares: set[asyncio.Task] = set()
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50000"))
+
 
 class AskRequest(BaseModel):
     prompt: str
     model: str = "openai"  # default to openai for now
     conversation_id: Optional[str] = None
     user_id: Optional[str] = None
+    cache: bool = True  # set False to skip the response cache for this request
+    hedge: Optional[bool] = None  # race a second provider for "auto"/fallback models (default: HEDGE_ENABLED)
+    # History paging when loading a conversation (empty prompt)
+    limit: Optional[int] = Field(None, ge=1, le=500)
+    before: Optional[int] = None
+    after: Optional[int] = None
 
 
 class AskResponse(BaseModel):
@@ -27,6 +59,8 @@ class AskResponse(BaseModel):
     conversation_id: Optional[str] = None
     response: str
     history: Optional[List[Dict[str, str]]] = None
+    next_before: Optional[int] = None
+    next_after: Optional[int] = None
 
 
 @router.post("/ask")
@@ -36,23 +70,42 @@ async def ask(request: AskRequest):
         f"model: {request.model}, "
         f"conversation_id: {request.conversation_id}, "
         f"user_id: {request.user_id}, "
-        f"prompt: {request.prompt}"
+        f"prompt: {len(request.prompt)} chars"
     )
 
     # If prompt is empty, just return history (for loading conversations)
     if not request.prompt or request.prompt.strip() == '':
-        history = conversation_store.get_history(request.conversation_id) if request.conversation_id else []
+        if not request.conversation_id:
+            return AskResponse(model=request.model, response="", history=[])
+
+        if request.limit is None:
+            history = await async_store.get_history(request.conversation_id, before=request.before,
+                                                    after=request.after)
+            return AskResponse(
+                model=request.model,
+                conversation_id=request.conversation_id,
+                response="",
+                history=history,
+            )
+
+        page = await async_store.get_history_page(
+            request.conversation_id, request.limit, request.before, request.after
+        )
         return AskResponse(
             model=request.model,
             conversation_id=request.conversation_id,
             response="",
-            history=history,
+            history=page["messages"],
+            next_before=page["next_before"],
+            next_after=page["next_after"],
         )
 
     answer = await route_to_model(
         request.model,
         request.prompt,
-        request.conversation_id
+        request.conversation_id,
+        use_cache=request.cache,
+        hedge=request.hedge
     )
     return AskResponse(
         model=request.model,
@@ -61,27 +114,105 @@ async def ask(request: AskRequest):
     )
 
 
-@router.post("/compare")
-async def compare_models(request: dict):
+@router.post("/ask/stream")
+async def ask_stream(request: AskRequest):
     """
-    Send the same prompt to multiple models in parallel and return all responses.
+    Same as /ask, but streams the answer back as Server-Sent Events.
 
-    Request format:
-    {
-        "message": "What is the capital of France?",
-        "models": ["gpt-4.1", "claude-3-5-sonnet-20241022"],
-        "conversation_id": "optional-uuid"
-    }
+    Events:
+        event: delta   data: {"type": "delta", "text": "Par", "offset": 3}
+        event: done    data: {"type": "done", "task_id": "...", "model": "...", "response": "Paris...", "usage": {...}}
+        event: error   data: {"type": "error", "task_id": "...", "error": "..."}
+        event: paused  data: {"type": "paused", "task_id": "...", "offset": 3}
 
-    Returns:
-    {
-        "conversation_id": "uuid",
-        "responses": [
-            {"model": "gpt-4", "response": "Paris is...", "timestamp": "..."},
-            {"model": "claude-3-5-sonnet-20241022", "response": "The capital...", "timestamp": "..."}
-        ]
-    }
+    The generation runs independently of this connection; its id is in the
+    X-Task-Id header. After a disconnect, GET /ask/stream/{task_id}?offset=N
+    continues from the last delta's offset without a new upstream call.
+    """
+    logger.info(
+        f"Received stream request -> "
+        f"model: {request.model}, "
+        f"conversation_id: {request.conversation_id}, "
+        f"user_id: {request.user_id}"
+    )
+
+    if not request.prompt or request.prompt.strip() == '':
+        raise HTTPException(status_code=400, detail="Prompt is required")
+
+    generation = await relay_manager.start(request.model, request.prompt, request.conversation_id,
+                                           use_cache=request.cache, hedge=request.hedge)
+    return _generation_response(generation, 0)
+
+
+def _generation_response(generation, offset: int):
+    async def event_stream():
+        async for event in generation.events(offset):
+            yield sse_event(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Task-Id": generation.task_id},
+    )
+
+
+async def _get_generation(task_id: str):
+    generation = await relay_manager.get(task_id)
+    if generation is None:
+        raise HTTPException(status_code=404, detail="Generation not found (unknown or expired)")
+    return generation
+
+
+@router.get("/ask/stream/{task_id}")
+async def ask_stream_reconnect(task_id: str, offset: int = Query(0, ge=0)):
+    """Reattach to a generation: replays its text from `offset`, then follows it live like /ask/stream."""
+    return _generation_response(await _get_generation(task_id), offset)
+
+
+@router.get("/ask/stream/{task_id}/status")
+async def ask_stream_status(task_id: str):
+    """Status ("running", "paused", "done", "error") and length of a generation."""
+    return (await _get_generation(task_id)).info()
+
+
+@router.post("/ask/stream/{task_id}/pause")
+async def ask_stream_pause(task_id: str):
+    """Stop the upstream call of a running generation, keeping its partial answer."""
+    generation = await _get_generation(task_id)
+    generation.pause()
+    return generation.info()
+
+
+@router.post("/ask/stream/{task_id}/resume")
+async def ask_stream_resume(task_id: str, offset: int = Query(0, ge=0)):
+    """
+    Continue a paused generation from its partial answer (sent to the model as
+    the start of its reply) and stream it from `offset`. For a running or
+    finished generation this is the same as reconnecting.
     """
+    generation = await _get_generation(task_id)
+    await relay_manager.resume(generation)
+    return _generation_response(generation, offset)
+
+
+def _positive(request: dict, name: str, cast):
+    """`request[name]` as a positive finite `cast` (int or float), None if absent; 400 otherwise."""
+    value = request.get(name)
+    if value is None:
+        return None
+    try:
+        if isinstance(value, bool) or (cast is int and float(value) != int(value)):
+            raise ValueError(value)
+        value = cast(value)
+    except (TypeError, ValueError, OverflowError):
+        raise HTTPException(status_code=400, detail=f"{name} must be {'an integer' if cast is int else 'a number'}")
+    if not (0 < value < math.inf):
+        raise HTTPException(status_code=400, detail=f"{name} must be greater than 0")
+    return value
+
+
+async def _start_compare(request: dict):
+    """Validate a compare request, store the user's message and return (message, models, conversation_id, history)."""
     message = request.get("message")
     models = request.get("models", [])
     conversation_id = request.get("conversation_id")
@@ -96,55 +227,380 @@ async def compare_models(request: dict):
         conversation_id = str(uuid.uuid4())
 
     # Store the user's message once
-    conversation_store.add_message(
+    await async_store.add_message(
         conversation_id=conversation_id,
         role="user",
         content=message,
         model=None
     )
 
-    # Get conversation history (same for all models)
-    history = conversation_store.get_history(conversation_id)
+    # Get conversation history (same for all models), trimmed to the default context budget
+    history = await build_context(conversation_id)
+
+    return message, models, conversation_id, history
+
+
+@router.post("/compare")
+async def compare_models(request: dict):
+    """
+    Send the same prompt to multiple models in parallel and return all responses.
+
+    Request format:
+    {
+        "message": "What is the capital of France?",
+        "models": ["gpt-4.1", "claude-3-5-sonnet-20241022"],
+        "conversation_id": "optional-uuid",
+        "cache": true,
+        "deadline": 30,          # seconds; default COMPARE_DEADLINE
+        "min_responses": 1,      # return as soon as this many models have answered
+        "return_after": 5,       # seconds; return whatever has finished by then
+        "pending": "background"  # or "cancel": what happens to models still running
+    }
+
+    Returns:
+    {
+        "conversation_id": "uuid",
+        "responses": [
+            {"model": "gpt-4", "response": "Paris is...", "timestamp": "...", "status": "ok"},
+            {"model": "claude-3-5-sonnet-20241022", "response": null, "timestamp": null, "status": "pending"}
+        ]
+    }
+
+    Status is "ok", "error", "pending" (still running; its answer is saved to the
+    conversation when it finishes), "cancelled" or "timed_out" (deadline passed).
+    The deadline is also passed to each provider as its request timeout.
+    """
+    deadline = _positive(request, "deadline", float) or COMPARE_DEADLINE_SECONDS
+    min_responses = _positive(request, "min_responses", int)
+    return_after = _positive(request, "return_after", float)
+    message, models, conversation_id, history = await _start_compare(request)
+
+    started = time.monotonic()
+    deadline_at = started + deadline
+    min_responses = min(min_responses or len(models), len(models))
+    return_at = min(deadline_at, started + return_after) if return_after else deadline_at
+    keep_pending = request.get("pending", "background") != "cancel"
 
     # Create async tasks for each model
     async def query_model(model):
         """Query a single model and return structured result."""
-        try:
-            # Route to appropriate client
-            if "gpt" in model.lower():
-                response_text = await openai_client.chat(message, history, model)
-            elif "claude" in model.lower():
-                response_text = await claude_client.chat(message, history, model)
-            elif "gemini" in model.lower():
-                response_text = await gemini_client.chat(message, history, model)
-            else:
-                response_text = f"Unknown model: {model}"
-
-            # Store this model's response
-            timestamp = conversation_store.add_message(
-                conversation_id=conversation_id,
-                role="assistant",
-                content=response_text,
-                model=model
-            )
+        with span("compare.model", model=model):
+            try:
+                # Route to appropriate client
+                adapter, concrete_model = registry.resolve(model)
+                if not adapter:
+                    raise ValueError(f"Unknown model: {model}")
+                # complete_chat raises on provider errors, so they are reported as "error" and not stored
+                remaining = deadline_at - time.monotonic()
+                response_text = await asyncio.wait_for(
+                    adapter.client.complete_chat(message, history, concrete_model,
+                                                 use_cache=request.get("cache", True),
+                                                 conversation_id=conversation_id, timeout=remaining),
+                    remaining
+                )
+
+                # Store this model's response
+                timestamp = await async_store.add_message(
+                    conversation_id=conversation_id,
+                    role="assistant",
+                    content=response_text,
+                    model=model
+                )
+
+                return {
+                    "model": model,
+                    "response": response_text,
+                    "timestamp": timestamp,
+                    "status": "ok"
+                }
+            except asyncio.TimeoutError:
+                logger.warning(f"{model} missed the /compare deadline")
+                return {"model": model, "response": None, "timestamp": None, "status": "timed_out"}
+            except Exception as e:
+                logger.error(f"Error querying {model}: {e}")
+                return {
+                    "model": model,
+                    "response": f"Error: {str(e)}",
+                    "timestamp": None,
+                    "status": "error"
+                }
 
-            return {
-                "model": model,
-                "response": response_text,
-                "timestamp": timestamp
-            }
-        except Exception as e:
-            logger.error(f"Error querying {model}: {e}")
-            return {
-                "model": model,
-                "response": f"Error: {str(e)}",
-                "timestamp": None
-            }
-
-    # Run all model queries in parallel
-    responses = await asyncio.gather(*[query_model(model) for model in models])
+    # Run all model queries in parallel, until enough have answered or time is up
+    tasks = [asyncio.create_task(query_model(model)) for model in models]
+    pending = set(tasks)
+    try:
+        while pending and len(tasks) - len(pending) < min_responses:
+            timeout = return_at - time.monotonic()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    responses = []
+    deadline_passed = time.monotonic() >= deadline_at
+    for model, task in zip(models, tasks):
+        if task.done():
+            responses.append(task.result())
+            continue
+
+        if keep_pending and not deadline_passed:
+            # Keeps running (bounded by the deadline) and saves its answer when done
+            _background_compares.add(task)
+            task.add_done_callback(_background_compares.discard)
+            status = "pending"
+        else:
+            task.cancel()
+            status = "timed_out" if deadline_passed else "cancelled"
+        responses.append({"model": model, "response": None, "timestamp": None, "status": status})
 
     return {
         "conversation_id": conversation_id,
         "responses": responses
-    }
\ No newline at end of file
+    }
+
+
+@router.post("/compare/stream")
+async def compare_models_stream(request: dict):
+    """
+    Streaming version of /compare: every model streams into one Server-Sent Events
+    response as soon as it produces tokens, instead of waiting for the slowest one.
+
+    Request format is the same as /compare. Events are tagged with the model:
+        event: start   data: {"type": "start", "conversation_id": "uuid", "models": [...]}
+        event: delta   data: {"type": "delta", "model": "gpt-4.1", "text": "Par"}
+        event: error   data: {"type": "error", "model": "gpt-4.1", "error": "..."}
+        event: done    data: {"type": "done", "model": "gpt-4.1", "response": "Paris...",
+                              "timestamp": "...", "latency_ms": 812.4, "ttft_ms": 203.1,
+                              "input_tokens": 12, "output_tokens": 40}
+    """
+    message, models, conversation_id, history = await _start_compare(request)
+
+    async def stream_model(model):
+        """Stream one model's answer and store it as soon as that model finishes."""
+        started = time.perf_counter()
+        first_token_at = None
+        usage = {}
+        parts = []
+
+        adapter, concrete_model = registry.resolve(model)
+        if adapter is None:
+            parts.append(f"Unknown model: {model}")
+        else:
+            client_module = adapter.client
+            try:
+                async for delta in stream_cached(client_module, concrete_model, message, history, usage,
+                                                 request.get("cache", True), conversation_id):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(delta)
+                    yield {"type": "delta", "text": delta}
+            except Exception as e:
+                logger.error(f"Error streaming {model}: {e}")
+                parts = [client_module.friendly_error(e)]
+                yield {"type": "error", "error": parts[0]}
+
+        response_text = "".join(parts)
+        timestamp = await async_store.add_message(
+            conversation_id=conversation_id,
+            role="assistant",
+            content=response_text,
+            model=model
+        )
+        finished = time.perf_counter()
+
+        yield {
+            "type": "done",
+            "response": response_text,
+            "timestamp": timestamp,
+            "latency_ms": round((finished - started) * 1000, 1),
+            "ttft_ms": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+            "cached": usage.get("cached", False),
+        }
+
+    async def event_stream():
+        yield sse_event({"type": "start", "conversation_id": conversation_id, "models": models})
+        async for event in merge_streams({model: stream_model(model) for model in models}):
+            yield sse_event(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class BatchItem(BaseModel):
+    prompt: str
+    model: str = "openai"
+    conversation_id: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    batch_id: Optional[str] = None  # client-chosen id to resume by; generated if omitted
+    concurrency: int = Field(batch.DEFAULT_CONCURRENCY, ge=1, le=64)  # in-flight items per provider
+    cache: bool = True
+
+
+class BatchResumeRequest(BaseModel):
+    concurrency: int = Field(batch.DEFAULT_CONCURRENCY, ge=1, le=64)
+    cache: bool = True
+    replay: bool = False  # also send results that were already saved before the disconnect
+
+
+def _ndjson(data: dict) -> str:
+    return json.dumps(data) + "\n"
+
+
+def _batch_line(result: dict) -> str:
+    return _ndjson({
+        "index": result["index"],
+        "model": result["model"],
+        "conversation_id": result["conversation_id"],
+        "status": result["status"],
+        "response": result["response"],
+    })
+
+
+def _batch_response(batch_id: str, total: int, items: list[dict], concurrency: int, use_cache: bool,
+                    replayed: list[dict] = ()):
+    """
+    NDJSON stream: a header line, one line per result as it finishes, then a summary line.
+    The caller has claimed the batch; the claim is released when the stream ends.
+    """
+    async def lines():
+        try:
+            yield _ndjson({"batch_id": batch_id, "total": total, "pending": len(items)})
+            for result in replayed:
+                yield _batch_line(result)
+
+            counts = {}
+            # aclosing: finished results are saved before the claim is released, even on disconnect
+            async with aclosing(batch.run_batch(batch_id, items, concurrency, use_cache)) as results:
+                async for result in results:
+                    counts[result["status"]] = counts.get(result["status"], 0) + 1
+                    yield _batch_line(result)
+            yield _ndjson({"batch_id": batch_id, "done": True, "counts": counts})
+        finally:
+            batch.release(batch_id)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/ask/batch")
+async def ask_batch(request: BatchRequest):
+    """
+    Run many prompts in one call. Results stream back as NDJSON in completion
+    order and are saved as they finish; if the connection drops, resume the rest
+    with POST /ask/batch/{batch_id}/resume.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+
+    batch_id = request.batch_id or str(uuid.uuid4())
+    items = [{"index": index, **item.model_dump()} for index, item in enumerate(request.items)]
+    try:
+        await async_store.create_batch(batch_id, items)
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail=f"Batch {batch_id} already exists; resume it instead")
+    batch.claim(batch_id)
+
+    logger.info(f"Batch {batch_id}: {len(items)} items, concurrency {request.concurrency}")
+    return _batch_response(batch_id, len(items), items, request.concurrency, request.cache)
+
+
+@router.get("/ask/batch/{batch_id}")
+async def batch_status(batch_id: str):
+    """Item counts per status ("pending", "ok", "error")."""
+    info = await async_store.get_batch(batch_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return info
+
+
+@router.post("/ask/batch/{batch_id}/resume")
+async def resume_batch(batch_id: str, request: BatchResumeRequest = BatchResumeRequest()):
+    """
+    Run the items of a batch that never finished, streaming results like /ask/batch.
+    409 while a run of the same batch is still in progress.
+    """
+    info = await async_store.get_batch(batch_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if not batch.claim(batch_id):
+        raise HTTPException(status_code=409, detail=f"Batch {batch_id} is still running; resume it when it stops")
+
+    try:
+        items = await async_store.get_batch_items(batch_id, pending=True)
+        replayed = await async_store.get_batch_items(batch_id, pending=False) if request.replay else []
+    except BaseException:
+        batch.release(batch_id)
+        raise
+    logger.info(f"Resuming batch {batch_id}: {len(items)} of {info['total']} items pending")
+    return _batch_response(batch_id, info["total"], items, request.concurrency, request.cache, replayed)
+
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters for the response and history caches, request coalescing,
+    message conversion and provider-side prompt caching.
+    """
+    return {
+        **response_cache.stats(),
+        "singleflight": provider_calls.stats(),
+        "history": history_cache.stats(),
+        "conversion": {
+            name: adapter.client.converter.stats()
+            for name, adapter in registry.adapters.items()
+            if hasattr(adapter.client, "converter")
+        },
+        "prompt": {
+            name: adapter.client.prompt_cache.stats()
+            for name, adapter in registry.adapters.items()
+            if hasattr(adapter.client, "prompt_cache")
+        },
+    }
+
+
+@router.get("/providers/health")
+async def providers_health():
+    """Rolling latency, error rate and circuit-breaker state per provider/model."""
+    return health.stats()
+
+
+@router.get("/providers/limits")
+async def providers_limits():
+    """Current adaptive concurrency/rate limits and queue counters per provider and model."""
+    return limits.stats()
+
+
+@router.get("/metrics")
+async def metrics_endpoint():
+    """Request, upstream, token, DB and event-loop metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/debug/traces")
+async def debug_traces(limit: int = Query(20, ge=1, le=500)):
+    """Most recent sampled request traces, newest first (TRACE_SAMPLE_RATE, or send "X-Trace: 1")."""
+    return {"traces": exporter.recent(limit)}
+
+
+@router.get("/debug/traces/{trace_id}")
+async def debug_trace(trace_id: str):
+    """One trace with its spans and, if it was profiled ("X-Profile: 1"), its CPU profile."""
+    trace = exporter.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found (not sampled or already evicted)")
+    return trace
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+from app.llm_clients.registry import registry
+from app.utils.router import circuit_open_message, complete_with_failover
+from backend import async_store
+
+load_dotenv()
+
+DEFAULT_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # in-flight items per provider
+CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "100"))  # results per DB transaction
+CHUNK_INTERVAL_SECONDS = 1.0  # ...or whatever finished in the last second
+
+_DONE = object()
+
+# Batches with a run in progress in this process. A resume has to wait for it:
+# the items it would load as pending are the ones that run is still answering.
+_running: set[str] = set()
+
+
+def claim(batch_id: str) -> bool:
+    """Reserve the batch for one run; False if a run of it is already in progress."""
+    if batch_id in _running:
+        return False
+    _running.add(batch_id)
+    return True
+
+
+def release(batch_id: str):
+    _running.discard(batch_id)
+
+
+async def _answer(item: dict, use_cache: bool) -> dict:
+    """
+    Run one item through the same circuit breakers and failover as /ask (without
+    hedging, which would double the cost of bulk work). Never raises: failures
+    become status "error" results.
+    """
+    result = {
+        "index": item["index"],
+        "prompt": item["prompt"],
+        "model": item["model"],
+        "concrete_model": None,
+        "conversation_id": item.get("conversation_id"),
+    }
+    candidates = registry.candidates(item["model"])
+    if candidates is None:
+        adapter, model = registry.resolve(item["model"])
+        if adapter is None:
+            return {**result, "status": "error", "response": f"Model '{item['model'].lower()}' not supported yet."}
+        candidates = [(adapter, model)]
+
+    adapter, model, answer, error = await complete_with_failover(item["model"], candidates, item["prompt"],
+                                                                 item.get("conversation_id"), use_cache, hedge=False)
+    if adapter is None:
+        if len(candidates) == 1:
+            return {**result, "status": "error", "response": circuit_open_message(candidates[0][1])}
+        return {**result, "status": "error",
+                "response": f"No healthy provider available for '{item['model']}'. Please try again shortly."}
+    if error is not None:
+        return {**result, "concrete_model": model, "status": "error", "response": adapter.client.friendly_error(error)}
+    return {**result, "concrete_model": model, "status": "ok", "response": answer}
+
+
+async def run_batch(batch_id: str, items: list[dict], concurrency: int = DEFAULT_CONCURRENCY,
+                    use_cache: bool = True):
+    """
+    Run batch items with at most `concurrency` in flight per provider, yielding
+    results in completion order. Finished results are saved in chunks; if the
+    consumer goes away, whatever finished is saved and the rest stays pending
+    for a resume.
+    """
+    # One work queue per provider, so a slow provider doesn't hold up the others
+    queues: dict[str, asyncio.Queue] = {}
+    for item in items:
+        adapter, _ = registry.resolve(item["model"])
+        queues.setdefault(adapter.name if adapter else "", asyncio.Queue()).put_nowait(item)
+
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def worker(queue: asyncio.Queue):
+        while not queue.empty():
+            item = queue.get_nowait()
+            await results.put(await _answer(item, use_cache))
+        await results.put(_DONE)
+
+    workers = [
+        asyncio.create_task(worker(queue))
+        for queue in queues.values()
+        for _ in range(min(concurrency, queue.qsize()))
+    ]
+
+    chunk = []
+    flushed_at = time.monotonic()
+    running = len(workers)
+    try:
+        while running:
+            result = await results.get()
+            if result is _DONE:
+                running -= 1
+                continue
+
+            chunk.append(result)
+            if len(chunk) >= CHUNK_SIZE or time.monotonic() - flushed_at >= CHUNK_INTERVAL_SECONDS:
+                await async_store.save_batch_results(batch_id, chunk)
+                chunk, flushed_at = [], time.monotonic()
+
+            yield result
+    finally:
+        for task in workers:
+            task.cancel()
+        # Results the consumer never saw are still worth keeping
+        while not results.empty():
+            result = results.get_nowait()
+            if result is not _DONE:
+                chunk.append(result)
+        if chunk:
+            await asyncio.shield(async_store.save_batch_results(batch_id, chunk))
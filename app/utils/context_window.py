@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from backend import async_store
+from backend.conversation_store import estimate_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# History tokens sent with each request. Clients override this per provider
+# (OPENAI_CONTEXT_BUDGET, CLAUDE_CONTEXT_BUDGET, GEMINI_CONTEXT_BUDGET).
+DEFAULT_BUDGET = int(os.getenv("CONTEXT_BUDGET_TOKENS", "16000"))
+# "latest", "pin_first" or "summary" (see conversation_store.get_context_window)
+STRATEGY = os.getenv("CONTEXT_STRATEGY", "latest")
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation with the new messages below. "
+    "Keep facts, decisions and open questions; be concise.\n\n"
+    "Current summary:\n{summary}\n\nNew messages:\n{messages}"
+)
+
+# Conversations with a summary refresh in progress
+_refreshing: set[str] = set()
+# The refresh tasks themselves; the event loop only keeps weak references to tasks
+_refresh_tasks: set[asyncio.Task] = set()
+
+
+def budget_from_env(name: str) -> int:
+    """Per-provider budget, falling back to CONTEXT_BUDGET_TOKENS."""
+    return int(os.getenv(name, str(DEFAULT_BUDGET)))
+
+
+async def build_context(conversation_id: str, prompt: str = "", budget: int = DEFAULT_BUDGET,
+                        summarize=None) -> list[dict]:
+    """
+    History for the next request: as many recent messages as fit in `budget`
+    after reserving room for `prompt`.
+
+    With the "summary" strategy, `summarize(text) -> str` (an upstream call that
+    raises on failure) folds messages that fell out of the window into the
+    conversation's rolling summary in the background.
+    """
+    messages, dropped_through = await async_store.get_context_window(
+        conversation_id, budget, STRATEGY, estimate_tokens(prompt)
+    )
+
+    if STRATEGY == "summary" and summarize is not None and dropped_through is not None \
+            and conversation_id not in _refreshing:
+        _refreshing.add(conversation_id)
+        task = asyncio.create_task(_refresh_summary(conversation_id, dropped_through, summarize))
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+
+    return messages
+
+
+async def _refresh_summary(conversation_id: str, through_id: int, summarize):
+    try:
+        summary, new_messages = await async_store.get_unsummarized(conversation_id, through_id)
+        if not new_messages:
+            return
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in new_messages)
+        updated = await summarize(SUMMARY_PROMPT.format(summary=summary or "(none)", messages=transcript))
+        if updated:
+            await async_store.save_summary(conversation_id, updated, through_id)
+    except Exception as e:
+        logger.warning("Error refreshing summary of conversation %s: %r", conversation_id, e)
+    finally:
+        _refreshing.discard(conversation_id)
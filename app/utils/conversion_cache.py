@@ -0,0 +1,79 @@
+from collections import OrderedDict
+
+from app.utils.tracing import span
+
+MAX_CONVERSATIONS = 1024
+
+
+class ConversionCache:
+    """
+    Per-conversation memo of provider-format messages.
+
+    `convert_one(role, content)` builds one provider message (a Gemini Content,
+    an Anthropic message dict, ...). Messages already converted for the same
+    conversation are reused, so a turn only converts what is new. Entries are
+    keyed by (role, content) rather than position, so a context window that
+    slides forward still reuses everything it kept.
+
+    Converted objects are shared between requests; callers must not mutate them.
+    """
+
+    def __init__(self, convert_one, max_conversations: int = MAX_CONVERSATIONS):
+        self.convert_one = convert_one
+        self.max_conversations = max_conversations
+        self._conversations: OrderedDict[str, dict] = OrderedDict()
+
+        self.converted = 0
+        self.reused = 0
+
+    def convert(self, messages: list[dict], conversation_id: str | None = None) -> list:
+        """Convert non-empty text messages, reusing this conversation's earlier conversions."""
+        with span("convert", messages=len(messages)):
+            return self._convert(messages, conversation_id)
+
+    def _convert(self, messages: list[dict], conversation_id: str | None) -> list:
+        memo = None
+        if conversation_id is not None:
+            memo = self._conversations.get(conversation_id)
+            if memo is None:
+                memo = self._conversations[conversation_id] = {}
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+            else:
+                self._conversations.move_to_end(conversation_id)
+
+        converted = []
+        for msg in messages:
+            content = msg.get("content")
+            if not isinstance(content, str) or not content:
+                continue
+            key = (msg["role"], content)
+            item = memo.get(key) if memo is not None else None
+            if item is None:
+                item = self.convert_one(msg["role"], content)
+                self.converted += 1
+                if memo is not None:
+                    memo[key] = item
+            else:
+                self.reused += 1
+            converted.append(item)
+
+        # Forget messages that have slid out of the window
+        if memo is not None and len(memo) > 2 * len(converted):
+            kept = {(msg["role"], msg["content"]) for msg in messages if msg.get("content")}
+            for key in [key for key in memo if key not in kept]:
+                del memo[key]
+
+        return converted
+
+    def forget(self, conversation_id: str):
+        self._conversations.pop(conversation_id, None)
+
+    def stats(self) -> dict:
+        total = self.converted + self.reused
+        return {
+            "conversations": len(self._conversations),
+            "converted": self.converted,
+            "reused": self.reused,
+            "reuse_ratio": round(self.reused / total, 4) if total else 0.0,
+        }
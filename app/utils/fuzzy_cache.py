@@ -0,0 +1,291 @@
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter, OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: near-duplicate answers are only served when this is on
+ENABLED = os.getenv("FUZZY_CACHE_ENABLED", "0") == "1"
+THRESHOLD = float(os.getenv("FUZZY_CACHE_THRESHOLD", "0.8"))  # Jaccard similarity of shingles
+MAX_ENTRIES = int(os.getenv("FUZZY_CACHE_MAX_ENTRIES", "1000000"))
+MAX_AGE_SECONDS = float(os.getenv("FUZZY_CACHE_MAX_AGE", "86400"))
+# Optional file of extra synonym groups, one per line: the first word replaces the others
+SYNONYMS_FILE = os.getenv("FUZZY_CACHE_SYNONYMS")
+
+# 32 MinHash values split into 8 LSH bands of 4 rows. Pairs with similarity 0.8
+# share a band with probability ~0.98; pairs at 0.3 only ~0.06.
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# Bucket cap and candidate budget keep lookups O(1) even when many prompts share
+# boilerplate ("difference between ... and ..."); the newest entries win a full bucket.
+MAX_BUCKET = 64
+MAX_CANDIDATES = 16
+
+_BIN_SHIFT = 32 - (NUM_PERM.bit_length() - 1)  # top bits of a shingle hash pick its bin
+_VALUE_MASK = (1 << _BIN_SHIFT) - 1
+_EMPTY = 1 << 32
+_DENSIFY_STEP = 1 << _BIN_SHIFT  # keeps borrowed values distinct from a bin's own values
+
+# Filler words that rarely change what a short question is asking
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "of", "to", "in", "on", "for", "and",
+    "what", "whats", "what's", "which", "who", "how", "do", "does", "did", "can", "could",
+    "would", "i", "me", "my", "you", "your", "please", "tell", "give", "explain", "about",
+    "with", "using", "by", "at", "as", "or", "so", "that", "this", "it", "there", "should",
+    "between", "vs", "versus",
+}
+
+# Common rewordings in short questions; each group is folded to its first word
+_SYNONYM_GROUPS = """
+remove delete drop erase
+combine merge join concatenate
+split divide separate
+convert transform turn change
+copy duplicate clone
+sort order arrange
+reverse invert flip
+check verify validate test
+fix repair solve
+make create build generate
+find search locate lookup
+start begin launch
+stop end halt terminate
+show display print
+get fetch retrieve obtain
+list array
+dictionary dict map hashmap
+string text str
+file document
+image picture photo
+number integer int
+fast quick speedy rapid
+slow sluggish laggy
+big large huge
+small little tiny
+error bug issue problem
+broken failing failed crashing
+function method
+example sample
+"""
+
+
+def _load_synonyms() -> dict[str, str]:
+    lines = _SYNONYM_GROUPS.splitlines()
+    if SYNONYMS_FILE:
+        try:
+            with open(SYNONYMS_FILE, encoding="utf-8") as f:
+                lines += f.read().lower().splitlines()
+        except Exception as e:
+            logger.error("Error loading fuzzy cache synonyms: %r", e)
+    synonyms = {}
+    for line in lines:
+        words = line.split()
+        for word in words[1:]:
+            synonyms[word] = words[0]
+    return synonyms
+
+
+_SYNONYMS = _load_synonyms()
+_WORD = re.compile(r"[a-z0-9']+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize(prompt: str) -> tuple[str, tuple]:
+    """
+    Reduce a prompt to its content words in order, with synonyms folded, plus
+    the numbers it mentions. Word order is kept: "convert int to string" and
+    "convert string to int" share every word but ask opposite things.
+    Numbers are kept apart and must match exactly ("is 1001 prime" != "is 1009 prime").
+    """
+    text = prompt.lower()
+    words = [w.strip("'") for w in _WORD.findall(text)]
+    content = [_SYNONYMS.get(w, w) for w in words if w and w not in _STOPWORDS]
+    return " ".join(content or words), tuple(_NUMBER.findall(text))
+
+
+def shingles(text: str) -> set[int]:
+    """
+    Hashed character shingles of the normalized text, plus its word bigrams, so
+    that swapping two words costs more than the few character shingles spanning them.
+    """
+    if len(text) <= SHINGLE_SIZE:
+        return {zlib.crc32(text.encode())}
+    hashes = {zlib.crc32(text[i:i + SHINGLE_SIZE].encode()) for i in range(len(text) - SHINGLE_SIZE + 1)}
+    words = text.split()
+    hashes.update(zlib.crc32(f"{a}\0{b}".encode()) for a, b in zip(words, words[1:]))
+    return hashes
+
+
+def signature(shingle_hashes: set[int]) -> array:
+    """
+    MinHash signature using one-permutation hashing: each shingle hash is mixed
+    once, its top bits pick a bin and each bin keeps its minimum. Empty bins
+    borrow from the next non-empty bin (rotation densification). This is
+    O(shingles + NUM_PERM) instead of O(shingles * NUM_PERM).
+    """
+    bins = [_EMPTY] * NUM_PERM
+    for h in shingle_hashes:
+        h = (h * 0x9E3779B1) & 0xFFFFFFFF
+        b = h >> _BIN_SHIFT
+        v = h & _VALUE_MASK
+        if v < bins[b]:
+            bins[b] = v
+
+    sig = array("Q", bins)
+    for i in range(NUM_PERM):
+        if bins[i] != _EMPTY:
+            continue
+        for distance in range(1, NUM_PERM):
+            borrowed = bins[(i + distance) % NUM_PERM]
+            if borrowed != _EMPTY:
+                sig[i] = borrowed + distance * _DENSIFY_STEP
+                break
+    return sig
+
+
+def same_order(query: list[str], candidate: list[str]) -> bool:
+    """Whether the words both prompts use come in the same order in each (swapped operands don't)."""
+    shared = set(query).intersection(candidate)
+    return [w for w in dict.fromkeys(query) if w in shared] == [w for w in dict.fromkeys(candidate) if w in shared]
+
+
+def jaccard(query: set[int], candidate: array) -> float:
+    """Exact Jaccard similarity of a shingle-hash set and a stored (distinct) shingle array."""
+    shared = len(query.intersection(candidate))
+    return shared / (len(query) + len(candidate) - shared)
+
+
+class FuzzyCache:
+    """
+    Near-duplicate prompt -> answer cache for single-turn requests.
+
+    Each prompt is reduced to a MinHash signature and indexed in BANDS hash
+    buckets. A lookup ranks the prompts sharing its buckets by how many bands
+    they share and checks the exact shingle Jaccard of only the best few, so its
+    cost does not grow with the number of cached prompts. A match must also use
+    its shared words in the same order.
+    """
+
+    def __init__(self, threshold: float = THRESHOLD, max_entries: int = MAX_ENTRIES,
+                 max_age: float = MAX_AGE_SECONDS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+        # entry id -> (created_at, band keys, shingle hashes, normalized text, answer); insertion order == age
+        self._entries: OrderedDict[int, tuple] = OrderedDict()
+        self._buckets: dict[int, list] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _index(self, model: str, prompt: str):
+        text, numbers = normalize(prompt)
+        shingle_hashes = shingles(text)
+        sig = signature(shingle_hashes)
+        band_keys = [
+            hash((model, numbers, band, tuple(sig[band * ROWS:(band + 1) * ROWS])))
+            for band in range(BANDS)
+        ]
+        return text, shingle_hashes, tuple(dict.fromkeys(band_keys))
+
+    def _remove(self, entry_id: int):
+        _, band_keys, _, _, _ = self._entries.pop(entry_id)
+        for key in band_keys:
+            bucket = self._buckets.get(key)
+            if bucket is None or entry_id not in bucket:
+                continue  # already pushed out of a full bucket
+            bucket.remove(entry_id)
+            if not bucket:
+                del self._buckets[key]
+
+    def _evict(self, now: float):
+        # Oldest first: over the size cap, or past max age
+        while self._entries:
+            oldest_id, (created_at, _, _, _, _) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - created_at <= self.max_age:
+                break
+            self._remove(oldest_id)
+
+    def lookup(self, model: str, prompt: str) -> str | None:
+        """Answer of the most similar cached prompt above the threshold, if any."""
+        text, prompt_shingles, band_keys = self._index(model, prompt)
+        words = text.split()
+        now = time.time()
+        best_answer, best_score = None, self.threshold
+
+        with self._lock:
+            shared_bands = Counter()
+            for key in band_keys:
+                shared_bands.update(self._buckets.get(key, ()))
+
+            for entry_id, _ in shared_bands.most_common(MAX_CANDIDATES):
+                created_at, _, candidate_shingles, candidate_text, answer = self._entries[entry_id]
+                if now - created_at > self.max_age:
+                    continue
+                # Jaccard can't exceed the size ratio; skip hopeless candidates cheaply
+                smaller, larger = sorted((len(prompt_shingles), len(candidate_shingles)))
+                if smaller < best_score * larger:
+                    continue
+                score = jaccard(prompt_shingles, candidate_shingles)
+                if score >= best_score and same_order(words, candidate_text.split()):
+                    best_answer, best_score = answer, score
+
+            if best_answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best_answer
+
+    def add(self, model: str, prompt: str, answer: str):
+        text, prompt_shingles, band_keys = self._index(model, prompt)
+        now = time.time()
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            # Compact arrays rather than tuples of ints: this is most of an entry's memory at 1M entries
+            self._entries[entry_id] = (now, array("q", band_keys), array("I", prompt_shingles), text, answer)
+            for key in band_keys:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    # Most buckets only ever hold one entry; a list is far smaller than a deque
+                    self._buckets[key] = [entry_id]
+                    continue
+                bucket.append(entry_id)
+                if len(bucket) > MAX_BUCKET:
+                    del bucket[0]
+            self._evict(now)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": ENABLED,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+fuzzy_cache = FuzzyCache()
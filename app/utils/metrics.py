@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds; covers fast cache hits up to slow upstream completions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# DB calls and event-loop lag are expected to be much shorter
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+LOOP_LAG_INTERVAL = 0.5  # seconds between event-loop lag samples
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, values)} {value}" for values, value in items]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram per label combination. observe() is one bisect and a
+    few additions under a lock; buckets are only made cumulative when rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(values, list(series)) for values, series in self._series.items()]
+        lines = []
+        for values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Everything in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+HTTP_REQUESTS = metrics.counter(
+    "relay_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_SECONDS = metrics.histogram(
+    "relay_http_request_seconds", "HTTP request duration, until the last body chunk is sent.", ("method", "route"))
+UPSTREAM_SECONDS = metrics.histogram(
+    "relay_upstream_seconds", "Provider call duration (whole stream for streaming calls).", ("provider", "model"))
+UPSTREAM_TTFT_SECONDS = metrics.histogram(
+    "relay_upstream_ttft_seconds", "Time to first token of streaming provider calls.", ("provider", "model"))
+UPSTREAM_ERRORS = metrics.counter(
+    "relay_upstream_errors_total", "Failed provider calls by exception class.", ("provider", "model", "error"))
+TOKENS = metrics.counter(
+    "relay_tokens_total", "Tokens reported by providers. cache_read and cache_write are the part of "
+    "input served from or written to a provider prompt cache.", ("provider", "model", "direction"))
+DB_SECONDS = metrics.histogram(
+    "relay_db_seconds", "conversation_store call duration on the store threads.", ("op", "kind"), FAST_BUCKETS)
+FAILOVERS = metrics.counter(
+    "relay_failovers_total", "Failed attempts after which a request moved on to the next candidate.",
+    ("provider", "model"))
+CIRCUIT_TRANSITIONS = metrics.counter(
+    "relay_circuit_transitions_total", "Circuit breaker state changes, by the state entered.",
+    ("provider", "model", "state"))
+RETENTION_DELETED = metrics.counter(
+    "relay_retention_deleted_total", "Rows deleted by the retention worker.", ("table",))
+LOOP_LAG_SECONDS = metrics.histogram(
+    "relay_event_loop_lag_seconds", "How late a timer on the event loop fires.", (), FAST_BUCKETS)
+
+
+def record_tokens(provider: str, model: str, input_tokens: int | None, output_tokens: int | None,
+                  cache_read_tokens: int | None = None, cache_write_tokens: int | None = None):
+    """`input_tokens` counts all input, including the cached part."""
+    if input_tokens:
+        TOKENS.inc(provider, model, "input", amount=input_tokens)
+    if output_tokens:
+        TOKENS.inc(provider, model, "output", amount=output_tokens)
+    if cache_read_tokens:
+        TOKENS.inc(provider, model, "cache_read", amount=cache_read_tokens)
+    if cache_write_tokens:
+        TOKENS.inc(provider, model, "cache_write", amount=cache_write_tokens)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them per route template
+    ("/ask/batch/{batch_id}", not the raw path, so label counts stay bounded).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(scope["method"], path, str(status))
+            HTTP_SECONDS.observe(time.perf_counter() - started, scope["method"], path)
+
+
+async def monitor_event_loop(interval: float = LOOP_LAG_INTERVAL):
+    """Sleep `interval` at a time and record how much later than asked each wake-up came."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
@@ -0,0 +1,328 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from app.utils.metrics import record_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Provider-side caching of conversation history. Every turn resends the same
+# history plus one new exchange; Anthropic and Gemini can keep an already
+# processed prefix and serve it as cheaper, faster cached input.
+ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "1") == "1"
+MAX_CONVERSATIONS = 1024
+
+# Anthropic: "5m" or "1h" (1h writes cost 2x input instead of 1.25x); every read restarts the TTL
+CLAUDE_CACHE_TTL = os.getenv("CLAUDE_CACHE_TTL", "5m")
+CLAUDE_CACHE_MIN_TOKENS = int(os.getenv("CLAUDE_CACHE_MIN_TOKENS", "1024"))  # the API won't cache shorter prefixes
+# Gemini: cached contents are billed for storage while they live, so only long histories get one
+GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL_SECONDS", "600"))
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "4096"))
+GEMINI_REFRESH_MARGIN = 60  # extend a cache that is used this many seconds before it expires
+GEMINI_REBUILD_RATIO = 0.5  # re-cache once the uncached tail reaches this fraction of the cached part
+EXPIRY_SAFETY = 5  # seconds; a cache this close to expiry is treated as gone
+
+
+def _extends(history: list, prefix: list) -> bool:
+    """Whether `history` starts with `prefix` (converted messages, compared by identity)."""
+    return len(history) >= len(prefix) and all(a is b for a, b in zip(prefix, history))
+
+
+class CacheHandle:
+    """A conversation's cached history prefix: its first `length` messages, about `tokens` tokens."""
+
+    __slots__ = ("length", "tokens", "expires_at", "model", "name", "refreshing")
+
+    def __init__(self, length: int, tokens: int, expires_at: float, model: str, name: str | None = None):
+        self.length = length
+        self.tokens = tokens
+        self.expires_at = expires_at  # time.time()
+        self.model = model
+        self.name = name  # Gemini cached content name; Anthropic caches have none
+        self.refreshing = False
+
+
+class _PrefixCache:
+    """
+    Per-conversation bookkeeping shared by the provider caches.
+
+    A conversation is only cached while its history is stable, i.e. extends
+    the history it sent on its previous turn. Once the context window slides
+    (or the rolling summary is rewritten) the prefix changes every turn, and a
+    cache nobody reads again costs more than it saves. Histories are compared
+    by identity of their converted messages, which the ConversionCache reuses
+    across turns, so the check is a pointer comparison per message.
+    """
+
+    def __init__(self, min_tokens: int, max_conversations: int = MAX_CONVERSATIONS):
+        self.min_tokens = min_tokens
+        self.max_conversations = max_conversations
+        self._histories: OrderedDict[str, list] = OrderedDict()  # history each conversation sent last
+        self._handles: dict[str, CacheHandle] = {}
+
+        self.requests = 0
+        self.cached_requests = 0  # sent with (part of) the history cached
+        self.unstable = 0
+        self.too_short = 0
+        self.expired = 0
+        self.input_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+
+    def _stable(self, conversation_id: str, history: list) -> bool:
+        """Whether `history` extends what this conversation sent last turn; remembers it for the next one."""
+        previous = self._histories.get(conversation_id)
+        self._histories[conversation_id] = history
+        self._histories.move_to_end(conversation_id)
+        while len(self._histories) > self.max_conversations:
+            evicted, _ = self._histories.popitem(last=False)
+            self._drop(evicted)
+        # A conversation seen for the first time (e.g. after a restart) gets the benefit of the doubt
+        return previous is None or _extends(history, previous)
+
+    def _drop(self, conversation_id: str):
+        self._handles.pop(conversation_id, None)
+
+    def forget(self, conversation_id: str):
+        """Stop using a conversation's cache (e.g. the provider no longer has it)."""
+        self._handles.pop(conversation_id, None)
+
+    def observe(self, input_tokens: int | None, cache_read_tokens: int | None, cache_write_tokens: int | None):
+        """Token counts of one response; input_tokens includes the cached ones."""
+        self.input_tokens += input_tokens or 0
+        self.cache_read_tokens += cache_read_tokens or 0
+        self.cache_write_tokens += cache_write_tokens or 0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ENABLED,
+            "conversations": len(self._histories),
+            "handles": len(self._handles),
+            "requests": self.requests,
+            "cached_requests": self.cached_requests,
+            "unstable": self.unstable,
+            "too_short": self.too_short,
+            "expired": self.expired,
+            "input_tokens": self.input_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "hit_ratio": round(self.cache_read_tokens / self.input_tokens, 4) if self.input_tokens else 0.0,
+        }
+
+
+class AnthropicPromptCache(_PrefixCache):
+    """
+    Marks the end of a conversation's history with a `cache_control`
+    breakpoint, so Anthropic caches everything up to it. The breakpoint from
+    the previous turn is kept too while its cache is alive: that prefix is then
+    read back even when the new breakpoint is more than 20 blocks further on
+    (the API only looks that far back for earlier cache entries).
+    """
+
+    def __init__(self, ttl: str = CLAUDE_CACHE_TTL, min_tokens: int = CLAUDE_CACHE_MIN_TOKENS,
+                 max_conversations: int = MAX_CONVERSATIONS):
+        super().__init__(min_tokens, max_conversations)
+        self.ttl_seconds = 3600 if ttl == "1h" else 300
+        self.cache_control = {"type": "ephemeral", "ttl": "1h"} if ttl == "1h" else {"type": "ephemeral"}
+
+    def prepare(self, model: str, messages: list[dict], history_length: int, tokens: int,
+                conversation_id: str | None) -> list[dict]:
+        """
+        The messages to send: `messages` (whose first `history_length` are
+        history of about `tokens` tokens) with cache breakpoints added.
+        Marked messages are copies; converted messages are shared and never mutated.
+        """
+        if not ENABLED or conversation_id is None or history_length <= 0:
+            return messages
+        self.requests += 1
+
+        if not self._stable(conversation_id, messages[:history_length]):
+            self.unstable += 1
+            self._drop(conversation_id)
+            return messages
+        if tokens < self.min_tokens:
+            self.too_short += 1
+            return messages
+
+        now = time.time()
+        breakpoints = {history_length - 1}
+        handle = self._handles.get(conversation_id)
+        if handle is not None and handle.model == model:
+            if handle.expires_at - now > EXPIRY_SAFETY:
+                breakpoints.add(handle.length - 1)
+                self.cached_requests += 1
+            else:
+                self.expired += 1
+        self._handles[conversation_id] = CacheHandle(history_length, tokens, now + self.ttl_seconds, model)
+
+        sent = list(messages)
+        for index in breakpoints:
+            sent[index] = self._with_breakpoint(sent[index])
+        return sent
+
+    def _with_breakpoint(self, message: dict) -> dict:
+        blocks = list(message["content"])
+        blocks[-1] = {**blocks[-1], "cache_control": self.cache_control}
+        return {**message, "content": blocks}
+
+
+class GeminiContextCache(_PrefixCache):
+    """
+    Keeps a Gemini cached content per long conversation holding its history,
+    and sends only the messages after it with `cached_content=<name>`.
+
+    Caches are created in the background (the turn that triggers one is sent
+    in full, so it isn't slowed down) and replaced by a longer one once the
+    uncached tail has grown by GEMINI_REBUILD_RATIO. A cache still in use
+    shortly before it expires gets its TTL extended; one that stops matching
+    the history (or goes unused and expires) is deleted or left to expire.
+    """
+
+    def __init__(self, provider: str, client, ttl: int = GEMINI_CACHE_TTL,
+                 min_tokens: int = GEMINI_CACHE_MIN_TOKENS, max_conversations: int = MAX_CONVERSATIONS):
+        super().__init__(min_tokens, max_conversations)
+        self.provider = provider
+        self.client = client
+        self.ttl = ttl
+        self._creating: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+        self.created = 0
+        self.refreshed = 0
+        self.deleted = 0
+        self.failed = 0
+
+    def prepare(self, model: str, contents: list, history_length: int, tokens: int,
+                conversation_id: str | None) -> tuple[list, str | None]:
+        """
+        (contents to send, cached content name or None) for `contents` whose
+        first `history_length` are history of about `tokens` tokens.
+        """
+        if not ENABLED or conversation_id is None or history_length <= 0 or self.client is None:
+            return contents, None
+        self.requests += 1
+
+        history = contents[:history_length]
+        if not self._stable(conversation_id, history):
+            self.unstable += 1
+            self._drop(conversation_id)
+            return contents, None
+
+        now = time.time()
+        handle = self._handles.get(conversation_id)
+        if handle is not None and (handle.model != model or handle.expires_at - now < EXPIRY_SAFETY):
+            if handle.model == model and handle.name is not None:
+                self.expired += 1
+            self._drop(conversation_id)
+            handle = None
+
+        if handle is None:
+            if tokens < self.min_tokens:
+                self.too_short += 1
+            else:
+                self._create_soon(conversation_id, model, history, tokens)
+            return contents, None
+        if handle.name is None:
+            return contents, None  # creating one failed recently; don't retry until this expires
+
+        if handle.expires_at - now < GEMINI_REFRESH_MARGIN and not handle.refreshing:
+            handle.refreshing = True
+            self._spawn(self._refresh(handle))
+        if tokens - handle.tokens >= handle.tokens * GEMINI_REBUILD_RATIO:
+            self._create_soon(conversation_id, model, history, tokens)
+
+        self.cached_requests += 1
+        return contents[handle.length:], handle.name
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _create_soon(self, conversation_id: str, model: str, history: list, tokens: int):
+        if conversation_id not in self._creating:
+            self._creating.add(conversation_id)
+            self._spawn(self._create(conversation_id, model, history, tokens))
+
+    async def _create(self, conversation_id: str, model: str, history: list, tokens: int):
+        started = time.time()
+        try:
+            cache = await self.client.aio.caches.create(
+                model=model, config={"contents": history, "ttl": f"{self.ttl}s"}
+            )
+        except Exception as e:
+            logger.warning("Error creating Gemini context cache: %r", e)
+            self.failed += 1
+            if conversation_id not in self._handles:
+                # Remember the failure (a handle without a name) so the next turns don't retry right away
+                self._handles[conversation_id] = CacheHandle(0, 0, started + self.ttl, model)
+            return
+        finally:
+            self._creating.discard(conversation_id)
+
+        current = self._histories.get(conversation_id)
+        if current is None or not _extends(current, history):
+            # The conversation moved on to a different prefix while this was being created
+            await self._delete(cache.name)
+            return
+        expires_at = started + self.ttl
+        if cache.expire_time is not None:
+            expires_at = min(expires_at, cache.expire_time.timestamp())
+        usage = getattr(cache, "usage_metadata", None)
+        cached_tokens = getattr(usage, "total_token_count", None) or tokens
+        self._drop(conversation_id)
+        self._handles[conversation_id] = CacheHandle(len(history), cached_tokens, expires_at, model, cache.name)
+        self.created += 1
+        self.cache_write_tokens += cached_tokens
+        record_tokens(self.provider, model, None, None, cache_write_tokens=cached_tokens)
+
+    async def _refresh(self, handle: CacheHandle):
+        started = time.time()
+        try:
+            cache = await self.client.aio.caches.update(name=handle.name, config={"ttl": f"{self.ttl}s"})
+            handle.expires_at = started + self.ttl
+            if cache.expire_time is not None:
+                handle.expires_at = min(handle.expires_at, cache.expire_time.timestamp())
+            self.refreshed += 1
+        except Exception as e:
+            logger.warning("Error refreshing Gemini context cache: %r", e)
+        finally:
+            handle.refreshing = False
+
+    async def _delete(self, name: str):
+        try:
+            await self.client.aio.caches.delete(name=name)
+            self.deleted += 1
+        except Exception as e:
+            logger.warning("Error deleting Gemini context cache: %r", e)
+
+    def _drop(self, conversation_id: str):
+        handle = self._handles.pop(conversation_id, None)
+        if handle is not None and handle.name is not None and handle.expires_at > time.time():
+            self._spawn(self._delete(handle.name))
+
+    async def shutdown(self):
+        """Delete the live caches rather than paying for their storage until they expire."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        now = time.time()
+        names = [handle.name for handle in self._handles.values()
+                 if handle.name is not None and handle.expires_at > now]
+        self._handles.clear()
+        await asyncio.gather(*(self._delete(name) for name in names))
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "created": self.created,
+            "refreshed": self.refreshed,
+            "deleted": self.deleted,
+            "failed": self.failed,
+        }
@@ -0,0 +1,216 @@
+import functools
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from app.utils.metrics import (CIRCUIT_TRANSITIONS, UPSTREAM_ERRORS, UPSTREAM_SECONDS, UPSTREAM_TTFT_SECONDS,
+                               record_tokens)
+from app.utils.tracing import span, start_span
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WINDOW = int(os.getenv("HEALTH_WINDOW", "100"))  # recent calls kept per provider/model
+FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))  # consecutive failures that open a circuit
+COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_COOLDOWN", "30"))  # open time before a probe is let through
+# Hedge only once the p95 is based on enough samples
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+
+def percentile(samples, pct: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class _ModelHealth:
+    def __init__(self):
+        # Seconds: to the first token of streams, and to the whole answer (streamed or not)
+        self.latencies = {"ttft": deque(maxlen=WINDOW), "completion": deque(maxlen=WINDOW)}
+        self.outcomes = deque(maxlen=WINDOW)   # True = success
+        self.consecutive_failures = 0
+        self.opened_at = None     # circuit open since
+        self.probe_started = None  # half-open probe in flight since
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def state(self, now: float) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if now - self.opened_at >= COOLDOWN_SECONDS else "open"
+
+
+class ProviderHealth:
+    """
+    Rolling latency/error stats and a circuit breaker per (provider, model).
+
+    A circuit opens after FAILURE_THRESHOLD consecutive failures. After
+    COOLDOWN_SECONDS it goes half-open and lets a single probe through: success
+    closes it, failure re-opens it. A probe that never reports back (cancelled,
+    served from cache) frees its slot again after another cooldown.
+    """
+
+    def __init__(self):
+        self._models: dict[tuple[str, str], _ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, provider: str, model: str) -> _ModelHealth:
+        health = self._models.get((provider, model))
+        if health is None:
+            health = self._models[(provider, model)] = _ModelHealth()
+        return health
+
+    def record_success(self, provider: str, model: str, completion: float, ttft: float | None = None):
+        with self._lock:
+            health = self._get(provider, model)
+            health.latencies["completion"].append(completion)
+            if ttft is not None:
+                health.latencies["ttft"].append(ttft)
+            health.outcomes.append(True)
+            health.consecutive_failures = 0
+            if health.opened_at is not None:
+                logger.info("Circuit closed for %s/%s", provider, model)
+                CIRCUIT_TRANSITIONS.inc(provider, model, "closed")
+            health.opened_at = None
+            health.probe_started = None
+
+    def record_failure(self, provider: str, model: str):
+        with self._lock:
+            health = self._get(provider, model)
+            health.outcomes.append(False)
+            health.consecutive_failures += 1
+            if health.probe_started is not None or health.consecutive_failures >= FAILURE_THRESHOLD:
+                if health.opened_at is None:
+                    logger.warning("Circuit opened for %s/%s after %d failures", provider, model,
+                                   health.consecutive_failures)
+                    CIRCUIT_TRANSITIONS.inc(provider, model, "open")
+                elif health.probe_started is not None:
+                    logger.warning("Circuit re-opened for %s/%s: half-open probe failed", provider, model)
+                    CIRCUIT_TRANSITIONS.inc(provider, model, "open")
+                health.opened_at = time.monotonic()
+                health.probe_started = None
+
+    def acquire(self, provider: str, model: str) -> bool:
+        """May a request be sent now? Takes the probe slot of a half-open circuit."""
+        now = time.monotonic()
+        with self._lock:
+            health = self._models.get((provider, model))
+            if health is None:
+                return True
+            state = health.state(now)
+            if state == "closed":
+                return True
+            if state == "open":
+                return False
+            if health.probe_started is not None and now - health.probe_started < COOLDOWN_SECONDS:
+                return False
+            health.probe_started = now
+            logger.info("Circuit half-open for %s/%s: sending a probe", provider, model)
+            CIRCUIT_TRANSITIONS.inc(provider, model, "half_open")
+            return True
+
+    def available(self, provider: str, model: str) -> bool:
+        """Like acquire(), without taking anything."""
+        health = self._models.get((provider, model))
+        return health is None or health.state(time.monotonic()) != "open"
+
+    def p95(self, provider: str, model: str, kind: str = "completion") -> float | None:
+        """
+        p95 of "completion" (whole answer) or "ttft" (first streamed token) latency,
+        or None until there are enough samples to trust it.
+        """
+        health = self._models.get((provider, model))
+        if health is None or len(health.latencies[kind]) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(list(health.latencies[kind]), 0.95)
+
+    def score(self, provider: str, model: str, kind: str = "completion") -> float:
+        """Lower is better: p50 latency of `kind` inflated by the recent error rate. Unmeasured models go first."""
+        health = self._models.get((provider, model))
+        if health is None or not health.latencies[kind]:
+            return 0.0
+        return percentile(list(health.latencies[kind]), 0.5) * (1 + 4 * health.error_rate())
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._models.items())
+        result = {}
+        for (provider, model), health in items:
+            result[f"{provider}/{model}"] = {
+                "state": health.state(now),
+                "calls": len(health.outcomes),
+                "error_rate": round(health.error_rate(), 4),
+                "consecutive_failures": health.consecutive_failures,
+            }
+            for kind, samples in health.latencies.items():
+                samples = list(samples)
+                for name, pct in (("p50", 0.5), ("p95", 0.95)):
+                    value = percentile(samples, pct)
+                    result[f"{provider}/{model}"][f"{kind}_{name}_ms"] = \
+                        round(value * 1000, 1) if value is not None else None
+        return result
+
+
+health = ProviderHealth()
+
+
+def tracked(provider: str):
+    """Decorator for a client's `_complete(model, ...)`: records latency, failures and circuit state."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(model: str, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with span("provider.call", provider=provider, model=model):
+                    result = await fn(model, *args, **kwargs)
+            except Exception as e:
+                health.record_failure(provider, model)
+                UPSTREAM_ERRORS.inc(provider, model, type(e).__name__)
+                raise
+            latency = time.perf_counter() - started
+            health.record_success(provider, model, latency)
+            UPSTREAM_SECONDS.observe(latency, provider, model)
+            return result
+        return wrapper
+    return decorator
+
+
+async def tracked_stream(provider: str, model: str, stream, usage: dict | None = None):
+    """
+    Pass a delta stream through, recording time to first token or the failure,
+    and the token counts the stream wrote into `usage`.
+    """
+    started = time.perf_counter()
+    first_token = None
+    stream_span = start_span("provider.stream", provider=provider, model=model)
+    try:
+        async for delta in stream:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+                UPSTREAM_TTFT_SECONDS.observe(first_token, provider, model)
+                if stream_span is not None:
+                    stream_span.attrs["ttft_ms"] = round(first_token * 1000, 3)
+            yield delta
+    except BaseException as e:
+        if stream_span is not None:
+            stream_span.finish(e)
+        if isinstance(e, Exception):
+            health.record_failure(provider, model)
+            UPSTREAM_ERRORS.inc(provider, model, type(e).__name__)
+        raise
+    if stream_span is not None:
+        stream_span.finish()
+    elapsed = time.perf_counter() - started
+    health.record_success(provider, model, elapsed, first_token if first_token is not None else elapsed)
+    UPSTREAM_SECONDS.observe(elapsed, provider, model)
+    if usage:
+        record_tokens(provider, model, usage.get("input_tokens"), usage.get("output_tokens"),
+                      usage.get("cache_read_tokens"), usage.get("cache_write_tokens"))
@@ -0,0 +1,256 @@
+import asyncio
+import functools
+import os
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Defaults for every provider; override per provider with e.g. OPENAI_MAX_CONCURRENCY, CLAUDE_RPS.
+MAX_CONCURRENCY = int(os.getenv("PROVIDER_MAX_CONCURRENCY", "16"))
+MIN_CONCURRENCY = 1
+RPS = float(os.getenv("PROVIDER_RPS", "0"))  # requests/second; 0 = no rate limit
+MAX_QUEUE = int(os.getenv("LIMITER_MAX_QUEUE", "64"))  # waiters beyond this are rejected at once
+MAX_WAIT_SECONDS = float(os.getenv("LIMITER_MAX_WAIT", "10"))
+
+
+class ProviderBusy(Exception):
+    """Raised instead of calling upstream when a provider's limiter has no room."""
+
+
+def overload_kind(e: Exception) -> str | None:
+    """"rate_limited" for 429s, "overloaded" for provider-wide overload (529/503), else None."""
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    text = repr(e)
+    if status == 429 or "RESOURCE_EXHAUSTED" in text or "rate_limit" in text.lower():
+        return "rate_limited"
+    if status in (503, 529) or "overloaded" in text.lower():
+        return "overloaded"
+    return None
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit plus token bucket, both adjusted by AIMD.
+
+    Each success raises the concurrency limit by 1/limit (about +1 per limit's
+    worth of calls) and the rate by 5% of its ceiling; an overload halves both.
+    Callers that can't start wait in a FIFO queue of at most `max_queue`; beyond
+    that, or after `max_wait` seconds, they get ProviderBusy instead of piling
+    onto an overloaded provider.
+    """
+
+    def __init__(self, name: str, max_concurrency: int = MAX_CONCURRENCY, rps: float = RPS,
+                 max_queue: int = MAX_QUEUE, max_wait: float = MAX_WAIT_SECONDS):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.max_rate = rps
+        self.rate = rps
+        self.tokens = max(rps, 1.0)  # bucket holds up to one second of requests
+        self._refilled_at = time.monotonic()
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._wake_scheduled = False
+        self._decreased_at = 0.0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.overloads = 0
+
+    def _refill(self):
+        if not self.max_rate:
+            return
+        now = time.monotonic()
+        self.tokens = min(max(self.max_rate, 1.0), self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _has_room(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        self._refill()
+        return not self.max_rate or self.tokens >= 1
+
+    def _start(self):
+        self.in_flight += 1
+        self.admitted += 1
+        if self.max_rate:
+            self.tokens -= 1
+
+    async def acquire(self):
+        if not self._waiters and self._has_room():
+            self._start()
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise ProviderBusy(f"{self.name} is at capacity ({self.in_flight} in flight, queue full)")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.timed_out += 1
+            raise ProviderBusy(f"{self.name} had no free slot within {self.max_wait}s")
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # The slot was handed over just as we gave up; pass it on
+            self.in_flight -= 1
+            self._wake()
+        else:
+            waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def _wake(self):
+        """Hand free slots to waiters in order; if only the rate is short, retry when a token is due."""
+        while self._waiters:
+            if self._waiters[0].done():
+                self._waiters.popleft()
+                continue
+            if self.in_flight >= int(self.limit):
+                return
+            self._refill()
+            if self.max_rate and self.tokens < 1:
+                if not self._wake_scheduled:
+                    self._wake_scheduled = True
+                    delay = (1 - self.tokens) / self.rate
+                    asyncio.get_running_loop().call_later(delay, self._scheduled_wake)
+                return
+            self._start()
+            self._waiters.popleft().set_result(None)
+
+    def _scheduled_wake(self):
+        self._wake_scheduled = False
+        self._wake()
+
+    def release(self, outcome: str | None = "success", started_at: float = 0.0):
+        """
+        Free a slot. outcome: "success" (increase), "overload" (decrease) or None (no change).
+        Only calls started after the last decrease can decrease again, so one burst of
+        429s halves the limit once rather than once per failed call.
+        """
+        self.in_flight -= 1
+        if outcome == "overload":
+            self.overloads += 1
+            if started_at >= self._decreased_at:
+                self._decreased_at = time.monotonic()
+                self.limit = max(MIN_CONCURRENCY, self.limit / 2)
+                if self.max_rate:
+                    self.rate = max(self.max_rate / 20, self.rate / 2)
+        elif outcome == "success":
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            if self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "max_concurrency": self.max_concurrency,
+            "rate_per_second": round(self.rate, 2) if self.max_rate else None,
+            "in_flight": self.in_flight,
+            "queued": sum(1 for waiter in self._waiters if not waiter.done()),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "overloads": self.overloads,
+        }
+
+
+class ProviderLimits:
+    """A limiter per provider and one per (provider, model); a call needs a slot in both."""
+
+    def __init__(self):
+        self._limiters: dict[str, AdaptiveLimiter] = {}
+
+    def _limiter(self, name: str, provider: str) -> AdaptiveLimiter:
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            prefix = provider.upper()
+            limiter = self._limiters[name] = AdaptiveLimiter(
+                name,
+                max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", str(MAX_CONCURRENCY))),
+                rps=float(os.getenv(f"{prefix}_RPS", str(RPS))),
+            )
+        return limiter
+
+    async def acquire(self, provider: str, model: str):
+        """Take a model slot, then a provider slot. Returns a handle for release()."""
+        model_limiter = self._limiter(f"{provider}/{model}", provider)
+        provider_limiter = self._limiter(provider, provider)
+        await model_limiter.acquire()
+        try:
+            await provider_limiter.acquire()
+        except BaseException:
+            model_limiter.release(None)
+            raise
+        return model_limiter, provider_limiter, time.monotonic()
+
+    @staticmethod
+    def release(slots, outcome: str | None = "success", error: Exception | None = None):
+        """Free both slots. A given error is classified: 429s slow the model, 529/503 the whole provider."""
+        model_limiter, provider_limiter, started_at = slots
+        if error is None:
+            model_limiter.release(outcome, started_at)
+            provider_limiter.release(outcome, started_at)
+            return
+        kind = overload_kind(error)
+        model_limiter.release("overload" if kind else None, started_at)
+        provider_limiter.release("overload" if kind == "overloaded" else None, started_at)
+
+    def stats(self) -> dict:
+        return {name: limiter.stats() for name, limiter in self._limiters.items()}
+
+
+limits = ProviderLimits()
+
+
+def limited(provider: str):
+    """Decorator for a client's `_complete(model, ...)`: waits for (or is refused) a slot first."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(model: str, *args, **kwargs):
+            slots = await limits.acquire(provider, model)
+            try:
+                result = await fn(model, *args, **kwargs)
+            except Exception as e:
+                limits.release(slots, error=e)
+                raise
+            except BaseException:
+                limits.release(slots, None)
+                raise
+            limits.release(slots)
+            return result
+        return wrapper
+    return decorator
+
+
+async def limited_stream(provider: str, model: str, stream):
+    """Hold a slot for the whole of a delta stream. The slot is only taken on first iteration."""
+    slots = await limits.acquire(provider, model)
+    try:
+        async for delta in stream:
+            yield delta
+    except Exception as e:
+        limits.release(slots, error=e)
+        raise
+    except BaseException:
+        limits.release(slots, None)
+        raise
+    limits.release(slots)
@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from app.utils import fuzzy_cache
+from app.utils.singleflight import provider_calls
+
+load_dotenv()
+
+ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Optional persistent tier, e.g. RESPONSE_CACHE_DB=backend/response_cache.db
+DB_PATH = os.getenv("RESPONSE_CACHE_DB")
+
+
+def cache_key(model: str, params: dict | None, messages: list[dict]) -> str:
+    """
+    Stable hash of everything that determines an answer: the concrete model,
+    generation parameters and the (normalized) message list sent upstream.
+    """
+    # Same filtering the clients apply before sending: only non-empty text turns
+    normalized = [
+        [msg["role"], msg["content"]]
+        for msg in messages
+        if isinstance(msg.get("content"), str) and msg.get("content")
+    ]
+    payload = json.dumps([model, params or {}, normalized], sort_keys=True, separators=(",", ":"),
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier exact-match answer cache: in-process LRU with TTL, plus an optional SQLite tier."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl: float = TTL_SECONDS, db_path: str | None = DB_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()  # key -> (expires_at, answer)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    answer TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self._db.commit()
+
+    @property
+    def persistent(self) -> bool:
+        return self._db is not None
+
+    def get_memory(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, answer = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return answer
+
+    def get_persistent(self, key: str) -> str | None:
+        """Blocking SQLite lookup; promotes hits into the memory tier."""
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT answer, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        self._put_memory(key, row[0], row[1])
+        return row[0]
+
+    def _put_memory(self, key: str, answer: str, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key: str, answer: str):
+        """Store an answer in the memory tier (the SQLite tier is written by put_persistent)."""
+        self._put_memory(key, answer, time.time() + self.ttl)
+
+    def put_persistent(self, key: str, answer: str):
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, answer, expires_at) VALUES (?, ?, ?)",
+                (key, answer, time.time() + self.ttl)
+            )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM response_cache")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "enabled": ENABLED,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "persistent": self.persistent,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round((self.hits + self.persistent_hits) / lookups, 4) if lookups else 0.0,
+            "fuzzy": fuzzy_cache.fuzzy_cache.stats(),
+        }
+
+
+response_cache = ResponseCache()
+
+
+def _single_turn_prompt(messages: list[dict] | None) -> str | None:
+    """The prompt of a history-free request, the only kind the fuzzy tier serves."""
+    if messages and len(messages) == 1 and isinstance(messages[0].get("content"), str):
+        return messages[0]["content"]
+    return None
+
+
+async def lookup(key: str, model: str | None = None, messages: list[dict] | None = None) -> str | None:
+    """
+    Check the memory tier, then the persistent tier (off the event loop), then,
+    for single-turn requests with the fuzzy cache enabled, near-duplicate prompts.
+    """
+    answer = response_cache.get_memory(key)
+    if answer is not None:
+        response_cache.hits += 1
+        return answer
+
+    if response_cache.persistent:
+        answer = await asyncio.to_thread(response_cache.get_persistent, key)
+        if answer is not None:
+            response_cache.persistent_hits += 1
+            return answer
+
+    response_cache.misses += 1
+
+    prompt = _single_turn_prompt(messages)
+    if fuzzy_cache.ENABLED and prompt is not None:
+        return fuzzy_cache.fuzzy_cache.lookup(model, prompt)
+    return None
+
+
+async def store(key: str, answer: str, model: str | None = None, messages: list[dict] | None = None):
+    response_cache.put(key, answer)
+
+    prompt = _single_turn_prompt(messages)
+    if fuzzy_cache.ENABLED and prompt is not None:
+        fuzzy_cache.fuzzy_cache.add(model, prompt, answer)
+
+    if response_cache.persistent:
+        await asyncio.to_thread(response_cache.put_persistent, key, answer)
+
+
+async def cached_completion(model: str, params: dict | None, messages: list[dict], fetch, use_cache: bool = True,
+                            timeout: float | None = None) -> str:
+    """
+    Return a cached answer for this exact request, or await `fetch()` and cache its result.
+    Identical requests already in flight share one upstream call instead of starting another;
+    `timeout` (the one `fetch` passes upstream) bounds how long this caller waits on a shared call.
+    `fetch` must raise on failure so error strings never end up in the cache.
+    """
+    caching = ENABLED and use_cache
+    key = cache_key(model, params, messages)
+
+    if caching:
+        answer = await lookup(key, model, messages)
+        if answer is not None:
+            return answer
+    else:
+        response_cache.bypassed += 1
+
+    async def fetch_and_store():
+        answer = await fetch()
+        if answer and caching:
+            await store(key, answer, model, messages)
+        return answer
+
+    return await provider_calls.do(key, fetch_and_store, timeout)
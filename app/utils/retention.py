@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+from app.utils.metrics import RETENTION_DELETED
+from backend import async_store
+from backend.database import utc_now
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))  # delete conversations idle this long; 0 = only on POST /cleanup
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))  # between scheduled runs
+BATCH_ROWS = int(os.getenv("RETENTION_BATCH_ROWS", "500"))  # rows per delete transaction (upper bound)
+MAX_STEP_MS = float(os.getenv("RETENTION_MAX_STEP_MS", "20"))  # shrink batches when a step takes longer
+PAUSE_SECONDS = float(os.getenv("RETENTION_PAUSE_SECONDS", "0.01"))  # idle gap between steps for other writers
+CONVERSATIONS_PER_STEP = 50
+VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "256"))  # pages returned to the filesystem per step
+MIN_BATCH_ROWS = 10
+
+
+class RetentionWorker:
+    """
+    Deletes conversations with no messages for `days_old` days (plus saved
+    generations and /ask/batch jobs that old) in small transactions on the
+    store's writer thread, then gives the freed pages back with
+    incremental_vacuum. Each step queues behind /ask writes instead of holding
+    the write lock for the whole cleanup, and the batch size adapts so one
+    step stays under MAX_STEP_MS.
+    """
+
+    def __init__(self):
+        self.batch_rows = BATCH_ROWS
+        self._task: asyncio.Task | None = None
+        self._progress = {}
+        self._warned_vacuum = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def status(self) -> dict:
+        return {"running": self.running, "scheduled_days": RETENTION_DAYS or None, **self._progress}
+
+    def start(self, days_old: int) -> bool:
+        """Start a run in the background; False if one is already running."""
+        if self.running:
+            return False
+        cutoff = utc_now(days_ago=days_old)
+        self._progress = {
+            "days_old": days_old,
+            "cutoff": cutoff,
+            "started_at": utc_now(),
+            "finished_at": None,
+            "conversations_deleted": 0,
+            "messages_deleted": 0,
+            "generations_deleted": 0,
+            "batch_items_deleted": 0,
+            "pages_vacuumed": 0,
+            "error": None,
+        }
+        self._task = asyncio.create_task(self._run(cutoff, self._progress))
+        return True
+
+    async def _step(self, func, *args) -> int:
+        """Run one bounded delete, adapting the batch size to how long it held up the writer."""
+        started = time.perf_counter()
+        count = await func(*args)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms > MAX_STEP_MS:
+            self.batch_rows = max(MIN_BATCH_ROWS, self.batch_rows // 2)
+        elif elapsed_ms < MAX_STEP_MS / 2:
+            self.batch_rows = min(BATCH_ROWS, self.batch_rows + max(1, self.batch_rows // 4))
+        await asyncio.sleep(PAUSE_SECONDS)
+        return count
+
+    async def _run(self, cutoff: str, progress: dict):
+        try:
+            while True:
+                conversation_ids = await async_store.stale_conversations(cutoff, CONVERSATIONS_PER_STEP)
+                if not conversation_ids:
+                    break
+                while True:
+                    deleted = await self._step(async_store.delete_stale_messages, conversation_ids, cutoff,
+                                               self.batch_rows)
+                    progress["messages_deleted"] += deleted
+                    RETENTION_DELETED.inc("messages", amount=deleted)
+                    if not deleted:
+                        break
+                deleted = await self._step(async_store.delete_stale_conversations, conversation_ids, cutoff)
+                progress["conversations_deleted"] += deleted
+                RETENTION_DELETED.inc("conversations", amount=deleted)
+                if not deleted:
+                    break  # every picked conversation became active again; the rest are newer
+
+            while deleted := await self._step(async_store.delete_stale_generations, cutoff, self.batch_rows):
+                progress["generations_deleted"] += deleted
+                RETENTION_DELETED.inc("generations", amount=deleted)
+
+            while deleted := await self._step(async_store.delete_stale_batches, cutoff, self.batch_rows):
+                progress["batch_items_deleted"] += deleted
+                RETENTION_DELETED.inc("batch_items", amount=deleted)
+
+            await self._vacuum(progress)
+        except asyncio.CancelledError:
+            progress["error"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.error("Error in retention run: %r", e)
+            progress["error"] = str(e)
+        finally:
+            progress["finished_at"] = utc_now()
+
+    async def _vacuum(self, progress: dict):
+        if await async_store.auto_vacuum_mode() != 2:
+            if not self._warned_vacuum:
+                self._warned_vacuum = True
+                logger.warning("Retention: database was created without auto_vacuum=INCREMENTAL, so freed pages "
+                               "are reused but not returned to the filesystem. Run "
+                               "`PRAGMA auto_vacuum=INCREMENTAL; VACUUM;` once, offline, to enable it.")
+            return
+        while freed := await self._step(async_store.incremental_vacuum, VACUUM_PAGES):
+            progress["pages_vacuumed"] += freed
+
+    async def schedule(self):
+        """Run every RETENTION_INTERVAL seconds while RETENTION_DAYS is set."""
+        while True:
+            if not self.running:
+                self.start(RETENTION_DAYS)
+            await asyncio.sleep(RETENTION_INTERVAL)
+
+    async def shutdown(self):
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+retention = RetentionWorker()
@@ -1,21 +1,395 @@
-from app.llm_clients.openai_client import ask_openai
-from app.llm_clients.claude_client import ask_claude
-from app.llm_clients.gemini_client import ask_gemini
+import asyncio
+import logging
+import os
 
+from dotenv import load_dotenv
 
-async def route_to_model(model_name: str, prompt: str, conversation_id: str | None) -> str:
+from app.llm_clients.registry import registry
+from backend.async_store import add_message
+from app.utils.context_window import build_context
+from app.utils import response_cache
+from app.utils.metrics import FAILOVERS
+from app.utils.provider_health import health, tracked_stream
+from app.utils.rate_limiter import limited_stream
+from app.utils.tracing import span, start_span
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Race a second provider when the first hasn't answered (or streamed a token) by its p95
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+
+
+def circuit_open_message(model: str) -> str:
+    return f"Model '{model}' is temporarily unavailable after repeated errors. Please try again shortly."
+
+
+async def route_to_model(model_name: str, prompt: str, conversation_id: str | None,
+                         use_cache: bool = True, hedge: bool | None = None) -> str:
     """
     Simple model router for multiple LLM backends (async version).
+    Logical models ("auto", fallback chains) fail over between providers.
     """
-    model_name = model_name.lower()
+    with span("route", model=model_name):
+        candidates = registry.candidates(model_name)
+        if candidates is not None:
+            return await _route_with_failover(model_name, candidates, prompt, conversation_id, use_cache,
+                                              HEDGE_ENABLED if hedge is None else hedge)
+
+        adapter, model = registry.resolve(model_name)
+        if adapter is None:
+            return f"Model '{model_name.lower()}' not supported yet."
+
+        # Fail fast instead of waiting out the SDK timeout against a provider that is down
+        if not health.acquire(adapter.name, model):
+            return circuit_open_message(model)
+
+        return await adapter.ask(prompt, conversation_id, model=model, use_cache=use_cache)
+
+
+def _ordered(model_name: str, candidates: list, kind: str = "completion") -> list:
+    """
+    Healthy candidates; "auto" is ranked fastest first by `kind` latency
+    ("ttft" for streams), fallback chains keep their order.
+    """
+    healthy = [(adapter, model) for adapter, model in candidates if health.available(adapter.name, model)]
+    if model_name.lower() == "auto":
+        healthy.sort(key=lambda candidate: health.score(candidate[0].name, candidate[1], kind))
+    return healthy
+
+
+async def _complete_with(adapter, model: str, prompt: str, conversation_id: str | None, use_cache: bool) -> str:
+    history = []
+    if conversation_id:
+        history = await build_context(conversation_id, prompt, adapter.client.CONTEXT_BUDGET,
+                                      adapter.client.summarize)
+    return await adapter.client.complete_chat(prompt, history, model, use_cache, conversation_id)
+
+
+def _failed_over(candidate, error: Exception):
+    """Log and count an attempt that failed, so the request moves on."""
+    adapter, model = candidate
+    logger.warning("Failover from %s/%s: %r", adapter.name, model, error)
+    FAILOVERS.inc(adapter.name, model)
+
+
+class HedgeFailed(Exception):
+    """Every attempt of a hedged race failed; `started` is how many candidates were tried."""
+
+    def __init__(self, error: Exception, started: int):
+        super().__init__(repr(error))
+        self.error = error
+        self.started = started
+
+
+def _guarded(candidate, start):
+    """`start` for a hedge to `candidate`, returning None instead while its circuit is open."""
+    def run():
+        adapter, model = candidate
+        return start() if health.acquire(adapter.name, model) else None
+    return run
+
+
+async def _first_success(first, second, delay: float, on_failure):
+    """
+    Await `first()`; if it hasn't succeeded after `delay` seconds (or failed
+    before that), also start `second()`, which may return None to decline.
+    Returns (index, result) of the first to succeed, cancelling the other;
+    `on_failure(index, error)` is called for each attempt that fails.
+    Raises HedgeFailed with the last error if every started attempt fails.
+    """
+    tasks = [asyncio.ensure_future(first())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done or tasks[0].exception() is not None:
+            coro = second()
+            if coro is not None:
+                tasks.append(asyncio.ensure_future(coro))
+
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return tasks.index(task), task.result()
+                error = task.exception()
+                on_failure(tasks.index(task), error)
+        raise HedgeFailed(error, len(tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def complete_with_failover(model_name: str, candidates: list, prompt: str, conversation_id: str | None,
+                                 use_cache: bool, hedge: bool):
+    """
+    Try each healthy candidate in turn (optionally hedging the next one), without persisting anything.
+    Returns (adapter, model, answer, error): the winner and its answer, or the last
+    candidate tried and its error (adapter None if no candidate was healthy).
+    """
+    ordered = _ordered(model_name, candidates)
+    failed = (None, None, None, None)
+
+    i = 0
+    while i < len(ordered):
+        adapter, model = ordered[i]
+        if not health.acquire(adapter.name, model):
+            i += 1
+            continue
+
+        attempt = lambda candidate: (lambda: _complete_with(candidate[0], candidate[1], prompt, conversation_id,
+                                                            use_cache))
+        delay = health.p95(adapter.name, model, "completion") if hedge and i + 1 < len(ordered) else None
+        try:
+            if delay is not None:
+                winner, answer = await _first_success(
+                    attempt(ordered[i]), _guarded(ordered[i + 1], attempt(ordered[i + 1])), delay,
+                    lambda offset, error: _failed_over(ordered[i + offset], error)
+                )
+                adapter, model = ordered[i + winner]
+            else:
+                answer = await attempt(ordered[i])()
+        except HedgeFailed as e:
+            failed = (adapter, model, None, e.error)
+            i += e.started
+            continue
+        except Exception as e:
+            _failed_over((adapter, model), e)
+            failed = (adapter, model, None, e)
+            i += 1
+            continue
+
+        return adapter, model, answer, None
+
+    return failed
+
 
-    if model_name in ("openai", "gpt", "gpt-4", "gpt-4o", "gpt-4.1", "gpt-4.1-mini", "gpt-4.1-nano"):
-        return await ask_openai(prompt, conversation_id)
+async def _route_with_failover(model_name: str, candidates: list, prompt: str, conversation_id: str | None,
+                               use_cache: bool, hedge: bool) -> str:
+    """complete_with_failover, persisting the winner's answer once."""
+    adapter, model, answer, error = await complete_with_failover(model_name, candidates, prompt, conversation_id,
+                                                                 use_cache, hedge)
+    if adapter is None:
+        return f"No healthy provider available for '{model_name}'. Please try again shortly."
+    if error is not None:
+        return adapter.client.friendly_error(error)
+
+    if conversation_id:
+        await add_message(conversation_id, "user", prompt)
+        await add_message(conversation_id, "assistant", answer, model=model)
+    return answer
+
+
+async def stream_cached(client_module, model: str, message: str, history: list, usage: dict,
+                        use_cache: bool = True, conversation_id: str | None = None, prefill: str | None = None):
+    """
+    client_module.stream_chat behind the response cache.
+    A hit is replayed as a single delta (and sets usage["cached"]); a completed miss is stored.
+    With `prefill` (the start of the answer), only the continuation is streamed and nothing is cached.
+    """
+    upstream = limited_stream(client_module.PROVIDER, model, tracked_stream(
+        client_module.PROVIDER, model,
+        client_module.stream_chat(message, history, model, usage=usage, conversation_id=conversation_id,
+                                  prefill=prefill),
+        usage
+    ))
+
+    if not response_cache.ENABLED or not use_cache or prefill:
+        response_cache.response_cache.bypassed += 1
+        async for delta in upstream:
+            yield delta
+        return
+
+    messages = history + [{"role": "user", "content": message}]
+    key = response_cache.cache_key(model, client_module.GENERATION_PARAMS, messages)
+    answer = await response_cache.lookup(key, model, messages)
+    if answer is not None:
+        await upstream.aclose()
+        usage["cached"] = True
+        yield answer
+        return
+
+    parts = []
+    async for delta in upstream:
+        parts.append(delta)
+        yield delta
+    if parts:
+        await response_cache.store(key, "".join(parts), model, messages)
+
+
+async def _open_stream(adapter, model: str, prompt: str, conversation_id: str | None, use_cache: bool,
+                       usage: dict):
+    """Start a cached stream and wait for its first delta. Returns (stream, first delta)."""
+    history = []
+    if conversation_id:
+        history = await build_context(conversation_id, prompt, adapter.client.CONTEXT_BUDGET,
+                                      adapter.client.summarize)
+    stream = stream_cached(adapter.client, model, prompt, history, usage, use_cache, conversation_id)
+    try:
+        return stream, await stream.__anext__()
+    except BaseException:
+        await stream.aclose()
+        raise
+
+
+async def _open_with_failover(model_name: str, candidates: list, prompt: str, conversation_id: str | None,
+                              use_cache: bool, hedge: bool):
+    """
+    Streaming failover: providers are only switched before the first token.
+    Returns (adapter, model, stream, first delta, usage); raises the last error if every candidate failed.
+    """
+    ordered = _ordered(model_name, candidates, "ttft")
+    last_error = None
+
+    i = 0
+    while i < len(ordered):
+        adapter, model = ordered[i]
+        if not health.acquire(adapter.name, model):
+            i += 1
+            continue
+
+        usages = [{}, {}]
+        opened = []  # streams opened by a hedged race, so the loser can be closed
+
+        def attempt(offset):
+            async def run():
+                candidate_adapter, candidate_model = ordered[i + offset]
+                result = await _open_stream(candidate_adapter, candidate_model, prompt, conversation_id,
+                                            use_cache, usages[offset])
+                opened.append(result[0])
+                return result
+            return run
+
+        delay = health.p95(adapter.name, model, "ttft") if hedge and i + 1 < len(ordered) else None
+        try:
+            if delay is not None:
+                winner, (stream, first) = await _first_success(
+                    attempt(0), _guarded(ordered[i + 1], attempt(1)), delay,
+                    lambda offset, error: _failed_over(ordered[i + offset], error)
+                )
+            else:
+                winner, (stream, first) = 0, await attempt(0)()
+        except HedgeFailed as e:
+            last_error = e.error
+            i += e.started
+            continue
+        except Exception as e:
+            _failed_over((adapter, model), e)
+            last_error = e
+            i += 1
+            continue
+
+        for other in opened:
+            if other is not stream:
+                await other.aclose()
+        adapter, model = ordered[i + winner]
+        return adapter, model, stream, first, usages[winner]
+
+    if last_error is None:
+        raise RuntimeError(f"No healthy provider available for '{model_name}'.")
+    raise last_error
+
+
+async def stream_to_model(model_name: str, prompt: str, conversation_id: str | None, use_cache: bool = True,
+                          hedge: bool | None = None, route: dict | None = None):
+    """
+    Streaming counterpart of route_to_model.
+
+    Yields event dicts: {"type": "delta", "text": ...} while the answer is generated,
+    then a single {"type": "done", ...} or {"type": "error", ...}.
+    The assembled answer is written to the conversation store once, at the end.
+    The chosen adapter and model are written into `route` when given.
+    """
+    route_span = start_span("route.stream", model=model_name)
+    try:
+        async for event in _stream_to_model(model_name, prompt, conversation_id, use_cache, hedge, route):
+            yield event
+    finally:
+        if route_span is not None:
+            route_span.finish()
+
+
+async def _stream_to_model(model_name: str, prompt: str, conversation_id: str | None, use_cache: bool,
+                           hedge: bool | None, route: dict | None):
+    parts = []
+    candidates = registry.candidates(model_name)
+
+    if candidates is not None:
+        try:
+            adapter, model, stream, first, usage = await _open_with_failover(
+                model_name, candidates, prompt, conversation_id, use_cache,
+                HEDGE_ENABLED if hedge is None else hedge
+            )
+        except Exception as e:
+            fallback = candidates[-1][0] if candidates else None
+            yield {"type": "error", "error": fallback.client.friendly_error(e) if fallback else str(e)}
+            return
+        parts.append(first)
+        yield {"type": "delta", "text": first}
+    else:
+        adapter, model = registry.resolve(model_name)
+        if adapter is None:
+            yield {"type": "error", "error": f"Model '{model_name.lower()}' not supported yet."}
+            return
+        if not health.acquire(adapter.name, model):
+            yield {"type": "error", "error": circuit_open_message(model)}
+            return
+
+        history = []
+        if conversation_id:
+            history = await build_context(conversation_id, prompt, adapter.client.CONTEXT_BUDGET,
+                                          adapter.client.summarize)
+        usage = {}
+        stream = stream_cached(adapter.client, model, prompt, history, usage, use_cache, conversation_id)
+
+    if route is not None:
+        route.update(adapter=adapter, model=model)
+    try:
+        async for delta in stream:
+            parts.append(delta)
+            yield {"type": "delta", "text": delta}
+    except Exception as e:
+        yield {"type": "error", "error": adapter.client.friendly_error(e)}
+        return
+
+    answer = "".join(parts)
+    if conversation_id and answer:
+        await add_message(conversation_id, "user", prompt)
+        await add_message(conversation_id, "assistant", answer, model=model)
+
+    yield {"type": "done", "model": model, "response": answer, "usage": usage}
+
+
+async def continue_stream(adapter, model: str, prompt: str, conversation_id: str | None, prefill: str):
+    """
+    Finish a partial answer without regenerating it: `prefill` is sent as the
+    start of the assistant's reply and only the rest is streamed. Events are as
+    for stream_to_model; "done" carries the whole answer, which is stored.
+    """
+    if not health.acquire(adapter.name, model):
+        yield {"type": "error", "error": circuit_open_message(model)}
+        return
 
-    if model_name in ("claude", "claude-3", "claude-3-5"):
-        return await ask_claude(prompt, conversation_id)
+    history = []
+    if conversation_id:
+        history = await build_context(conversation_id, prompt + prefill, adapter.client.CONTEXT_BUDGET,
+                                      adapter.client.summarize)
+    usage = {}
+    parts = [prefill]
+    try:
+        async for delta in stream_cached(adapter.client, model, prompt, history, usage, False, conversation_id,
+                                         prefill):
+            parts.append(delta)
+            yield {"type": "delta", "text": delta}
+    except Exception as e:
+        yield {"type": "error", "error": adapter.client.friendly_error(e)}
+        return
 
-    if model_name in ("gemini", "gemini-2", "gemini-2.0-flash", "gemini-2.5-pro"):
-        return await ask_gemini(prompt, conversation_id)
+    answer = "".join(parts)
+    if conversation_id:
+        await add_message(conversation_id, "user", prompt)
+        await add_message(conversation_id, "assistant", answer, model=model)
 
-    return f"Model '{model_name}' not supported yet."
\ No newline at end of file
+    yield {"type": "done", "model": model, "response": answer, "usage": usage}
@@ -0,0 +1,73 @@
+import asyncio
+import math
+
+# A call that ends this much before a caller's deadline is still joined (deadlines computed moments apart)
+DEADLINE_SLACK = 0.05
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task, deadline: float):
+        self.task = task
+        self.deadline = deadline  # loop time the leader is allowed to run until
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight calls: while a call for `key` is running, later
+    callers await the same result instead of starting their own.
+
+    The shared call is shielded from any single waiter's cancellation, so one
+    client disconnecting doesn't fail the others. It is only cancelled when the
+    last waiter goes away.
+
+    Each caller waits at most its own `timeout`, and only joins a call whose
+    leader may run at least that long; otherwise it starts its own call, which
+    later callers join instead. So no caller inherits another's deadline.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, _Call] = {}
+        self.leaders = 0     # calls that actually went upstream
+        self.coalesced = 0   # callers that piggybacked on one of them
+
+    async def do(self, key: str, fn, timeout: float | None = None):
+        deadline = asyncio.get_running_loop().time() + timeout if timeout is not None else math.inf
+        call = self._inflight.get(key)
+        if call is None or call.deadline < deadline - DEADLINE_SLACK:
+            call = _Call(asyncio.ensure_future(fn()), deadline)
+            self._inflight[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.task), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            if call.waiters == 1 and not call.task.done():
+                # Nobody else wants the answer; stop paying for it
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call):
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+        # Retrieve the exception so an abandoned, failed call doesn't log a warning
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def stats(self) -> dict:
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._inflight),
+            "upstream_calls": self.leaders,
+            "coalesced_calls": self.coalesced,
+            "coalescing_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
+
+
+provider_calls = SingleFlight()
@@ -0,0 +1,43 @@
+import asyncio
+import json
+
+# Sent after a partial assistant message, for providers without native prefill
+CONTINUE_PROMPT = ("Your previous reply was cut off. Continue it from exactly where it stopped, "
+                   "without repeating any of it or adding any preamble.")
+
+
+def sse_event(event: dict) -> str:
+    """Format an event dict as one Server-Sent Events frame, named after its "type"."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def merge_streams(streams: dict):
+    """
+    Interleave several async event streams into one, in arrival order.
+
+    `streams` maps a tag (e.g. the model name) to an async iterator of event dicts.
+    Every event is yielded with a "model" key set to its tag. If the consumer stops
+    early (client disconnect), the remaining producers are cancelled.
+    """
+    queue = asyncio.Queue()
+    finished = object()
+
+    async def pump(tag, stream):
+        try:
+            async for event in stream:
+                await queue.put({"model": tag, **event})
+        finally:
+            await queue.put(finished)
+
+    tasks = [asyncio.create_task(pump(tag, stream)) for tag, stream in streams.items()]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            event = await queue.get()
+            if event is finished:
+                remaining -= 1
+                continue
+            yield event
+    finally:
+        for task in tasks:
+            task.cancel()
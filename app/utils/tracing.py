@@ -0,0 +1,223 @@
+import contextlib
+import contextvars
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))  # fraction of requests traced; "X-Trace: 1" forces one
+BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))  # recent traces kept for GET /debug/traces
+TRACE_FILE = os.getenv("TRACE_FILE")  # also append finished traces here as JSON lines
+# Allow "X-Profile: 1" to attach a cProfile of the request to its trace
+PROFILING_ENABLED = os.getenv("TRACE_PROFILING", "0") == "1"
+PROFILE_TOP = 40  # functions listed per profile
+
+_current: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    """The spans of one sampled request."""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.wall_time = time.time()
+        self.spans: list[Span] = []
+        self.profile: str | None = None
+        self.finished = False
+        self._ids = itertools.count(1)
+
+    def to_dict(self, root: "Span") -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": root.name,
+            "timestamp": self.wall_time,
+            "duration_ms": round((root.ended - root.started) * 1000, 3),
+            "spans": [span.to_dict() for span in sorted(self.spans, key=lambda span: span.started)],
+            "profile": self.profile,
+        }
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "started", "ended")
+
+    def __init__(self, trace: Trace, parent: "Span | None", name: str, attrs: dict):
+        self.trace = trace
+        self.span_id = next(trace._ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.ended = None
+
+    def finish(self, error: BaseException | None = None):
+        self.ended = time.perf_counter()
+        if error is not None:
+            self.attrs["error"] = type(error).__name__
+        # Spans still running when the request ends (background work) are dropped
+        if not self.trace.finished:
+            self.trace.spans.append(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.started - self.trace.started) * 1000, 3),
+            "duration_ms": round((self.ended - self.started) * 1000, 3),
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }
+
+
+class _SpanContext:
+    __slots__ = ("parent", "name", "attrs", "span", "token")
+
+    def __init__(self, parent: Span, name: str, attrs: dict):
+        self.parent = parent
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> Span:
+        self.span = Span(self.parent.trace, self.parent, self.name, self.attrs)
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        self.span.finish(exc)
+        return False
+
+
+_NOT_TRACED = contextlib.nullcontext()
+
+
+def span(name: str, **attrs):
+    """
+    `with span("store.get_history", conversation_id=...):` times a block as a
+    child of the current span. Outside a sampled request this is a shared no-op.
+    The current span is a contextvar, so tasks started inside the block
+    (asyncio.gather, create_task) nest under it too.
+    """
+    parent = _current.get()
+    if parent is None:
+        return _NOT_TRACED
+    return _SpanContext(parent, name, attrs)
+
+
+def start_span(name: str, **attrs) -> Span | None:
+    """
+    A child span that is not made current, for code that can't wrap a `with`
+    around its work (async generators). Call .finish() on it; None when not sampled.
+    """
+    parent = _current.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, parent, name, attrs)
+
+
+class TraceExporter:
+    """Keeps recent traces in a ring buffer and optionally appends them to a JSONL file."""
+
+    def __init__(self, size: int = BUFFER_SIZE, path: str | None = TRACE_FILE):
+        self._recent: deque[dict] = deque(maxlen=size)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: dict):
+        self._recent.append(trace)
+        if self.path:
+            line = json.dumps(trace) + "\n"
+            with self._lock, open(self.path, "a") as f:
+                f.write(line)
+
+    def recent(self, limit: int = 20) -> list[dict]:
+        """Newest first, without profiles (fetch a single trace for that)."""
+        traces = list(self._recent)[-limit:]
+        return [{**trace, "profile": trace["profile"] is not None} for trace in reversed(traces)]
+
+    def get(self, trace_id: str) -> dict | None:
+        for trace in list(self._recent):
+            if trace["trace_id"] == trace_id:
+                return trace
+        return None
+
+
+exporter = TraceExporter()
+
+_profiler_lock = threading.Lock()  # cProfile can only profile one request at a time
+
+
+def _start_profile():
+    if not PROFILING_ENABLED or not _profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_profile(profiler) -> str:
+    profiler.disable()
+    _profiler_lock.release()
+    out = io.StringIO()
+    out.write("# Whole event-loop thread while this request ran: includes concurrent requests.\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+    return out.getvalue()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that starts a trace for sampled requests (TRACE_SAMPLE_RATE,
+    or forced with an "X-Trace: 1" header) and returns its id in "X-Trace-Id".
+    With TRACE_PROFILING=1, an "X-Profile: 1" header also profiles the request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        forced = headers.get(b"x-trace") == b"1"
+        if not forced and not (SAMPLE_RATE and random.random() < SAMPLE_RATE):
+            return await self.app(scope, receive, send)
+
+        trace = Trace()
+        root = Span(trace, None, f"{scope['method']} {scope['path']}", {})
+        token = _current.set(root)
+        profiler = _start_profile() if headers.get(b"x-profile") == b"1" else None
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace.trace_id.encode())]
+                root.attrs["status"] = message["status"]
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            if profiler is not None:
+                trace.profile = _stop_profile(profiler)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                root.name = f"{scope['method']} {route}"
+            root.finish(error)
+            trace.finished = True
+            exporter.export(trace.to_dict(root))
@@ -0,0 +1,334 @@
+# Async front-end for conversation_store.
+# The sync store does blocking SQLite I/O, so calling it from an `async def`
+# handler stalls the whole event loop. Reads run on a small dedicated thread
+# pool; writes go through a write-behind queue that group-commits every
+# message that arrived while the previous commit was in flight.
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.metrics import DB_SECONDS
+from app.utils.tracing import span
+from backend import batch_store, conversation_store, generation_store, retention_store, transfer_store
+from backend.database import utc_now
+
+logger = logging.getLogger(__name__)
+
+# "commit": add_message returns once its batch is committed (no loss on crash).
+# "async":  add_message returns immediately; the batch is committed shortly after.
+DURABILITY = os.getenv("STORE_DURABILITY", "commit")
+BATCH_SIZE = int(os.getenv("STORE_BATCH_SIZE", "256"))
+READ_WORKERS = int(os.getenv("STORE_READ_WORKERS", "4"))
+
+_read_executor = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="store-read")
+# One writer thread: SQLite allows a single writer anyway
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-write")
+
+
+class WriteBehindQueue:
+    """
+    Collects add_message calls and commits them in batches on the writer thread.
+    Rows commit in queue order, so once the last row queued for a conversation
+    (or overall) is committed, everything queued before it is too.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        self.batch_size = batch_size
+        self._loop = None
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._last: asyncio.Future | None = None
+        self._last_by_conversation: dict[str, asyncio.Future] = {}
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._last = None
+            self._last_by_conversation = {}
+            self._worker = asyncio.create_task(self._run())
+
+    async def put(self, row: tuple) -> asyncio.Future:
+        """Queue one row; the returned future resolves when it is committed."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._last = future
+        self._last_by_conversation[row[0]] = future
+        await self._queue.put((row, future))
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Everything that queued up during the last commit goes into this one
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            rows = [row for row, _ in batch]
+            try:
+                await loop.run_in_executor(_write_executor, _timed, "write", conversation_store.add_messages, rows)
+                error = None
+            except Exception as e:
+                logger.error("Error committing %d messages: %r", len(rows), e)
+                error = e
+
+            for row, future in batch:
+                if self._last_by_conversation.get(row[0]) is future:
+                    del self._last_by_conversation[row[0]]
+                if future.done():
+                    continue
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(None)
+
+    async def flush(self, conversation_id: str | None = None):
+        """
+        Wait until the rows queued so far (only this conversation's, when given)
+        have been committed. Rows queued after the call are not waited for.
+        """
+        if self._loop is not asyncio.get_running_loop():
+            return
+        last = self._last if conversation_id is None else self._last_by_conversation.get(conversation_id)
+        if last is not None and not last.done():
+            await asyncio.wait([last])
+
+    async def close(self):
+        """Flush and stop the worker (call on shutdown)."""
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+
+write_queue = WriteBehindQueue()
+
+
+def _timed(kind: str, func, *args):
+    """Run a store call on its thread, recording how long it took there (queueing excluded)."""
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        DB_SECONDS.observe(time.perf_counter() - started, func.__name__, kind)
+
+
+async def add_message(conversation_id: str, role: str, content: str, model=None):
+    """Async add_message. Returns the message timestamp like the sync version."""
+    timestamp = utc_now()
+    future = await write_queue.put((conversation_id, role, content, model, timestamp))
+
+    if DURABILITY == "commit":
+        with span("store.add_message", role=role):
+            await future
+    else:
+        # Nobody awaits it; mark any error as retrieved so asyncio doesn't warn
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    return timestamp
+
+
+async def _read(func, *args, conversation_id: str | None = None):
+    with span(f"store.{func.__name__}"):
+        # Read-your-writes: don't read past messages queued before this call
+        # (only the conversation's own, for reads scoped to one)
+        await write_queue.flush(conversation_id)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_read_executor, _timed, "read", func, *args)
+
+
+async def get_history(conversation_id: str, limit: int | None = None, before: int | None = None,
+                      after: int | None = None):
+    """Async get_history."""
+    return await _read(conversation_store.get_history, conversation_id, limit, before, after,
+                       conversation_id=conversation_id)
+
+
+async def get_history_page(conversation_id: str, limit: int = 50, before: int | None = None,
+                           after: int | None = None):
+    """Async get_history_page."""
+    return await _read(conversation_store.get_history_page, conversation_id, limit, before, after,
+                       conversation_id=conversation_id)
+
+
+async def get_context_window(conversation_id: str, budget: int, strategy: str = "latest", reserve: int = 0):
+    """Async get_context_window."""
+    return await _read(conversation_store.get_context_window, conversation_id, budget, strategy, reserve,
+                       conversation_id=conversation_id)
+
+
+async def get_unsummarized(conversation_id: str, through_id: int):
+    """Async get_unsummarized."""
+    return await _read(conversation_store.get_unsummarized, conversation_id, through_id,
+                       conversation_id=conversation_id)
+
+
+async def save_summary(conversation_id: str, summary: str, through_id: int):
+    """Async save_summary (runs on the writer thread)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_write_executor, _timed, "write", conversation_store.save_summary,
+                                      conversation_id, summary, through_id)
+
+
+async def list_conversations(limit: int | None = None, before: str | None = None, after: str | None = None):
+    """Async list_conversations."""
+    return await _read(conversation_store.list_conversations, limit, before, after)
+
+
+async def list_conversations_page(limit: int = 50, before: str | None = None, after: str | None = None):
+    """Async list_conversations_page."""
+    return await _read(conversation_store.list_conversations_page, limit, before, after)
+
+
+async def search_messages(query: str, model: str | None = None, since: str | None = None,
+                          until: str | None = None, limit: int = 20, offset: int = 0):
+    """Async search_messages."""
+    return await _read(conversation_store.search_messages, query, model, since, until, limit, offset)
+
+
+async def delete_conversation(conversation_id: str):
+    """Async delete_conversation."""
+    await write_queue.flush(conversation_id)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_write_executor, _timed, "write", conversation_store.delete_conversation,
+                                      conversation_id)
+
+
+async def _write(func, *args):
+    with span(f"store.{func.__name__}"):
+        # Ordered after the messages queued before this call, on the single writer thread
+        await write_queue.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_write_executor, _timed, "write", func, *args)
+
+
+async def create_batch(batch_id: str, items: list[dict]):
+    """Async batch_store.create_batch."""
+    return await _write(batch_store.create_batch, batch_id, items)
+
+
+async def save_batch_results(batch_id: str, results: list[dict]):
+    """Async batch_store.save_results."""
+    return await _write(batch_store.save_results, batch_id, results)
+
+
+async def get_batch(batch_id: str):
+    """Async batch_store.get_batch."""
+    return await _read(batch_store.get_batch, batch_id)
+
+
+async def get_batch_items(batch_id: str, pending: bool):
+    """Async batch_store.get_items."""
+    return await _read(batch_store.get_items, batch_id, pending)
+
+
+async def append_generation(generation: dict, text: str):
+    """Async generation_store.append_generation."""
+    return await _write(generation_store.append_generation, generation, text)
+
+
+async def get_generation(task_id: str):
+    """Async generation_store.get_generation."""
+    return await _read(generation_store.get_generation, task_id)
+
+
+async def delete_generation(task_id: str):
+    """Async generation_store.delete_generation."""
+    return await _write(generation_store.delete_generation, task_id)
+
+
+async def stale_conversations(cutoff: str, limit: int):
+    """Async retention_store.stale_conversations."""
+    return await _read(retention_store.stale_conversations, cutoff, limit)
+
+
+async def delete_stale_messages(conversation_ids: list[str], cutoff: str, limit: int):
+    """Async retention_store.delete_messages."""
+    return await _write(retention_store.delete_messages, conversation_ids, cutoff, limit)
+
+
+async def delete_stale_conversations(conversation_ids: list[str], cutoff: str):
+    """Async retention_store.delete_conversations."""
+    return await _write(retention_store.delete_conversations, conversation_ids, cutoff)
+
+
+async def delete_stale_generations(cutoff: str, limit: int):
+    """Async retention_store.delete_generations."""
+    return await _write(retention_store.delete_generations, cutoff, limit)
+
+
+async def delete_stale_batches(cutoff: str, limit: int):
+    """Async retention_store.delete_batches."""
+    return await _write(retention_store.delete_batches, cutoff, limit)
+
+
+async def incremental_vacuum(pages: int):
+    """Async retention_store.incremental_vacuum."""
+    return await _write(retention_store.incremental_vacuum, pages)
+
+
+async def auto_vacuum_mode():
+    """Async retention_store.auto_vacuum_mode."""
+    return await _read(retention_store.auto_vacuum_mode)
+
+
+async def export_conversations(since: str | None = None, until: str | None = None, model: str | None = None):
+    """
+    Async transfer_store.export_chunks: NDJSON text chunks, each read and
+    encoded on a read thread while the previous one is being sent.
+    """
+    await write_queue.flush()
+    loop = asyncio.get_running_loop()
+    chunks = transfer_store.export_chunks(since, until, model)
+    try:
+        while (chunk := await loop.run_in_executor(_read_executor, next, chunks, None)) is not None:
+            yield chunk
+    finally:
+        await loop.run_in_executor(_read_executor, chunks.close)
+
+
+async def import_conversations(body, on_conflict: str = "skip", defer_indexes: bool = False) -> dict:
+    """
+    Import NDJSON from an async iterator of byte chunks (a request body).
+    Lines are parsed and inserted on the writer thread, IMPORT_BATCH_LINES per
+    transaction, while the next batch is read. With `defer_indexes` the message
+    and search indexes are dropped for the import and rebuilt at the end.
+    """
+    state = transfer_store.ImportState(on_conflict)
+    if defer_indexes:
+        await _write(transfer_store.drop_indexes)
+    pending = None
+    try:
+        lines, rest = [], b""
+        async for chunk in body:
+            *complete, rest = (rest + chunk).split(b"\n")
+            lines.extend(complete)
+            if len(lines) >= transfer_store.IMPORT_BATCH_LINES:
+                if pending is not None:
+                    await pending
+                pending = asyncio.ensure_future(_write(transfer_store.import_lines, lines, state))
+                lines = []
+        if rest:
+            lines.append(rest)
+        if pending is not None:
+            await pending
+            pending = None
+        if lines:
+            await _write(transfer_store.import_lines, lines, state)
+    finally:
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)
+        if defer_indexes:
+            await asyncio.shield(_write(transfer_store.create_indexes))
+    return state.result()
+
+
+async def shutdown():
+    """Flush-on-shutdown hook: commit anything still queued and stop the threads."""
+    await write_queue.close()
+    _read_executor.shutdown(wait=True)
+    _write_executor.shutdown(wait=True)
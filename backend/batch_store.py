@@ -0,0 +1,91 @@
+# Storage for /ask/batch jobs.
+# Items are written once when the batch is created; results are written back in
+# chunks, each chunk in one transaction together with the conversation messages
+# it produces.
+
+from backend.database import pooled_connection, utc_now
+from backend.conversation_store import insert_messages, cache_messages
+
+def create_batch(batch_id: str, items: list[dict]):
+    """Store a new batch and its items (all pending)."""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO batches (batch_id, total) VALUES (?, ?)", (batch_id, len(items)))
+        cursor.executemany(
+            "INSERT INTO batch_items (batch_id, item_index, prompt, model, conversation_id) VALUES (?, ?, ?, ?, ?)",
+            [
+                (batch_id, index, item["prompt"], item["model"], item.get("conversation_id"))
+                for index, item in enumerate(items)
+            ]
+        )
+        conn.commit()
+
+def save_results(batch_id: str, results: list[dict]):
+    """
+    Record a chunk of finished items in one transaction. Successful items that
+    belong to a conversation also get their user/assistant messages stored.
+    Each result is {"index", "status", "response", "prompt", "model", "concrete_model", "conversation_id"}.
+    """
+    if not results:
+        return
+
+    timestamp = utc_now()
+    messages = []
+    for result in results:
+        if result["status"] == "ok" and result.get("conversation_id"):
+            messages.append((result["conversation_id"], "user", result["prompt"], None, timestamp))
+            messages.append((result["conversation_id"], "assistant", result["response"],
+                             result["concrete_model"], timestamp))
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "UPDATE batch_items SET status = ?, response = ?, completed_at = ? "
+            "WHERE batch_id = ? AND item_index = ?",
+            [(result["status"], result["response"], timestamp, batch_id, result["index"]) for result in results]
+        )
+        inserted = insert_messages(cursor, messages) if messages else {}
+        conn.commit()
+
+    cache_messages(inserted)
+
+def get_batch(batch_id: str):
+    """Batch metadata with per-status counts, or None."""
+    with pooled_connection() as conn:
+        batch = conn.execute(
+            "SELECT batch_id, created_at, total FROM batches WHERE batch_id = ?", (batch_id,)
+        ).fetchone()
+        if batch is None:
+            return None
+        counts = conn.execute(
+            "SELECT status, COUNT(*) AS n FROM batch_items WHERE batch_id = ? GROUP BY status", (batch_id,)
+        ).fetchall()
+
+    return {
+        "batch_id": batch["batch_id"],
+        "created_at": batch["created_at"],
+        "total": batch["total"],
+        "counts": {row["status"]: row["n"] for row in counts},
+    }
+
+def get_items(batch_id: str, pending: bool):
+    """Pending items (to run) or finished items (to replay), in index order."""
+    condition = "status = 'pending'" if pending else "status != 'pending'"
+    with pooled_connection() as conn:
+        rows = conn.execute(
+            "SELECT item_index, prompt, model, conversation_id, status, response FROM batch_items "
+            f"WHERE batch_id = ? AND {condition} ORDER BY item_index",
+            (batch_id,)
+        ).fetchall()
+
+    return [
+        {
+            "index": row["item_index"],
+            "prompt": row["prompt"],
+            "model": row["model"],
+            "conversation_id": row["conversation_id"],
+            "status": row["status"],
+            "response": row["response"],
+        }
+        for row in rows
+    ]
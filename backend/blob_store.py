@@ -0,0 +1,69 @@
+# Content-addressed storage for message bodies.
+# A body of at least MIN_BYTES is stored once in `blobs`, keyed by a hash of
+# its text, and messages point at it with blob_id (their content is then '').
+# So the prompt /compare stores next to every model's answer, or a canned
+# error reply, costs one row however often it repeats. Blobs of at least
+# COMPRESS_MIN_BYTES are zlib-compressed when that makes them smaller.
+# Triggers on `messages` (see database._add_blobs) keep the reference counts
+# and the search index in step; reads decode with the blob_text() SQL function.
+
+import hashlib
+import os
+import zlib
+
+MIN_BYTES = int(os.getenv("BLOB_MIN_BYTES", "64"))  # shorter bodies stay inline in messages.content
+COMPRESS_MIN_BYTES = int(os.getenv("BLOB_COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = 6
+
+# blobs.encoding
+RAW, ZLIB = 0, 1
+
+# A message's text, for queries over `messages m` joined with BLOB_JOIN
+CONTENT_SQL = "CASE WHEN m.blob_id IS NULL THEN m.content ELSE blob_text(b.data, b.encoding) END"
+BLOB_JOIN = "LEFT JOIN blobs b ON b.id = m.blob_id"
+
+def digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def encode(data: bytes) -> tuple[int, bytes]:
+    """(encoding, stored bytes) for a body."""
+    if len(data) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(data, COMPRESS_LEVEL)
+        if len(packed) < len(data):
+            return ZLIB, packed
+    return RAW, data
+
+def blob_text(data: bytes | None, encoding: int | None) -> str | None:
+    """Decode a stored blob back to text (registered as the blob_text() SQL function)."""
+    if data is None:
+        return None
+    if encoding == ZLIB:
+        data = zlib.decompress(data)
+    return bytes(data).decode("utf-8")
+
+def register_functions(conn):
+    """Make blob_text() available on a connection; every connection that reads or writes messages needs it."""
+    conn.create_function("blob_text", 2, blob_text, deterministic=True)
+
+def store(cursor, content: str) -> tuple[str, int | None]:
+    """
+    Store a message body inside the caller's transaction.
+    Returns (content, blob_id) for the messages row: short text stays inline,
+    anything longer is found by hash or written as a new blob. The reference
+    is counted by the insert trigger on `messages`.
+    """
+    data = content.encode("utf-8")
+    if len(data) < MIN_BYTES:
+        return content, None
+
+    key = digest(data)
+    row = cursor.execute("SELECT id FROM blobs WHERE hash = ?", (key,)).fetchone()
+    if row is not None:
+        return "", row[0]
+
+    encoding, packed = encode(data)
+    cursor.execute(
+        "INSERT INTO blobs (hash, encoding, size, data) VALUES (?, ?, ?, ?)",
+        (key, encoding, len(data), packed)
+    )
+    return "", cursor.lastrowid
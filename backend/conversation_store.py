@@ -2,134 +2,482 @@
 # For now it resets every time you restart the server.
 # Later we can swap this to Redis or a database.
 
-from datetime import datetime
-from backend.database import get_connection
+import re
+from backend.blob_store import BLOB_JOIN, CONTENT_SQL, store as store_body
+from backend.database import pooled_connection, utc_now
+from backend.history_cache import history_cache, MAX_MESSAGES
+
+# Keeps the denormalized summary on `conversations` in step with `messages`,
+# so list_conversations never has to scan the messages table. Rows can arrive
+# out of timestamp order (imports, batches), so an older one never moves last_message_at back.
+_UPSERT_SUMMARY = """
+    INSERT INTO conversations (conversation_id, message_count, last_message_at, last_model)
+    VALUES (?, 1, ?, ?)
+    ON CONFLICT (conversation_id) DO UPDATE SET
+        message_count = message_count + 1,
+        last_message_at = MAX(COALESCE(last_message_at, ''), excluded.last_message_at),
+        last_model = CASE WHEN excluded.last_message_at >= COALESCE(last_message_at, '')
+                          THEN COALESCE(excluded.last_model, last_model) ELSE last_model END
+"""
+
+# Message rows with their text, for queries over `messages m` + BLOB_JOIN
+_MESSAGE_COLUMNS = f"m.id, m.role, {CONTENT_SQL} AS content, m.token_count"
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English text).
+    Stored per message at insert time, so windows never re-tokenize history.
+    """
+    return (len(text) + 3) // 4
 
 def add_message(conversation_id: str, role: str, content: str, model=None):
     """Add a message to a conversation."""
-    timestamp = datetime.now().isoformat()
+    timestamp = utc_now()
 
-    conn = get_connection()
-    cursor = conn.cursor()
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
 
-    # Ensure conversation exists
-    cursor.execute(
-        "INSERT OR IGNORE INTO conversations (conversation_id) VALUES (?)",
-        (conversation_id,)
-    )
+        # Insert message (long bodies go to the blob store)
+        token_count = estimate_tokens(content)
+        inline, blob_id = store_body(cursor, content)
+        cursor.execute(
+            "INSERT INTO messages (conversation_id, role, content, model, timestamp, token_count, blob_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (conversation_id, role, inline, model, timestamp, token_count, blob_id)
+        )
+        message_id = cursor.lastrowid
 
-    # Insert message
-    cursor.execute(
-        "INSERT INTO messages (conversation_id, role, content, model, timestamp) VALUES (?, ?, ?, ?, ?)",
-        (conversation_id, role, content, model, timestamp)
-    )
+        # Create the conversation or bump its summary
+        cursor.execute(_UPSERT_SUMMARY, (conversation_id, timestamp, model))
+
+        conn.commit()
 
-    conn.commit()
-    conn.close()
+    history_cache.append(conversation_id, [
+        {"id": message_id, "role": role, "content": content, "token_count": token_count}
+    ])
     return timestamp
 
-def get_history(conversation_id: str):
-    """Retrieve all messages for a conversation."""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        SELECT role, content, timestamp
-        FROM messages
-        WHERE conversation_id = ?
-        ORDER BY timestamp ASC
-        """,
-        (conversation_id,)
+def add_messages(rows: list[tuple]):
+    """
+    Add many messages in one transaction (group commit).
+    Each row is (conversation_id, role, content, model, timestamp).
+    """
+    if not rows:
+        return
+
+    with pooled_connection() as conn:
+        inserted = insert_messages(conn.cursor(), rows)
+        conn.commit()
+
+    cache_messages(inserted)
+
+def insert_messages(cursor, rows: list[tuple]) -> dict[str, list[dict]]:
+    """
+    Insert message rows and bump conversation summaries inside the caller's
+    transaction. Returns the new messages per conversation; pass them to
+    cache_messages() once the transaction has committed.
+    """
+    token_counts = [estimate_tokens(row[2]) for row in rows]
+    bodies = [store_body(cursor, row[2]) for row in rows]
+    cursor.executemany(
+        "INSERT INTO messages (conversation_id, role, content, model, timestamp, token_count, blob_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (conversation_id, role, inline, model, timestamp, tokens, blob_id)
+            for (conversation_id, role, _, model, timestamp), tokens, (inline, blob_id)
+            in zip(rows, token_counts, bodies)
+        ]
+    )
+    # One statement inside one transaction, so the new ids are consecutive
+    last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+    cursor.executemany(
+        _UPSERT_SUMMARY,
+        [(conversation_id, timestamp, model) for conversation_id, _, _, model, timestamp in rows]
+    )
+
+    by_conversation = {}
+    first_id = last_id - len(rows) + 1
+    for offset, ((conversation_id, role, content, _, _), tokens) in enumerate(zip(rows, token_counts)):
+        by_conversation.setdefault(conversation_id, []).append(
+            {"id": first_id + offset, "role": role, "content": content, "token_count": tokens}
+        )
+    return by_conversation
+
+def cache_messages(by_conversation: dict[str, list[dict]]):
+    """Write-through of committed messages to the history cache."""
+    for conversation_id, messages in by_conversation.items():
+        history_cache.append(conversation_id, messages)
+
+def _history_rows(conversation_id: str, limit=None, before=None, after=None):
+    """
+    Fetch message rows oldest-first, optionally as a keyset window on message id.
+
+    With a limit and no `after`, returns the latest `limit` messages (older than
+    `before` if given). With `after`, returns the first `limit` messages newer than it.
+    """
+    query = f"SELECT m.id, m.role, {CONTENT_SQL} AS content FROM messages m {BLOB_JOIN} WHERE m.conversation_id = ?"
+    params = [conversation_id]
+    if before is not None:
+        query += " AND m.id < ?"
+        params.append(before)
+    if after is not None:
+        query += " AND m.id > ?"
+        params.append(after)
+
+    # Walk the index from whichever end the window is anchored to
+    newest_first = after is None and limit is not None
+    query += " ORDER BY m.id DESC" if newest_first else " ORDER BY m.id ASC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    with pooled_connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    if limit is not None and after is None:
+        rows.reverse()
+    return rows
+
+def _cached_conversation(conversation_id: str):
+    """
+    The conversation's cache entry, loading it from SQLite on a miss.
+    Returns None when the cache is off or the conversation is too long to cache.
+    """
+    if not history_cache.enabled:
+        return None
+    entry = history_cache.get(conversation_id)
+    if entry is not None:
+        return entry
+
+    seq = history_cache.begin_fill()
+    with pooled_connection() as conn:
+        summary = conn.execute(
+            "SELECT message_count, summary, summary_through FROM conversations WHERE conversation_id = ?",
+            (conversation_id,)
+        ).fetchone()
+        if summary is not None and summary["message_count"] > MAX_MESSAGES:
+            return None
+        rows = conn.execute(
+            f"SELECT {_MESSAGE_COLUMNS} FROM messages m {BLOB_JOIN} WHERE m.conversation_id = ? ORDER BY m.id ASC",
+            (conversation_id,)
+        ).fetchall()
+
+    messages = [
+        {"id": row["id"], "role": row["role"], "content": row["content"], "token_count": row["token_count"]}
+        for row in rows
+    ]
+    return history_cache.fill(
+        conversation_id, messages,
+        summary["summary"] if summary else None,
+        summary["summary_through"] if summary else None,
+        seq
     )
 
-    rows = cursor.fetchall()
-    conn.close()
+def get_history(conversation_id: str, limit: int | None = None, before: int | None = None,
+                after: int | None = None):
+    """
+    Retrieve messages for a conversation, oldest first.
+    Pass `limit` (and optionally a `before`/`after` message id) to get a window.
+    """
+    if limit is None and before is None and after is None:
+        entry = _cached_conversation(conversation_id)
+        if entry is not None:
+            return [{"role": msg["role"], "content": msg["content"]} for msg in entry.messages]
+
+    rows = _history_rows(conversation_id, limit, before, after)
 
     # Convert to list of dicts
     return [{"role": row["role"], "content": row["content"]} for row in rows]
 
-def list_conversations():
-    """List all conversations with metadata."""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT
-            c.conversation_id,
-            c.created_at,
-            COUNT(m.id) as message_count,
-            MAX(m.timestamp) as last_message_at
-        FROM conversations c
-        LEFT JOIN messages m ON c.conversation_id = m.conversation_id
-        GROUP BY c.conversation_id 
-        ORDER BY last_message_at DESC
-    """)
-
-    rows = cursor.fetchall()
-    conn.close()
+def get_history_page(conversation_id: str, limit: int = 50, before: int | None = None,
+                     after: int | None = None):
+    """
+    One page of history plus keyset cursors.
+
+    `next_before` fetches the page of older messages, `next_after` the page of newer
+    ones; each is None when there is nothing more in that direction.
+    """
+    # Ask for one extra row to learn whether another page exists
+    rows = _history_rows(conversation_id, limit + 1, before, after)
+    has_more = len(rows) > limit
+
+    if after is None:
+        rows = rows[1:] if has_more else rows
+        older, newer = has_more, before is not None
+    else:
+        rows = rows[:limit]
+        older, newer = True, has_more
+
+    return {
+        "messages": [{"role": row["role"], "content": row["content"]} for row in rows],
+        "next_before": rows[0]["id"] if rows and older else None,
+        "next_after": rows[-1]["id"] if rows and newer else None,
+    }
+
+def get_context_window(conversation_id: str, budget: int, strategy: str = "latest", reserve: int = 0):
+    """
+    The most recent messages whose stored token counts fit in `budget - reserve`.
+
+    Strategies:
+        "latest"     newest messages that fit
+        "pin_first"  the conversation's first message, then the newest that fit
+        "summary"    the stored rolling summary, then the newest messages it doesn't cover
+
+    Rows are read newest-first and reading stops at the first message that
+    doesn't fit, so the cost is O(window), not O(conversation). Cached
+    conversations are windowed in memory without touching SQLite.
+    Returns (messages, dropped_through): the id of the newest message left out of
+    the window (and not covered by the summary), or None if nothing was dropped.
+    """
+    entry = _cached_conversation(conversation_id)
+    if entry is not None:
+        messages = entry.messages[:]  # snapshot; writers may append concurrently
+        first = messages[0] if messages else None
+        return _select_window(reversed(messages), first, entry.summary, entry.summary_through,
+                              budget - reserve, strategy)
+
+    with pooled_connection() as conn:
+        first = summary = summary_through = None
+        if strategy == "pin_first":
+            first = conn.execute(
+                f"SELECT {_MESSAGE_COLUMNS} FROM messages m {BLOB_JOIN} WHERE m.conversation_id = ? "
+                "ORDER BY m.id ASC LIMIT 1",
+                (conversation_id,)
+            ).fetchone()
+        elif strategy == "summary":
+            row = conn.execute(
+                "SELECT summary, summary_through FROM conversations WHERE conversation_id = ?",
+                (conversation_id,)
+            ).fetchone()
+            if row is not None:
+                summary, summary_through = row["summary"], row["summary_through"]
+
+        # Bodies are decoded lazily, only for the rows the window actually reads
+        rows = conn.execute(
+            f"SELECT {_MESSAGE_COLUMNS} FROM messages m {BLOB_JOIN} WHERE m.conversation_id = ? ORDER BY m.id DESC",
+            (conversation_id,)
+        )
+        return _select_window(rows, first, summary, summary_through, budget - reserve, strategy)
+
+def _select_window(newest_first, first, summary, summary_through, remaining: int, strategy: str):
+    """Walk messages newest-first until the budget runs out (see get_context_window)."""
+    prefix = []
+    stop_at_id = None
+
+    if strategy == "pin_first" and first is not None and _row_tokens(first) <= remaining:
+        prefix.append({"role": first["role"], "content": first["content"]})
+        remaining -= _row_tokens(first)
+        stop_at_id = first["id"]
+
+    elif strategy == "summary" and summary:
+        summary = f"Summary of the earlier conversation:\n{summary}"
+        if estimate_tokens(summary) <= remaining:
+            prefix.append({"role": "user", "content": summary})
+            remaining -= estimate_tokens(summary)
+            stop_at_id = summary_through
+
+    window = []
+    dropped_through = None
+    for row in newest_first:
+        if stop_at_id is not None and row["id"] <= stop_at_id:
+            break
+        tokens = _row_tokens(row)
+        if tokens > remaining:
+            dropped_through = row["id"]
+            break
+        remaining -= tokens
+        window.append(row)
+
+    window.reverse()
+    # Providers expect the conversation to open with a user turn
+    while window and not prefix and window[0]["role"] != "user":
+        dropped_through = window.pop(0)["id"]
+
+    return prefix + [{"role": row["role"], "content": row["content"]} for row in window], dropped_through
+
+def _row_tokens(row) -> int:
+    # Rows written before token counts existed are estimated on the fly
+    return row["token_count"] if row["token_count"] is not None else estimate_tokens(row["content"])
+
+def get_unsummarized(conversation_id: str, through_id: int):
+    """Current summary plus the messages after it up to `through_id`, for a summary refresh."""
+    with pooled_connection() as conn:
+        row = conn.execute(
+            "SELECT summary, summary_through FROM conversations WHERE conversation_id = ?",
+            (conversation_id,)
+        ).fetchone()
+        summary = row["summary"] if row else None
+        after = (row["summary_through"] if row else None) or 0
+
+        rows = conn.execute(
+            f"SELECT m.role, {CONTENT_SQL} AS content FROM messages m {BLOB_JOIN} "
+            "WHERE m.conversation_id = ? AND m.id > ? AND m.id <= ? ORDER BY m.id ASC",
+            (conversation_id, after, through_id)
+        ).fetchall()
+
+    return summary, [{"role": row["role"], "content": row["content"]} for row in rows]
+
+def save_summary(conversation_id: str, summary: str, through_id: int):
+    """Store a rolling summary covering every message up to `through_id`."""
+    with pooled_connection() as conn:
+        conn.execute(
+            "UPDATE conversations SET summary = ?, summary_through = ? "
+            "WHERE conversation_id = ? AND COALESCE(summary_through, 0) < ?",
+            (summary, through_id, conversation_id, through_id)
+        )
+        conn.commit()
+    history_cache.set_summary(conversation_id, summary, through_id)
+
+def conversation_cursor(conversation: dict) -> str:
+    """Opaque keyset cursor for a conversation in the newest-first listing."""
+    return f"{conversation['last_message_at']}|{conversation['conversation_id']}"
+
+def _parse_cursor(cursor: str) -> tuple[str, str]:
+    last_message_at, _, conversation_id = cursor.partition("|")
+    return last_message_at, conversation_id
+
+def list_conversations(limit: int | None = None, before: str | None = None, after: str | None = None):
+    """
+    List conversations with metadata, most recently active first.
+    Pass `limit` (and optionally a `before`/`after` cursor) to get a window.
+    """
+    query = """
+        SELECT conversation_id, created_at, message_count, last_message_at, last_model
+        FROM conversations
+    """
+    params = []
+    if before is not None:
+        query += " WHERE (last_message_at, conversation_id) < (?, ?)"
+        params.extend(_parse_cursor(before))
+    elif after is not None:
+        query += " WHERE (last_message_at, conversation_id) > (?, ?)"
+        params.extend(_parse_cursor(after))
+
+    # For `after`, take the conversations just above the cursor, then flip them
+    oldest_first = after is not None and before is None
+    if oldest_first:
+        query += " ORDER BY last_message_at ASC, conversation_id ASC"
+    else:
+        query += " ORDER BY last_message_at DESC, conversation_id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    with pooled_connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    if oldest_first:
+        rows.reverse()
 
     return [
         {
             "conversation_id": row["conversation_id"],
             "created_at": row["created_at"],
             "message_count": row["message_count"],
-            "last_message_at": row["last_message_at"]
+            "last_message_at": row["last_message_at"],
+            "last_model": row["last_model"]
         }
         for row in rows
     ]
 
-def delete_conversation(conversation_id: str):
-    """Delete a conversation and all its messages."""
-    conn = get_connection()
-    cursor = conn.cursor()
+def list_conversations_page(limit: int = 50, before: str | None = None, after: str | None = None):
+    """One page of conversations plus keyset cursors (see get_history_page)."""
+    conversations = list_conversations(limit + 1, before, after)
+    has_more = len(conversations) > limit
 
-    # Delete messages first (foreign key constraint)
-    cursor.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+    if after is None:
+        conversations = conversations[:limit]
+        older, newer = has_more, before is not None
+    else:
+        conversations = conversations[1:] if has_more else conversations
+        older, newer = True, has_more
 
+    return {
+        "conversations": conversations,
+        "next_before": conversation_cursor(conversations[-1]) if conversations and older else None,
+        "next_after": conversation_cursor(conversations[0]) if conversations and newer else None,
+    }
 
-    # Delete conversation
-    cursor.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+def _match_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 query: every word must match, quoted so
+    punctuation and FTS5 operators are taken literally; a trailing * keeps prefix search.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if re.search(r"\w", word):
+            terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
 
-    deleted_count = cursor.rowcount
-    conn.commit()
-    conn.close()
+def search_messages(query: str, model: str | None = None, since: str | None = None, until: str | None = None,
+                    limit: int = 20, offset: int = 0):
+    """
+    Full-text search over message content, best matches first (BM25).
+    `model` keeps only answers from that model; `since`/`until` bound the
+    message timestamp (ISO dates or datetimes). Returns one page of results
+    with `next_offset` (None on the last page).
+    """
+    match = _match_query(query)
+    if not match:
+        return {"results": [], "next_offset": None}
 
-    return deleted_count > 0
+    sql = """
+        SELECT m.id, m.conversation_id, m.role, m.model, m.timestamp,
+               snippet(messages_fts, 0, '**', '**', '…', 16) AS snippet,
+               bm25(messages_fts) AS score
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ?
+    """
+    params = [match]
+    if model is not None:
+        sql += " AND m.model = ?"
+        params.append(model)
+    if since is not None:
+        sql += " AND m.timestamp >= ?"
+        params.append(since)
+    if until is not None:
+        sql += " AND m.timestamp < ?"
+        params.append(until)
+    sql += " ORDER BY rank LIMIT ? OFFSET ?"
+    params.extend([limit + 1, offset])
 
-def cleanup_old_conversations(days_old: int = 30):
-    """Delete conversations older than specificed days."""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with pooled_connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
 
-    # Find old conversations IDs
-    cursor.execute("""
-        SELECT conversation_id
-        FROM conversations
-        WHERE created_at < datetime('now', '-' || ? || ' days')
-    """, (days_old,))
+    has_more = len(rows) > limit
+    return {
+        "results": [
+            {
+                "message_id": row["id"],
+                "conversation_id": row["conversation_id"],
+                "role": row["role"],
+                "model": row["model"],
+                "timestamp": row["timestamp"],
+                "snippet": row["snippet"],
+                "score": round(-row["score"], 4),  # bm25() is lower-is-better
+            }
+            for row in rows[:limit]
+        ],
+        "next_offset": offset + limit if has_more else None,
+    }
 
-    old_conversations = [row["conversation_id"] for row in cursor.fetchall()]
+def delete_conversation(conversation_id: str):
+    """Delete a conversation and all its messages."""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
 
-    if not old_conversations:
-        conn.close()
-        return 0
+        # Delete messages first (foreign key constraint)
+        cursor.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
 
-    # Delete their messages
-    placeholders = ','.join('?' * len(old_conversations))
-    cursor.execute(
-        f"DELETE FROM conversations WHERE conversation_id IN {placeholders}",
-        old_conversations
-    )
 
-    # Delete the conversations
-    cursor.execute(
-        f"DELETE FROM conversations WHERE conversation_id IN {placeholders}",
-        old_conversations
-    )
+        # Delete conversation
+        cursor.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
 
-    deleted_count = len(old_conversations)
-    conn.commit()
-    conn.close()
+        deleted_count = cursor.rowcount
+        conn.commit()
 
-    return deleted_count
\ No newline at end of file
+    history_cache.invalidate([conversation_id])
+    return deleted_count > 0
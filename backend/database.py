@@ -1,20 +1,173 @@
+import logging
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+from backend import blob_store
+
+logger = logging.getLogger(__name__)
+
 # Database file location
 DB_PATH = Path(__file__).parent / "conversation.db"
 
+# Connection pool settings
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHED_STATEMENTS = 256  # prepared statements kept per connection by the sqlite3 module
+
+def utc_now(days_ago: float = 0) -> str:
+    """
+    Timestamp for the database: ISO 8601 in UTC without an offset, the same
+    clock as CURRENT_TIMESTAMP, so every stored and compared time agrees.
+    """
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).replace(tzinfo=None).isoformat()
+
 def get_connection():
     """Returns a connection to the SQLite database."""
     conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row # Access columbs by name
+    blob_store.register_functions(conn)
     return conn
 
+def _open_pooled_connection():
+    """Open a long-lived connection and apply the per-connection tuning once."""
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    conn.row_factory = sqlite3.Row
+    blob_store.register_functions(conn)
+
+    # WAL lets readers run alongside a writer; NORMAL sync is safe in WAL mode
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")  # negative = KiB
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+class ConnectionPool:
+    """
+    Bounded pool of long-lived SQLite connections.
+
+    Connections are opened lazily up to `size` and handed out LIFO, so the
+    hottest connection (and its prepared-statement cache) is reused first.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return _open_pooled_connection()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError(f"No database connection free after {self.timeout}s (pool size {self.size})")
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` block."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection (call on shutdown)."""
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+pool = ConnectionPool()
+
+def pooled_connection():
+    """Borrow a pooled connection: `with pooled_connection() as conn: ...`"""
+    return pool.connection()
+
+# Secondary indexes on `messages` (from migrations 1 and 2). A bulk import can
+# drop them and build them once at the end, which is much faster than
+# updating them row by row. The same goes for the search index: while it is
+# deferred, messages_body_insert is swapped for a trigger that only counts
+# blob references, and messages_fts is rebuilt in one pass afterwards.
+MESSAGE_INDEXES = {
+    "idx_messages_conversation_timestamp": "ON messages (conversation_id, timestamp)",
+    "idx_messages_conversation_id": "ON messages (conversation_id, id)",
+}
+DEFERRED_INSERT_TRIGGER = "messages_body_insert_deferred"
+
+def _has_trigger(cursor, name: str) -> bool:
+    return cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)
+    ).fetchone() is not None
+
+def drop_message_indexes(cursor):
+    for name in MESSAGE_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    if _has_trigger(cursor, "messages_body_insert"):
+        cursor.execute("DROP TRIGGER messages_body_insert")
+        cursor.execute(f"""
+            CREATE TRIGGER {DEFERRED_INSERT_TRIGGER} AFTER INSERT ON messages BEGIN
+                UPDATE blobs SET refs = refs + 1 WHERE id = new.blob_id;
+            END
+        """)
+
+def create_message_indexes(cursor):
+    for name, definition in MESSAGE_INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} {definition}")
+    if _has_trigger(cursor, DEFERRED_INSERT_TRIGGER):
+        cursor.execute(f"DROP TRIGGER {DEFERRED_INSERT_TRIGGER}")
+        cursor.execute(_body_insert_trigger())
+        cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
 def init_db():
     """Initialize the database schema."""
     conn = get_connection()
     cursor = conn.cursor()
 
+    # Let the retention worker return freed pages to the filesystem. Only takes
+    # effect on a new database; existing ones need a one-off VACUUM to switch.
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
     # Create conversations table
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS conversations (
@@ -43,5 +196,279 @@ def init_db():
         pass  # Column already exists
 
     conn.commit()
+    migrate(conn)
+    # Restore the indexes a bulk import deferred, if it was interrupted
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= 2:
+        create_message_indexes(conn.cursor())
+        conn.commit()
     conn.close()
-    print(f"Database initialized at {DB_PATH}")
\ No newline at end of file
+    print(f"Database initialized at {DB_PATH}")
+
+def _add_history_index_and_summary(cursor):
+    """Index history lookups and keep per-conversation stats on the conversations row."""
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation_timestamp "
+        "ON messages (conversation_id, timestamp)"
+    )
+
+    cursor.execute("ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE conversations ADD COLUMN last_message_at TIMESTAMP")
+    cursor.execute("ALTER TABLE conversations ADD COLUMN last_model TEXT")
+
+    # Backfill the summary for existing conversations (uses the index above)
+    cursor.execute("""
+        UPDATE conversations SET
+            message_count = (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.conversation_id = conversations.conversation_id
+            ),
+            last_message_at = (
+                SELECT MAX(m.timestamp) FROM messages m
+                WHERE m.conversation_id = conversations.conversation_id
+            ),
+            last_model = (
+                SELECT m.model FROM messages m
+                WHERE m.conversation_id = conversations.conversation_id AND m.model IS NOT NULL
+                ORDER BY m.timestamp DESC LIMIT 1
+            )
+    """)
+
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_last_message_at "
+        "ON conversations (last_message_at)"
+    )
+
+def _add_keyset_indexes(cursor):
+    """Indexes for keyset pagination of history (by id) and of the conversation list."""
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation_id "
+        "ON messages (conversation_id, id)"
+    )
+
+    # Empty conversations have no last_message_at; give them one so cursors can reach them
+    cursor.execute(
+        "UPDATE conversations SET last_message_at = replace(created_at, ' ', 'T') "
+        "WHERE last_message_at IS NULL"
+    )
+    cursor.execute("DROP INDEX IF EXISTS idx_conversations_last_message_at")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_recent "
+        "ON conversations (last_message_at, conversation_id)"
+    )
+
+def _add_token_counts_and_summary(cursor):
+    """Per-message token counts for context windowing, and a rolling conversation summary."""
+    cursor.execute("ALTER TABLE messages ADD COLUMN token_count INTEGER")
+    # Same estimate as conversation_store.estimate_tokens, so old and new rows agree
+    cursor.execute("UPDATE messages SET token_count = (length(content) + 3) / 4")
+
+    cursor.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+    cursor.execute("ALTER TABLE conversations ADD COLUMN summary_through INTEGER")
+
+def _add_batches(cursor):
+    """Tables for /ask/batch jobs, so a batch can be resumed by id."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS batches (
+            batch_id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            total INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS batch_items (
+            batch_id TEXT NOT NULL,
+            item_index INTEGER NOT NULL,
+            prompt TEXT NOT NULL,
+            model TEXT NOT NULL,
+            conversation_id TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            response TEXT,
+            completed_at TIMESTAMP,
+            PRIMARY KEY (batch_id, item_index),
+            FOREIGN KEY (batch_id) REFERENCES batches(batch_id)
+        )
+    """)
+
+def _add_generations(cursor):
+    """Partial and finished streamed answers, so a dropped client can resume a generation."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS generations (
+            task_id TEXT PRIMARY KEY,
+            conversation_id TEXT,
+            model TEXT NOT NULL,
+            provider TEXT,
+            concrete_model TEXT,
+            prompt TEXT NOT NULL,
+            status TEXT NOT NULL,
+            text TEXT NOT NULL DEFAULT '',
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    """)
+
+def _add_message_search(cursor):
+    """Full-text index over message content, kept in step with `messages` by triggers."""
+    # External content: the index stores only the terms, reading text back from `messages`
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+
+    # Backfill existing messages
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def _body_of(row: str) -> str:
+    """SQL for the text of messages row `row` ("new" or "old" in a trigger)."""
+    return (f"CASE WHEN {row}.blob_id IS NULL THEN {row}.content "
+            f"ELSE (SELECT blob_text(data, encoding) FROM blobs WHERE id = {row}.blob_id) END")
+
+def _body_insert_trigger() -> str:
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS messages_body_insert AFTER INSERT ON messages BEGIN
+            UPDATE blobs SET refs = refs + 1 WHERE id = new.blob_id;
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, {_body_of("new")});
+        END
+    """
+
+def _add_blobs(cursor):
+    """
+    Move message bodies into content-addressed, compressed blobs (see blob_store),
+    and point the search index at the decoded text.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            id INTEGER PRIMARY KEY,
+            hash BLOB NOT NULL UNIQUE,
+            encoding INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            refs INTEGER NOT NULL DEFAULT 0,
+            data BLOB NOT NULL
+        )
+    """)
+    cursor.execute("ALTER TABLE messages ADD COLUMN blob_id INTEGER REFERENCES blobs(id)")
+
+    # The index reads text from `messages.content`, which is about to be emptied
+    for name in ("messages_fts_insert", "messages_fts_delete", "messages_fts_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cursor.execute("DROP TABLE IF EXISTS messages_fts")
+
+    # Move existing bodies over, a chunk of rows at a time
+    last_id = 0
+    while True:
+        rows = cursor.execute(
+            "SELECT id, content FROM messages WHERE id > ? AND length(CAST(content AS BLOB)) >= ? "
+            "ORDER BY id LIMIT 1000",
+            (last_id, blob_store.MIN_BYTES)
+        ).fetchall()
+        if not rows:
+            break
+        updates = [(blob_store.store(cursor, row["content"])[1], row["id"]) for row in rows]
+        cursor.executemany("UPDATE messages SET content = '', blob_id = ? WHERE id = ?", updates)
+        cursor.executemany("UPDATE blobs SET refs = refs + 1 WHERE id = ?", [(blob_id,) for blob_id, _ in updates])
+        last_id = rows[-1]["id"]
+
+    cursor.execute(f"""
+        CREATE VIEW IF NOT EXISTS message_bodies AS
+        SELECT m.id, {blob_store.CONTENT_SQL} AS content
+        FROM messages m {blob_store.BLOB_JOIN}
+    """)
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='message_bodies',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+
+    # Count blob references and index text as messages come and go; a blob goes with its last message
+    cursor.execute(_body_insert_trigger())
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS messages_body_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, {_body_of("old")});
+            UPDATE blobs SET refs = refs - 1 WHERE id = old.blob_id;
+            DELETE FROM blobs WHERE id = old.blob_id AND refs <= 0;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS messages_body_update AFTER UPDATE OF content, blob_id ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, {_body_of("old")});
+            UPDATE blobs SET refs = refs + 1 WHERE id = new.blob_id;
+            UPDATE blobs SET refs = refs - 1 WHERE id = old.blob_id;
+            DELETE FROM blobs WHERE id = old.blob_id AND refs <= 0;
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, {_body_of("new")});
+        END
+    """)
+
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def _timestamps_to_utc(cursor):
+    """
+    Python-written timestamps (ISO 8601 with a "T") used to be local time while
+    CURRENT_TIMESTAMP defaults are UTC; convert the former so retention cutoffs compare like with like.
+    """
+    for table, column in (("messages", "timestamp"), ("generations", "updated_at"), ("batch_items", "completed_at")):
+        cursor.execute(
+            f"UPDATE {table} SET {column} = strftime('%Y-%m-%dT%H:%M:%f', {column}, 'utc') "
+            f"WHERE {column} LIKE '____-__-__T%'"
+        )
+    # Conversations without messages got theirs from the UTC created_at already
+    cursor.execute("""
+        UPDATE conversations SET last_message_at = (
+            SELECT MAX(m.timestamp) FROM messages m WHERE m.conversation_id = conversations.conversation_id
+        )
+        WHERE EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = conversations.conversation_id)
+    """)
+
+# Schema migrations, applied in order. The number of applied migrations is
+# stored in PRAGMA user_version, so each one runs exactly once per database.
+# Append new migrations to the end; never reorder or edit shipped ones.
+MIGRATIONS = [
+    _add_history_index_and_summary,
+    _add_keyset_indexes,
+    _add_token_counts_and_summary,
+    _add_batches,
+    _add_generations,
+    _add_message_search,
+    _add_blobs,
+    _timestamps_to_utc,
+]
+
+def migrate(conn):
+    """Apply any schema migrations this database hasn't seen yet."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for target, migration in enumerate(MIGRATIONS, start=1):
+        if version >= target:
+            continue
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Applied database migration %d: %s", target, migration.__name__)
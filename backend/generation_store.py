@@ -0,0 +1,41 @@
+# Storage for resumable streamed generations (see app/relay_manager.py).
+# Text is appended in chunks as it streams, so a partial answer survives a
+# client disconnect or a restart. Answers that finish before their first save
+# never get a row: they are already in the conversation.
+
+from backend.database import pooled_connection, utc_now
+
+def append_generation(generation: dict, text: str):
+    """
+    Append streamed text to a generation, creating its row on the first save,
+    and update its status (and provider/model once known).
+    `generation` is {"task_id", "conversation_id", "model", "prompt", "status", "provider", "concrete_model", "error"}.
+    """
+    with pooled_connection() as conn:
+        conn.execute(
+            "INSERT INTO generations (task_id, conversation_id, model, prompt, status, text, provider, "
+            "concrete_model, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(task_id) DO UPDATE SET text = text || excluded.text, status = excluded.status, "
+            "provider = COALESCE(excluded.provider, provider), "
+            "concrete_model = COALESCE(excluded.concrete_model, concrete_model), "
+            "error = excluded.error, updated_at = excluded.updated_at",
+            (generation["task_id"], generation["conversation_id"], generation["model"], generation["prompt"],
+             generation["status"], text, generation["provider"], generation["concrete_model"], generation["error"],
+             utc_now())
+        )
+        conn.commit()
+
+def get_generation(task_id: str):
+    """The generation as a dict, or None."""
+    with pooled_connection() as conn:
+        row = conn.execute(
+            "SELECT task_id, conversation_id, model, provider, concrete_model, prompt, status, text, error "
+            "FROM generations WHERE task_id = ?",
+            (task_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+def delete_generation(task_id: str):
+    with pooled_connection() as conn:
+        conn.execute("DELETE FROM generations WHERE task_id = ?", (task_id,))
+        conn.commit()
@@ -0,0 +1,162 @@
+# Write-through cache of recent conversations' message lists.
+# The relay writes every message itself, so once a conversation is loaded it
+# can be kept current from add_message without reading SQLite again.
+
+import os
+import threading
+from collections import OrderedDict
+
+ENABLED = os.getenv("HISTORY_CACHE_ENABLED", "1") == "1"
+MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Longer conversations are served from SQLite (the context window reads only their tail)
+MAX_MESSAGES = int(os.getenv("HISTORY_CACHE_MAX_MESSAGES", "2000"))
+
+# Rough per-message overhead of the cached dict, on top of the text itself
+_MESSAGE_OVERHEAD = 200
+# How many recent writes to remember for detecting racing fills
+_RECENT_WRITES = 4096
+
+
+def message_size(message: dict) -> int:
+    return len(message["content"]) + _MESSAGE_OVERHEAD
+
+
+class _Entry:
+    __slots__ = ("messages", "size", "summary", "summary_through")
+
+    def __init__(self, messages: list[dict], summary: str | None, summary_through: int | None):
+        self.messages = messages  # {"id", "role", "content", "token_count"}, oldest first
+        self.size = sum(message_size(msg) for msg in messages)
+        self.summary = summary
+        self.summary_through = summary_through
+
+
+class HistoryCache:
+    """
+    Bounded LRU of conversation_id -> full message list, evicted by approximate byte size.
+
+    Writers call append/set_summary/invalidate after committing. A reader that
+    missed loads the conversation from SQLite and offers it back with fill();
+    if a write for that conversation landed while it was reading, the (possibly
+    stale) load is not cached.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES, enabled: bool = ENABLED):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        # Write sequence numbers: global, and the last one per recently written conversation
+        self._seq = 0
+        self._last_write: OrderedDict[str, int] = OrderedDict()
+        self._forgotten_seq = 0  # newest seq dropped from _last_write
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _record_write(self, conversation_id: str):
+        self._seq += 1
+        self._last_write[conversation_id] = self._seq
+        self._last_write.move_to_end(conversation_id)
+        if len(self._last_write) > _RECENT_WRITES:
+            _, seq = self._last_write.popitem(last=False)
+            self._forgotten_seq = seq
+
+    def _drop(self, conversation_id: str):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def get(self, conversation_id: str) -> _Entry | None:
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return entry
+
+    def begin_fill(self) -> int:
+        """Call before reading a conversation from SQLite; pass the result to fill()."""
+        with self._lock:
+            return self._seq
+
+    def fill(self, conversation_id: str, messages: list[dict], summary: str | None,
+             summary_through: int | None, seq: int) -> _Entry:
+        """Cache a conversation loaded from SQLite, unless it was written since `seq`."""
+        entry = _Entry(messages, summary, summary_through)
+        with self._lock:
+            stale = self._forgotten_seq > seq or self._last_write.get(conversation_id, 0) > seq
+            if stale or conversation_id in self._entries or entry.size > self.max_bytes // 4:
+                return entry
+            self._entries[conversation_id] = entry
+            self._size += entry.size
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+            self.evictions += 1
+
+    def append(self, conversation_id: str, messages: list[dict]):
+        """Write-through for newly committed messages (ids ascending)."""
+        with self._lock:
+            self._record_write(conversation_id)
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return
+            for msg in messages:
+                last_id = entry.messages[-1]["id"] if entry.messages else 0
+                if msg["id"] > last_id:
+                    entry.messages.append(msg)
+                    entry.size += message_size(msg)
+                    self._size += message_size(msg)
+                elif not any(cached["id"] == msg["id"] for cached in reversed(entry.messages)):
+                    # A concurrent writer appended a newer row first; reload rather than reorder
+                    self._drop(conversation_id)
+                    break
+                # else: a racing fill already loaded this row
+            if len(entry.messages) > MAX_MESSAGES:
+                self._drop(conversation_id)
+            self._evict()
+
+    def set_summary(self, conversation_id: str, summary: str, through_id: int):
+        with self._lock:
+            self._record_write(conversation_id)
+            entry = self._entries.get(conversation_id)
+            if entry is not None and (entry.summary_through or 0) < through_id:
+                entry.summary = summary
+                entry.summary_through = through_id
+
+    def invalidate(self, conversation_ids):
+        with self._lock:
+            for conversation_id in conversation_ids:
+                self._record_write(conversation_id)
+                self._drop(conversation_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "conversations": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+history_cache = HistoryCache()
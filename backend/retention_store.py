@@ -0,0 +1,120 @@
+# Bounded deletes for the retention worker (app/utils/retention.py).
+# Every function here is one short transaction touching at most `limit` rows,
+# so the write lock is released between steps and /ask writes can get in.
+
+from collections import Counter
+
+from backend.database import pooled_connection
+from backend.history_cache import history_cache
+
+def stale_conversations(cutoff: str, limit: int) -> list[str]:
+    """Ids of up to `limit` conversations with no messages since `cutoff`, oldest first."""
+    with pooled_connection() as conn:
+        rows = conn.execute(
+            "SELECT conversation_id FROM conversations WHERE last_message_at < ? "
+            "ORDER BY last_message_at, conversation_id LIMIT ?",
+            (cutoff, limit)
+        ).fetchall()
+    return [row["conversation_id"] for row in rows]
+
+def delete_messages(conversation_ids: list[str], cutoff: str, limit: int) -> int:
+    """
+    Delete up to `limit` messages of these conversations. A conversation that
+    got a new message since it was picked is left alone. Message counts and the
+    history cache follow, so a conversation is never listed or served with messages it no longer has.
+    """
+    placeholders = ",".join("?" * len(conversation_ids))
+    with pooled_connection() as conn:
+        deleted = Counter(row[0] for row in conn.execute(
+            f"""
+            DELETE FROM messages WHERE id IN (
+                SELECT m.id FROM messages m
+                JOIN conversations c ON c.conversation_id = m.conversation_id
+                WHERE m.conversation_id IN ({placeholders}) AND c.last_message_at < ?
+                LIMIT ?
+            )
+            RETURNING conversation_id
+            """,
+            (*conversation_ids, cutoff, limit)
+        ).fetchall())
+        conn.executemany(
+            "UPDATE conversations SET message_count = MAX(message_count - ?, 0) WHERE conversation_id = ?",
+            [(count, conversation_id) for conversation_id, count in deleted.items()]
+        )
+        conn.commit()
+
+    history_cache.invalidate(list(deleted))
+    return sum(deleted.values())
+
+def delete_conversations(conversation_ids: list[str], cutoff: str) -> int:
+    """Delete these conversations once their messages are gone (and they are still stale)."""
+    placeholders = ",".join("?" * len(conversation_ids))
+    with pooled_connection() as conn:
+        cursor = conn.execute(
+            f"""
+            DELETE FROM conversations
+            WHERE conversation_id IN ({placeholders}) AND last_message_at < ?
+              AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = conversations.conversation_id)
+            """,
+            (*conversation_ids, cutoff)
+        )
+        deleted = cursor.rowcount
+        conn.commit()
+
+    history_cache.invalidate(conversation_ids)
+    return deleted
+
+def delete_generations(cutoff: str, limit: int) -> int:
+    """Delete up to `limit` saved generations (paused or orphaned) last updated before `cutoff`."""
+    with pooled_connection() as conn:
+        cursor = conn.execute(
+            "DELETE FROM generations WHERE task_id IN "
+            "(SELECT task_id FROM generations WHERE updated_at < ? LIMIT ?)",
+            (cutoff, limit)
+        )
+        deleted = cursor.rowcount
+        conn.commit()
+    return deleted
+
+def delete_batches(cutoff: str, limit: int) -> int:
+    """
+    Delete up to `limit` items of batches created before `cutoff`, then the
+    batches left empty. Returns the number of items deleted.
+    """
+    with pooled_connection() as conn:
+        cursor = conn.execute(
+            """
+            DELETE FROM batch_items WHERE rowid IN (
+                SELECT i.rowid FROM batch_items i
+                JOIN batches b ON b.batch_id = i.batch_id
+                WHERE b.created_at < datetime(?)
+                LIMIT ?
+            )
+            """,
+            (cutoff, limit)
+        )
+        deleted = cursor.rowcount
+        conn.execute(
+            "DELETE FROM batches WHERE created_at < datetime(?) "
+            "AND NOT EXISTS (SELECT 1 FROM batch_items i WHERE i.batch_id = batches.batch_id)",
+            (cutoff,)
+        )
+        conn.commit()
+    return deleted
+
+def incremental_vacuum(pages: int) -> int:
+    """
+    Return up to `pages` free pages to the filesystem. Only works on databases
+    with auto_vacuum=INCREMENTAL; returns the number of pages freed.
+    """
+    with pooled_connection() as conn:
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # execute() only steps the pragma once (one page); executescript runs it to completion
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return before - after
+
+def auto_vacuum_mode() -> int:
+    """PRAGMA auto_vacuum: 0 = none, 1 = full, 2 = incremental."""
+    with pooled_connection() as conn:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
@@ -0,0 +1,218 @@
+# Bulk export and import of conversations as NDJSON
+# (GET /conversations/export, POST /conversations/import).
+#
+# Each conversation is a {"type": "conversation", ...} line followed by one
+# {"type": "message", ...} line per message, oldest first:
+#   {"type": "conversation", "conversation_id", "created_at", "summary", "summary_through"}
+#   {"type": "message", "conversation_id", "id", "role", "content", "model", "timestamp"}
+# Message ids are the exporting database's; they are only used to carry
+# summary_through over to the new ids on import.
+
+import json
+import os
+
+from backend.blob_store import BLOB_JOIN, CONTENT_SQL
+from backend.conversation_store import insert_messages
+from backend.database import create_message_indexes, drop_message_indexes, get_connection, pooled_connection, utc_now
+from backend.history_cache import history_cache
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "2000"))  # messages fetched and encoded per chunk
+IMPORT_BATCH_LINES = int(os.getenv("IMPORT_BATCH_LINES", "20000"))  # lines per import transaction
+MAX_IMPORT_ERRORS = 100  # bad lines reported back (all of them are skipped)
+
+def export_chunks(since: str | None = None, until: str | None = None, model: str | None = None,
+                  chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """
+    Yield the export as NDJSON text, about `chunk_rows` messages per chunk.
+    `since`/`until` keep conversations last active in that range; `model`
+    keeps conversations with at least one answer from that model.
+
+    One cursor on its own connection walks conversations in id order and
+    their messages by index, so memory stays flat and the export is a single
+    consistent snapshot. (While it runs, WAL checkpoints can't get past that
+    snapshot, so the -wal file grows with concurrent writes until it's done.)
+    """
+    query = f"""
+        SELECT c.conversation_id, c.created_at, c.summary, c.summary_through,
+               m.id, m.role, {CONTENT_SQL} AS content, m.model, m.timestamp
+        FROM conversations c
+        LEFT JOIN messages m ON m.conversation_id = c.conversation_id
+        {BLOB_JOIN}
+    """
+    conditions, params = [], []
+    if since is not None:
+        conditions.append("c.last_message_at >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("c.last_message_at < ?")
+        params.append(until)
+    if model is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM messages x WHERE x.conversation_id = c.conversation_id AND x.model = ?)"
+        )
+        params.append(model)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY c.conversation_id, m.id"
+
+    conn = get_connection()
+    try:
+        cursor = conn.execute(query, params)
+        current = None
+        while rows := cursor.fetchmany(chunk_rows):
+            lines = []
+            for row in rows:
+                if row["conversation_id"] != current:
+                    current = row["conversation_id"]
+                    lines.append(json.dumps({
+                        "type": "conversation",
+                        "conversation_id": current,
+                        "created_at": row["created_at"],
+                        "summary": row["summary"],
+                        "summary_through": row["summary_through"],
+                    }))
+                if row["id"] is not None:
+                    lines.append(json.dumps({
+                        "type": "message",
+                        "conversation_id": current,
+                        "id": row["id"],
+                        "role": row["role"],
+                        "content": row["content"],
+                        "model": row["model"],
+                        "timestamp": row["timestamp"],
+                    }))
+            yield "\n".join(lines) + "\n"
+    finally:
+        conn.close()
+
+class ImportState:
+    """
+    Progress of one import across its batches. Records are expected grouped
+    as the export writes them: a conversation line, then its messages.
+    """
+
+    def __init__(self, on_conflict: str = "skip"):
+        self.on_conflict = on_conflict  # "skip" conversations that already exist, or "append" to them
+        self.line = 0
+        self.conversations = 0
+        self.messages = 0
+        self.skipped = 0
+        self.errors = []
+        self._current = None  # conversation of the last conversation line
+        self._skipping = False
+        self._summary = None  # (summary, exported summary_through) waiting for its message
+
+    def error(self, message: str):
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({"line": self.line, "error": message})
+
+    def result(self) -> dict:
+        return {
+            "conversations": self.conversations,
+            "messages": self.messages,
+            "skipped_conversations": self.skipped,
+            "lines": self.line,
+            "errors": self.errors,
+        }
+
+def _text(record: dict, key: str, required: bool = True) -> str | None:
+    value = record.get(key)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"'{key}' must be a string")
+    return value
+
+def import_lines(lines: list[bytes], state: ImportState):
+    """Parse and insert one batch of NDJSON lines in a single transaction."""
+    now = utc_now()
+    rows = []  # (conversation_id, role, content, model, timestamp) for insert_messages
+    counts = {}  # rows per conversation so far
+    summaries = {}  # conversation_id -> (summary, position of its summary_through message among its rows)
+    created = []  # conversations new in this batch
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        for line in lines:
+            state.line += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                kind = record.get("type", "message")
+                conversation_id = _text(record, "conversation_id")
+
+                if kind == "conversation":
+                    state._current = conversation_id
+                    exists = cursor.execute(
+                        "SELECT 1 FROM conversations WHERE conversation_id = ?", (conversation_id,)
+                    ).fetchone() is not None
+                    state._skipping = exists and state.on_conflict == "skip"
+                    state._summary = None
+                    if state._skipping:
+                        state.skipped += 1
+                        continue
+                    if not exists:
+                        # last_message_at comes from its messages (the summary upsert never moves it back)
+                        cursor.execute(
+                            "INSERT INTO conversations (conversation_id, created_at) VALUES (?, ?)",
+                            (conversation_id, _text(record, "created_at", required=False) or now)
+                        )
+                        created.append(conversation_id)
+                    state.conversations += 1
+                    summary = _text(record, "summary", required=False)
+                    if summary is not None and record.get("summary_through") is not None:
+                        state._summary = (summary, record["summary_through"])
+
+                elif kind == "message":
+                    if conversation_id == state._current and state._skipping:
+                        continue
+                    rows.append((
+                        conversation_id,
+                        _text(record, "role"),
+                        _text(record, "content"),
+                        _text(record, "model", required=False),
+                        _text(record, "timestamp", required=False) or now,
+                    ))
+                    counts[conversation_id] = counts.get(conversation_id, 0) + 1
+                    if (state._summary is not None and conversation_id == state._current
+                            and record.get("id") == state._summary[1]):
+                        summaries[conversation_id] = (state._summary[0], counts[conversation_id] - 1)
+                        state._summary = None
+                else:
+                    raise ValueError(f"unknown record type {kind!r}")
+            except (ValueError, TypeError) as e:
+                state.error(str(e))
+
+        inserted = insert_messages(cursor, rows) if rows else {}
+        # Ones without messages still need a place in the listing, as in migration 2
+        cursor.executemany(
+            "UPDATE conversations SET last_message_at = replace(created_at, ' ', 'T') "
+            "WHERE conversation_id = ? AND last_message_at IS NULL",
+            [(conversation_id,) for conversation_id in created]
+        )
+        if summaries:
+            cursor.executemany(
+                "UPDATE conversations SET summary = ?, summary_through = ? WHERE conversation_id = ?",
+                [(summary, inserted[conversation_id][position]["id"], conversation_id)
+                 for conversation_id, (summary, position) in summaries.items()]
+            )
+        conn.commit()
+
+    state.messages += len(rows)
+    # Imported conversations are read back from SQLite, not cached
+    history_cache.invalidate(list(inserted))
+
+def drop_indexes():
+    """Drop the secondary message indexes and pause the search index for a bulk import."""
+    with pooled_connection() as conn:
+        drop_message_indexes(conn.cursor())
+        conn.commit()
+
+def create_indexes():
+    """Rebuild the message and search indexes after a bulk import (init_db also does, after a crash)."""
+    with pooled_connection() as conn:
+        create_message_indexes(conn.cursor())
+        conn.commit()
@@ -0,0 +1,143 @@
+"""
+Database size and read throughput with message bodies stored inline versus in
+the content-addressed, compressed blob store (backend/blob_store.py).
+
+Usage:
+    python benchmarks/bench_blobs.py [--conversations 2000] [--turns 10] [--reads 5000]
+
+Both layouts get the same synthetic history: mostly short prompts and
+medium answers, some pasted logs/code (a few KB, sometimes tens of KB, often
+pasted again), /compare turns that store one prompt next to three answers,
+and repeated canned error replies. "inline" is the old layout (every body in
+messages.content); "blobs" is the default. Reads go straight to SQLite with
+the history cache off.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from backend import blob_store, conversation_store, database  # noqa: E402
+from backend.history_cache import history_cache  # noqa: E402
+
+WORDS = ("the", "model", "request", "latency", "token", "cache", "error", "stream", "answer", "context",
+         "provider", "python", "async", "database", "index", "query", "response", "timeout", "retry", "limit")
+CANNED = ["Claude error: the provider is overloaded, please try again.",
+          "OpenAI error: rate limit exceeded, please retry in a few seconds.",
+          "Gemini error: the request timed out."]
+DEFAULT_MIN_BYTES = blob_store.MIN_BYTES
+
+
+def prose(rng: random.Random, chars: int) -> str:
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def paste(rng: random.Random, chars: int) -> str:
+    lines = []
+    length = 0
+    while length < chars:
+        line = (f"2025-06-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d} "
+                f"{rng.choice(['INFO', 'WARN', 'ERROR'])} {rng.choice(WORDS)}.{rng.choice(WORDS)} "
+                f"id={rng.randint(0, 99999)} {prose(rng, 40)}")
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+
+def history(conversations: int, turns: int, seed: int) -> list[tuple]:
+    rng = random.Random(seed)
+    pastes = []
+    timestamp = datetime.now().isoformat()
+    rows = []
+    for n in range(conversations):
+        conversation_id = f"bench-{n}"
+        for _ in range(turns):
+            kind = rng.random()
+            if kind < 0.05 and pastes:
+                prompt = rng.choice(pastes)  # the same file pasted again
+            elif kind < 0.15:
+                prompt = paste(rng, rng.choice([2000, 4000, 8000, 30000]))
+                pastes.append(prompt)
+            else:
+                prompt = prose(rng, rng.randint(40, 400))
+            rows.append((conversation_id, "user", prompt, None, timestamp))
+
+            answers = 3 if rng.random() < 0.2 else 1  # /compare: one prompt, three answers
+            for model in ("gpt-4.1-mini", "claude-sonnet-4", "gemini-2.5-flash")[:answers]:
+                answer = rng.choice(CANNED) if rng.random() < 0.05 else prose(rng, rng.randint(200, 3000))
+                rows.append((conversation_id, "assistant", answer, model, timestamp))
+    return rows
+
+
+def build(path: Path, rows: list[tuple], inline: bool) -> float:
+    blob_store.MIN_BYTES = sys.maxsize if inline else DEFAULT_MIN_BYTES
+    database.pool.close_all()
+    database.DB_PATH = path
+    database.init_db()
+    started = time.perf_counter()
+    for start in range(0, len(rows), 5000):
+        conversation_store.add_messages(rows[start:start + 5000])
+    elapsed = time.perf_counter() - started
+    with database.pooled_connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return elapsed
+
+
+def reads(conversations: int, count: int, seed: int) -> tuple[float, float]:
+    rng = random.Random(seed)
+    ids = [f"bench-{rng.randrange(conversations)}" for _ in range(count)]
+
+    started = time.perf_counter()
+    for conversation_id in ids:
+        conversation_store.get_history(conversation_id)
+    history_rate = count / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for conversation_id in ids:
+        conversation_store.get_context_window(conversation_id, 4000)
+    window_rate = count / (time.perf_counter() - started)
+    return history_rate, window_rate
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--reads", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    history_cache.enabled = False
+    rows = history(args.conversations, args.turns, args.seed)
+    text_mb = sum(len(row[2].encode()) for row in rows) / 1e6
+    print(f"{len(rows)} messages, {text_mb:.1f} MB of text")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for layout in ("inline", "blobs"):
+            path = Path(tmpdir) / f"{layout}.db"
+            write_seconds = build(path, rows, inline=layout == "inline")
+            size_mb = os.path.getsize(path) / 1e6
+            with database.pooled_connection() as conn:
+                blobs = conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+            history_rate, window_rate = reads(args.conversations, args.reads, args.seed)
+            print(f"{layout:<7} db {size_mb:8.1f} MB  blobs {blobs:7d}  "
+                  f"write {len(rows) / write_seconds:9.0f} msg/s  "
+                  f"get_history {history_rate:8.0f}/s  get_context_window {window_rate:8.0f}/s")
+        database.pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
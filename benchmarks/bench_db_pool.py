@@ -0,0 +1,89 @@
+"""
+Compare the old per-call SQLite connection path against the connection pool.
+
+Usage:
+    python benchmarks/bench_db_pool.py [--messages 5000] [--threads 8]
+
+Each path gets its own fresh database file, so the old path runs with the
+default rollback journal and the pooled path with WAL, as they would in production.
+"""
+import argparse
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend import database, conversation_store  # noqa: E402
+
+
+def old_add_message(conversation_id: str, role: str, content: str, model=None):
+    """The pre-pool add_message: open, write, commit, close on every call."""
+    timestamp = datetime.now().isoformat()
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR IGNORE INTO conversations (conversation_id) VALUES (?)", (conversation_id,))
+    cursor.execute(
+        "INSERT INTO messages (conversation_id, role, content, model, timestamp) VALUES (?, ?, ?, ?, ?)",
+        (conversation_id, role, content, model, timestamp)
+    )
+    conn.commit()
+    conn.close()
+    return timestamp
+
+
+def run(add_message, total: int, threads: int) -> tuple[float, int]:
+    """Write `total` messages split over `threads` writers. Returns (messages/sec, lock errors)."""
+    per_thread = total // threads
+    errors = []
+
+    def writer(n):
+        for i in range(per_thread):
+            try:
+                add_message(f"bench-{n}-{i % 20}", "user", f"message {i} from writer {n}")
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    return (per_thread * threads - len(errors)) / elapsed, len(errors)
+
+
+def fresh_db(tmpdir: str, name: str):
+    database.DB_PATH = Path(tmpdir) / name
+    database.pool.close_all()
+    database.init_db()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for threads in (1, args.threads):
+            fresh_db(tmpdir, f"old-{threads}.db")
+            old_rate, old_errors = run(old_add_message, args.messages, threads)
+
+            fresh_db(tmpdir, f"pool-{threads}.db")
+            pool_rate, pool_errors = run(conversation_store.add_message, args.messages, threads)
+            database.pool.close_all()
+
+            print(f"threads={threads}")
+            print(f"  per-call connection: {old_rate:10.0f} msg/s  ({old_errors} lock errors)")
+            print(f"  pooled (WAL):        {pool_rate:10.0f} msg/s  ({pool_errors} lock errors)")
+            print(f"  speedup:             {pool_rate / old_rate:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
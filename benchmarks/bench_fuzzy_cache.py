@@ -0,0 +1,216 @@
+"""
+Recall and lookup latency of the near-duplicate (MinHash/LSH) prompt cache.
+
+Usage:
+    python benchmarks/bench_fuzzy_cache.py [--size 1000000] [--queries 5000]
+
+Builds a synthetic set of distinct questions (a task, an object and a made-up
+library or topic name), caches an answer for each, then queries with
+paraphrases of cached questions and with fresh questions (should miss).
+Recall is reported per kind of paraphrase:
+
+    surface   case, punctuation and filler words only
+    synonym   verbs and nouns swapped for synonyms
+    reorder   the same words in another clause order
+    both      synonyms and reordering together
+
+It also caches questions with two operands and queries them with the operands
+swapped ("convert a list to a string" / "convert a string to a list"): same
+words, opposite meaning. Every one of those must miss; the script exits with
+status 1 if any hits.
+"""
+import argparse
+import random
+import resource
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.utils.fuzzy_cache import FuzzyCache  # noqa: E402
+
+MODEL = "bench-model"
+
+VERBS = [
+    ("sort", "order", "arrange"), ("reverse", "invert", "flip"), ("parse", "read", "decode"),
+    ("merge", "combine", "join"), ("split", "divide", "partition"), ("convert", "transform", "change"),
+    ("delete", "remove", "drop"), ("copy", "duplicate", "clone"), ("count", "tally", "total"),
+    ("compress", "shrink", "pack"), ("validate", "check", "verify"), ("cache", "memoize", "store"),
+]
+NOUNS = [
+    ("list", "array"), ("string", "text"), ("file", "document"), ("dictionary", "map"),
+    ("date", "timestamp"), ("image", "picture"), ("table", "spreadsheet"), ("number", "integer"),
+    ("request", "call"), ("record", "row"),
+]
+ADJECTIVES = [("fast", "quick"), ("slow", "sluggish"), ("big", "large"), ("broken", "failing")]
+
+# Each family has templates that say the same thing with the clauses in another order
+FAMILIES = [
+    ("how do i {v} a {n} in {e}", "in {e} how do i {v} a {n}", "{v} a {n} in {e} how"),
+    ("what is the best way to {v} a {n} with {e}", "with {e} what is the best way to {v} a {n}",
+     "best way to {v} a {n}, using {e}"),
+    ("why is my {e} {n} so {a}", "my {n} in {e} is so {a}, why", "{a} {n} in {e}, why is that"),
+    ("difference between {e} and {f} for {n}", "for {n}, difference between {e} and {f}",
+     "{e} vs {f} for {n}, what is the difference"),
+]
+
+# Same words, different meaning once {x} and {y} are swapped
+SWAPPABLE = [
+    "how do i convert a {x} to a {y} in {e}",
+    "is {x} faster than {y}",
+    "migrate from {x} to {y}",
+    "why is {x} slower than {y} for {n}",
+    "{x} vs {y}: should i move from {x} to {y}",
+]
+
+SURFACE = [
+    lambda q: q.upper(),
+    lambda q: q.capitalize() + "?",
+    lambda q: "Please " + q,
+    lambda q: "Can you tell me " + q + "?",
+    lambda q: "  " + q.title() + " ...",
+]
+
+SYLLABLES = [c + v for c in "bcdfghjklmnprstvwz" for v in ("a", "e", "i", "o", "u", "ai", "or")]
+
+
+def pseudo_word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 4)))
+
+
+def make_intent(rng: random.Random) -> tuple:
+    """
+    What a question asks: family, synonym groups and names, independent of
+    wording. Slots the family doesn't use are zeroed so equal intents compare equal.
+    """
+    family = rng.randrange(len(FAMILIES))
+    used = FAMILIES[family][0]
+    return (family,
+            rng.randrange(len(VERBS)) if "{v}" in used else 0,
+            rng.randrange(len(NOUNS)),
+            rng.randrange(len(ADJECTIVES)) if "{a}" in used else 0,
+            pseudo_word(rng),
+            pseudo_word(rng) if "{f}" in used else "")
+
+
+def phrase(intent: tuple, template: int, synonyms: tuple) -> str:
+    family, verb, noun, adjective, e, f = intent
+    v, n, a = synonyms
+    return FAMILIES[family][template].format(v=VERBS[verb][v], n=NOUNS[noun][n], a=ADJECTIVES[adjective][a],
+                                             e=e, f=f)
+
+
+def paraphrase(rng: random.Random, intent: tuple, template: int, synonyms: tuple, kind: str) -> str:
+    family, verb, noun, adjective = intent[:4]
+    if kind in ("synonym", "both"):
+        # Change every synonym group the family uses
+        swap = lambda current, size: (current + rng.randrange(1, size)) % size
+        used = FAMILIES[family][0]
+        synonyms = (swap(synonyms[0], len(VERBS[verb])) if "{v}" in used else synonyms[0],
+                    swap(synonyms[1], len(NOUNS[noun])),
+                    swap(synonyms[2], len(ADJECTIVES[adjective])) if "{a}" in used else synonyms[2])
+    if kind in ("reorder", "both"):
+        template = (template + rng.randrange(1, len(FAMILIES[family]))) % len(FAMILIES[family])
+    return rng.choice(SURFACE)(phrase(intent, template, synonyms))
+
+
+def make_swappable(rng: random.Random) -> tuple[str, str]:
+    """A two-operand question and the same question with its operands swapped."""
+    template = rng.choice(SWAPPABLE)
+    if "{e}" in template:
+        x, y = (rng.choice(group) for group in rng.sample(NOUNS, 2))
+    else:
+        x, y = pseudo_word(rng), pseudo_word(rng)
+    e, n = pseudo_word(rng), rng.choice(rng.choice(NOUNS))
+    return template.format(x=x, y=y, e=e, n=n), template.format(x=y, y=x, e=e, n=n)
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=5000, help="per paraphrase kind")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cache = FuzzyCache(threshold=args.threshold, max_entries=args.size + args.queries, max_age=float("inf"))
+
+    cached = []  # (intent, template, synonyms) of each cached question
+    seen = set()
+    while len(cached) < args.size:
+        intent = make_intent(rng)
+        if intent in seen:
+            continue
+        seen.add(intent)
+        cached.append((intent, rng.randrange(3), (rng.randrange(3), rng.randrange(2), rng.randrange(2))))
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for i, (intent, template, synonyms) in enumerate(cached):
+        cache.add(MODEL, phrase(intent, template, synonyms), f"answer-{i}")
+    build_s = time.perf_counter() - started
+    rss_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    print(f"indexed {args.size} prompts in {build_s:.1f}s ({build_s / args.size * 1e6:.1f} us/prompt), "
+          f"~{rss_mb:.0f} MB")
+
+    # Paraphrases of cached questions: should return that question's answer
+    latencies = []
+    for kind in ("surface", "synonym", "reorder", "both"):
+        correct = wrong = missed = 0
+        for _ in range(args.queries):
+            i = rng.randrange(args.size)
+            query = paraphrase(rng, *cached[i], kind)
+            t = time.perf_counter()
+            answer = cache.lookup(MODEL, query)
+            latencies.append(time.perf_counter() - t)
+            if answer == f"answer-{i}":
+                correct += 1
+            elif answer is None:
+                missed += 1
+            else:
+                wrong += 1
+        print(f"recall ({kind + ')':<8}  {correct / args.queries:.3f}  (missed {missed}, wrong answer {wrong})")
+
+    # Fresh questions: any hit is a false positive
+    false_hits = fresh = 0
+    while fresh < args.queries:
+        intent = make_intent(rng)
+        if intent in seen:
+            continue
+        fresh += 1
+        query = phrase(intent, rng.randrange(3), (rng.randrange(3), rng.randrange(2), rng.randrange(2)))
+        t = time.perf_counter()
+        if cache.lookup(MODEL, query) is not None:
+            false_hits += 1
+        latencies.append(time.perf_counter() - t)
+
+    # Swapped operands: cache one direction, ask the other; any hit is a wrong answer
+    swapped = [make_swappable(rng) for _ in range(args.queries)]
+    for i, (question, _) in enumerate(swapped):
+        cache.add(MODEL, question, f"swappable-{i}")
+    swap_hits = []
+    for question, query in swapped:
+        t = time.perf_counter()
+        if cache.lookup(MODEL, query) is not None:
+            swap_hits.append((question, query))
+        latencies.append(time.perf_counter() - t)
+
+    print(f"false-hit rate:     {false_hits / args.queries:.4f}")
+    print(f"swapped operands:   {len(swap_hits) / args.queries:.4f}  (must be 0)")
+    print(f"lookup latency:     p50 {percentile(latencies, 0.5) * 1e6:.1f} us, "
+          f"p99 {percentile(latencies, 0.99) * 1e6:.1f} us")
+    for question, query in swap_hits[:5]:
+        print(f"  {query!r} served the answer cached for {question!r}")
+    if swap_hits:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Latency and cached-input share of long multi-turn conversations with
+provider-side prompt caching (app/utils/prompt_cache.py) off and on.
+
+Usage:
+    python benchmarks/bench_prompt_cache.py [--models claude,gemini] [--conversations 20] [--turns 8]
+                                            [--history 40] [--input-tokens-per-second 20000]
+
+Each conversation starts with --history messages of about --message-chars
+characters and then gets --turns /ask requests in a row (conversations run
+concurrently). The fake providers charge FAKE_INPUT_TOKENS_PER_SECOND of
+prefill time for every uncached input token, and check the cache_control
+breakpoints / cached contents the relay sends. The context budget is large
+enough that the window never slides, so the history prefix stays stable.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def configure(args):
+    """Settings are read at import time, so this runs before the app is imported."""
+    os.environ["FAKE_PROVIDERS"] = "all"
+    os.environ["FAKE_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["FAKE_LATENCY_DIST"] = "fixed"
+    os.environ["FAKE_OUTPUT_TOKENS"] = "50"
+    os.environ["FAKE_INPUT_TOKENS_PER_SECOND"] = str(args.input_tokens_per_second)
+    os.environ["CONTEXT_BUDGET_TOKENS"] = "1000000"
+    os.environ.setdefault("PROVIDER_MAX_CONCURRENCY", "1024")
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def populate(conversation_store, prefix: str, args) -> list[str]:
+    ids = [f"{prefix}-{n}" for n in range(args.conversations)]
+    timestamp = datetime.now().isoformat()
+    filler = "lorem ipsum dolor sit amet " * (args.message_chars // 27 + 1)
+    conversation_store.add_messages([
+        (conversation_id, "user" if i % 2 == 0 else "assistant",
+         f"message {i} of {conversation_id}: {filler[:args.message_chars]}", None, timestamp)
+        for conversation_id in ids
+        for i in range(args.history)
+    ])
+    return ids
+
+
+async def run(client, model: str, conversation_ids: list[str], turns: int) -> list[float]:
+    latencies = []
+
+    async def conversation(conversation_id: str):
+        for turn in range(turns):
+            started = time.perf_counter()
+            response = await client.post("/ask", json={
+                "prompt": f"question {turn} about {conversation_id}", "model": model,
+                "conversation_id": conversation_id, "cache": False,
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.05)  # think time; background cache creation finishes meanwhile
+
+    await asyncio.gather(*(conversation(conversation_id) for conversation_id in conversation_ids))
+    return latencies
+
+
+async def main_async(args, tmpdir: str):
+    import httpx
+    from app.llm_clients import claude_client, gemini_client
+    from app.utils import prompt_cache
+    from backend import async_store, conversation_store, database
+    os.chdir(ROOT)
+    import main
+
+    database.DB_PATH = Path(tmpdir) / "bench.db"
+    database.init_db()
+    caches = {
+        "claude": (claude_client, lambda: prompt_cache.AnthropicPromptCache()),
+        "gemini": (gemini_client, lambda: prompt_cache.GeminiContextCache(gemini_client.PROVIDER,
+                                                                           gemini_client.client)),
+    }
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for model in args.models.split(","):
+            module, new_cache = caches[model]
+            for enabled in (False, True):
+                prompt_cache.ENABLED = enabled
+                module.prompt_cache = new_cache()
+                conversation_ids = populate(conversation_store, f"{model}-{enabled}", args)
+                latencies = await run(client, model, conversation_ids, args.turns)
+                stats = module.prompt_cache.stats()
+                print(f"{model:<7} cache {'on ' if enabled else 'off'}  "
+                      f"mean {sum(latencies) / len(latencies) * 1000:7.1f} ms  "
+                      f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  "
+                      f"input {stats['input_tokens']:9d}  cached {stats['hit_ratio']:6.1%}  "
+                      f"written {stats['cache_write_tokens']:8d}")
+                if hasattr(module.prompt_cache, "shutdown"):
+                    await module.prompt_cache.shutdown()
+
+    await async_store.shutdown()
+    database.pool.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", default="claude,gemini")
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--history", type=int, default=40, help="messages already in each conversation")
+    parser.add_argument("--message-chars", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--input-tokens-per-second", type=float, default=20000)
+    args = parser.parse_args()
+
+    configure(args)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        asyncio.run(main_async(args, tmpdir))
+
+
+if __name__ == "__main__":
+    main()
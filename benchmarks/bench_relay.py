@@ -0,0 +1,188 @@
+"""
+End-to-end load benchmark of the relay against fake providers.
+
+Usage:
+    python benchmarks/bench_relay.py [--scenarios ask,ask_stream,compare,history]
+                                     [--concurrency 1,8,32] [--requests 200]
+                                     [--latency-ms 200] [--latency-dist lognormal]
+                                     [--tokens-per-second 0] [--error-rate 0]
+                                     [--conversations 200] [--messages 20]
+
+Requests go through the whole ASGI app in-process (routing, context building,
+conversion, limiter, SQLite writes) with every provider replaced by the local
+fakes in app/llm_clients/fake_providers.py, so runs cost nothing and are
+repeatable. Each run uses a fresh SQLite file, pre-populated with
+--conversations x --messages messages (--conversations 0 for an empty DB).
+
+For each scenario and concurrency it prints throughput, p50/p99 latency and the
+relay's own overhead per request: latency minus the time fake upstream calls
+were in flight. "errors" counts non-200 responses and streamed error events
+(/ask and /compare report provider failures as answer text). Provider concurrency limits default to 1024 here so the
+limiter doesn't hide the relay's own costs; set PROVIDER_MAX_CONCURRENCY to
+measure with production limits.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+MODELS = ["openai", "claude", "gemini"]
+
+
+def configure(args):
+    """Settings are read at import time, so this runs before the app is imported."""
+    os.environ["FAKE_PROVIDERS"] = "all"
+    os.environ["FAKE_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["FAKE_LATENCY_DIST"] = args.latency_dist
+    os.environ["FAKE_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["FAKE_OUTPUT_TOKENS"] = str(args.output_tokens)
+    os.environ["FAKE_ERROR_RATE"] = str(args.error_rate)
+    os.environ.setdefault("PROVIDER_MAX_CONCURRENCY", "1024")
+    os.environ.setdefault("LIMITER_MAX_QUEUE", "100000")
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def covered(spans: list[tuple[float, float]]) -> float:
+    """Total time during which at least one span was in flight."""
+    total, end = 0.0, None
+    for start, stop in sorted(spans):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+
+def populate(conversation_store, conversations: int, messages: int) -> list[str]:
+    ids = [f"bench-{n}" for n in range(conversations)]
+    timestamp = datetime.now().isoformat()
+    rows = [
+        (conversation_id, "user" if i % 2 == 0 else "assistant",
+         f"message {i} of {conversation_id}: " + "lorem ipsum dolor sit amet " * 8,
+         None if i % 2 == 0 else "gpt-4.1-mini", timestamp)
+        for conversation_id in ids
+        for i in range(messages)
+    ]
+    for start in range(0, len(rows), 5000):
+        conversation_store.add_messages(rows[start:start + 5000])
+    return ids
+
+
+def request_for(scenario: str, n: int, conversation_ids: list[str]) -> tuple[str, dict]:
+    conversation_id = random.choice(conversation_ids) if conversation_ids else None
+    prompt = f"benchmark question {n} {random.random()}"
+    if scenario == "ask":
+        return "/ask", {"prompt": prompt, "model": MODELS[n % len(MODELS)], "conversation_id": conversation_id,
+                        "cache": False}
+    if scenario == "ask_stream":
+        return "/ask/stream", {"prompt": prompt, "model": MODELS[n % len(MODELS)],
+                               "conversation_id": conversation_id, "cache": False}
+    if scenario == "compare":
+        return "/compare", {"message": prompt, "models": MODELS, "conversation_id": conversation_id, "cache": False}
+    if scenario == "history":
+        return "/ask", {"prompt": "", "conversation_id": conversation_id or "bench-empty"}
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+async def run(client, fake_providers, scenario: str, concurrency: int, total: int, conversation_ids: list[str],
+              report: bool = True):
+    latencies, overheads = [], []
+    errors = 0
+    counter = iter(range(total))
+
+    async def one(n: int):
+        nonlocal errors
+        path, body = request_for(scenario, n, conversation_ids)
+        spans = []
+        token = fake_providers.upstream_spans.set(spans)
+        started = time.perf_counter()
+        try:
+            response = await client.post(path, json=body)
+            if response.status_code != 200 or '"type": "error"' in response.text:
+                errors += 1
+        finally:
+            fake_providers.upstream_spans.reset(token)
+        latency = time.perf_counter() - started
+        latencies.append(latency)
+        overheads.append(latency - covered(spans))
+
+    async def worker():
+        for n in counter:
+            await one(n)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    if not report:
+        return
+
+    print(f"{scenario:<11} c={concurrency:<4} n={total:<6} "
+          f"{total / elapsed:9.1f} req/s  "
+          f"p50 {percentile(latencies, 0.5) * 1000:8.1f} ms  p99 {percentile(latencies, 0.99) * 1000:8.1f} ms  "
+          f"overhead p50 {percentile(overheads, 0.5) * 1000:7.2f} ms  p99 {percentile(overheads, 0.99) * 1000:7.2f} ms"
+          f"  errors {errors}")
+
+
+async def main_async(args, tmpdir: str):
+    import httpx
+    from app.llm_clients import fake_providers
+    from backend import async_store, conversation_store, database
+    os.chdir(ROOT)  # main.py serves ./frontend
+    import main
+
+    database.DB_PATH = Path(tmpdir) / "bench.db"
+    database.init_db()
+    conversation_ids = populate(conversation_store, args.conversations, args.messages)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for scenario in args.scenarios.split(","):
+            for concurrency in (int(level) for level in args.concurrency.split(",")):
+                if args.warmup:
+                    # Imports, prepared statements, history cache
+                    await run(client, fake_providers, scenario, concurrency, min(concurrency * 2, 20),
+                              conversation_ids, report=False)
+                await run(client, fake_providers, scenario, concurrency, args.requests, conversation_ids)
+
+    await async_store.shutdown()
+    database.pool.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default="ask,ask_stream,compare,history")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--latency-dist", default="lognormal", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--output-tokens", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--conversations", type=int, default=200, help="pre-populated conversations (0 = empty DB)")
+    parser.add_argument("--messages", type=int, default=20, help="messages per pre-populated conversation")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    configure(args)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        asyncio.run(main_async(args, tmpdir))
+
+
+if __name__ == "__main__":
+    main()
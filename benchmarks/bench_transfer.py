@@ -0,0 +1,122 @@
+"""
+Throughput and memory of the NDJSON export/import (backend/transfer_store.py).
+
+Usage:
+    python benchmarks/bench_transfer.py [--conversations 5000] [--turns 20]
+
+Builds a synthetic history, exports it to a file with export_chunks, then
+imports that file into fresh databases with the message indexes kept and
+deferred. Peak traced Python memory is reported for each phase; it should
+stay flat as --conversations grows.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from backend import conversation_store, database, transfer_store  # noqa: E402
+from backend.history_cache import history_cache  # noqa: E402
+
+WORDS = ("the", "model", "request", "latency", "token", "cache", "error", "stream", "answer", "context",
+         "provider", "python", "async", "database", "index", "query", "response", "timeout", "retry", "limit")
+
+
+def use(path: Path):
+    database.pool.close_all()
+    database.DB_PATH = path
+    database.init_db()
+
+
+def populate(conversations: int, turns: int, seed: int) -> int:
+    rng = random.Random(seed)
+    timestamp = datetime.now().isoformat()
+    rows = []
+    total = 0
+    for n in range(conversations):
+        for _ in range(turns):
+            rows.append((f"bench-{n}", "user", " ".join(rng.choices(WORDS, k=rng.randint(5, 60))), None, timestamp))
+            rows.append((f"bench-{n}", "assistant", " ".join(rng.choices(WORDS, k=rng.randint(30, 400))),
+                         "gpt-4.1-mini", timestamp))
+        if len(rows) >= 10000:
+            conversation_store.add_messages(rows)
+            total += len(rows)
+            rows = []
+    if rows:
+        conversation_store.add_messages(rows)
+        total += len(rows)
+    return total
+
+
+def export(path: Path) -> tuple[float, int]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in transfer_store.export_chunks():
+            f.write(chunk)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def load(path: Path, defer_indexes: bool) -> tuple[float, int, dict]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    state = transfer_store.ImportState()
+    if defer_indexes:
+        transfer_store.drop_indexes()
+    with open(path, "rb") as f:
+        lines = []
+        for line in f:
+            lines.append(line)
+            if len(lines) >= transfer_store.IMPORT_BATCH_LINES:
+                transfer_store.import_lines(lines, state)
+                lines = []
+        if lines:
+            transfer_store.import_lines(lines, state)
+    if defer_indexes:
+        transfer_store.create_indexes()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, state.result()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=5000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    history_cache.enabled = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp = Path(tmpdir)
+        use(tmp / "source.db")
+        messages = populate(args.conversations, args.turns, args.seed)
+
+        elapsed, peak = export(tmp / "export.ndjson")
+        size_mb = os.path.getsize(tmp / "export.ndjson") / 1e6
+        print(f"{messages} messages, export {size_mb:.1f} MB")
+        print(f"export              {messages / elapsed:9.0f} msg/s  {size_mb / elapsed:6.1f} MB/s  "
+              f"peak {peak / 1e6:6.1f} MB")
+
+        for defer_indexes in (False, True):
+            use(tmp / f"import-{defer_indexes}.db")
+            elapsed, peak, result = load(tmp / "export.ndjson", defer_indexes)
+            label = "import (deferred)" if defer_indexes else "import (indexed)"
+            print(f"{label:<19} {result['messages'] / elapsed:9.0f} msg/s  {size_mb / elapsed:6.1f} MB/s  "
+                  f"peak {peak / 1e6:6.1f} MB  errors {len(result['errors'])}")
+        database.pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
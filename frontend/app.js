@@ -9,6 +9,9 @@
     };
 
     const API_BASE = '';
+    const CONVERSATION_PAGE_SIZE = 50;
+    const HISTORY_PAGE_SIZE = 50;
+    let nextConversationsCursor = null;
 
     // DOM elements
     const chatMessages = document.getElementById('chatMessages');
@@ -99,19 +102,41 @@
     }
 
     async function loadConversations() {
+        // Only the most recent window; older ones come in via "Load more"
         try {
-            const response = await fetch(`${API_BASE}/conversations`);
+            const response = await fetch(`${API_BASE}/conversations?limit=${CONVERSATION_PAGE_SIZE}`);
             const data = await response.json();
 
             if (data.conversations) {
                 allConversations = data.conversations;
-                renderConversationList(data.conversations);
+                nextConversationsCursor = data.next_before;
+                renderConversationList(applyFilters(allConversations));
             }
         } catch (error) {
             console.error('Failed to load conversations:', error);
         }
     }
 
+    async function loadMoreConversations() {
+        if (!nextConversationsCursor) return;
+
+        try {
+            const cursor = encodeURIComponent(nextConversationsCursor);
+            const response = await fetch(
+                `${API_BASE}/conversations?limit=${CONVERSATION_PAGE_SIZE}&before=${cursor}`
+            );
+            const data = await response.json();
+
+            if (data.conversations) {
+                allConversations = allConversations.concat(data.conversations);
+                nextConversationsCursor = data.next_before;
+                renderConversationList(applyFilters(allConversations));
+            }
+        } catch (error) {
+            console.error('Failed to load more conversations:', error);
+        }
+    }
+
     function renderConversationList(conversations) {
         conversationList.innerHTML = '';
 
@@ -175,6 +200,14 @@
 
             conversationList.appendChild(item);
         });
+
+        if (nextConversationsCursor) {
+            const loadMoreBtn = document.createElement('button');
+            loadMoreBtn.className = 'clear-filters-btn';
+            loadMoreBtn.textContent = 'Load more';
+            loadMoreBtn.addEventListener('click', loadMoreConversations);
+            conversationList.appendChild(loadMoreBtn);
+        }
     }
 
     async function loadConversation(conversationId) {
@@ -182,22 +215,11 @@
         chatMessages.innerHTML = '';
 
         try {
-            const response = await fetch(`${API_BASE}/ask`, {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({
-                    prompt: '', //Empty prompt to just get history
-                    model: modelSelect.value,
-                    conversation_id: currentConversationId
-                })
-            });
-
-            const data = await response.json();
+            const data = await fetchHistoryPage(conversationId);
 
             if (data.history) {
-                data.history.forEach(msg => {
-                    displayMessage(msg.role, msg.content, '');
-                });
+                prependHistory(data.history, data.next_before);
+                chatMessages.scrollTop = chatMessages.scrollHeight;
             }
 
             loadConversations(); // Refresh sidebar to update active state
@@ -206,6 +228,45 @@
         }
     }
 
+    async function fetchHistoryPage(conversationId, before = null) {
+        const response = await fetch(`${API_BASE}/ask`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                prompt: '', //Empty prompt to just get history
+                model: modelSelect.value,
+                conversation_id: conversationId,
+                limit: HISTORY_PAGE_SIZE,
+                before: before
+            })
+        });
+        return response.json();
+    }
+
+    function prependHistory(messages, nextBefore) {
+        // Insert a page of older messages above whatever is already shown
+        const anchor = chatMessages.firstChild;
+        messages.forEach(msg => {
+            const contentDiv = displayMessage(msg.role, msg.content, '');
+            chatMessages.insertBefore(contentDiv.parentElement, anchor);
+        });
+
+        if (nextBefore) {
+            const conversationId = currentConversationId;
+            const loadEarlierBtn = document.createElement('button');
+            loadEarlierBtn.className = 'clear-filters-btn';
+            loadEarlierBtn.textContent = 'Load earlier messages';
+            loadEarlierBtn.addEventListener('click', async () => {
+                loadEarlierBtn.remove();
+                const data = await fetchHistoryPage(conversationId, nextBefore);
+                if (data.history && conversationId === currentConversationId) {
+                    prependHistory(data.history, data.next_before);
+                }
+            });
+            chatMessages.insertBefore(loadEarlierBtn, chatMessages.firstChild);
+        }
+    }
+
     async function deleteConversation(conversationId, event) {
         event.stopPropagation(); // Prevent triggering the conversation load
 
@@ -291,8 +352,8 @@
                     return;
                 }
 
-                // Call comparison endpoint
-                const response = await fetch(`${API_BASE}/compare`, {
+                // Call streaming comparison endpoint; each model fills its own column
+                const response = await fetch(`${API_BASE}/compare/stream`, {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({
@@ -302,19 +363,35 @@
                     })
                 });
 
-                const data = await response.json();
+                if (!response.ok) {
+                    const data = await response.json();
+                    thinkingDiv.remove();
+                    displayMessage('assistant', `Error: ${data.detail || data.error}`, 'system');
+                    return;
+                }
+
                 thinkingDiv.remove();
+                const columns = displayComparison(
+                    selectedModels.map(model => ({ model: model, response: '' }))
+                );
+
+                await readEventStream(response, (event) => {
+                    const column = columns[event.model];
+                    if (!column) return;
+
+                    if (event.type === 'delta') {
+                        column.textContent += event.text;
+                        chatMessages.scrollTop = chatMessages.scrollHeight;
+                    } else if (event.type === 'done') {
+                        column.textContent = event.response;
+                    }
+                });
 
-                if (data.error) {
-                    displayMessage('assistant', `Error: ${data.error}`, 'system');
-                } else {
-                    // Display comparison results
-                    displayComparison(data.responses);
-                }
+                loadConversations();
 
             } else {
-                // Normal single-model mode (your existing logic)
-            const response = await fetch(`${API_BASE}/ask`, {
+                // Normal single-model mode, streamed token by token
+            const response = await fetch(`${API_BASE}/ask/stream`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -324,16 +401,44 @@
                 })
             });
 
-            const data = await response.json();
+            if (!response.ok) {
+                const data = await response.json().catch(() => ({}));
+                thinkingDiv.remove();
+                displayMessage('assistant', `Error: ${data.detail || data.error || response.statusText}`, 'system');
+                return;
+            }
 
-            // Remove thinking indicator
-            thinkingDiv.remove()
+            let contentDiv = null;
+
+            const onEvent = (event) => {
+                if (event.type === 'delta') {
+                    // Swap the thinking indicator for the answer on the first token
+                    if (!contentDiv) {
+                        thinkingDiv.remove();
+                        contentDiv = displayMessage('assistant', '');
+                    }
+                    contentDiv.textContent += event.text;
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                } else if (event.type === 'done') {
+                    thinkingDiv.remove();
+                    if (!contentDiv) {
+                        contentDiv = displayMessage('assistant', event.response);
+                    }
+                    const metaDiv = document.createElement('div');
+                    metaDiv.className = 'message-meta';
+                    metaDiv.textContent = `${event.model} • ${new Date().toLocaleTimeString()}`;
+                    contentDiv.appendChild(metaDiv);
+                } else if (event.type === 'error') {
+                    thinkingDiv.remove();
+                    displayMessage('assistant', `Error: ${event.error}`, 'system');
+                } else if (event.type === 'paused') {
+                    // The server stopped (e.g. restarting); the answer so far is kept and can be continued
+                    thinkingDiv.remove();
+                    showResumeButton(event, onEvent);
+                }
+            };
 
-            if (data.error) {
-                displayMessage('assistant', `Error: ${data.error}`, data.model || 'system');
-            } else {
-                displayMessage('assistant', data.response, data.model);
-            }
+            await readEventStream(response, onEvent);
 
             // Refresh conversation list
             loadConversations();
@@ -349,6 +454,31 @@
         }
     }
 
+    function showResumeButton(event, onEvent) {
+        const notice = displayMessage('assistant', 'Generation paused.', 'system');
+        const resumeBtn = document.createElement('button');
+        resumeBtn.className = 'clear-filters-btn';
+        resumeBtn.textContent = 'Resume';
+        resumeBtn.addEventListener('click', async () => {
+            notice.parentElement.remove();
+            try {
+                const response = await fetch(
+                    `${API_BASE}/ask/stream/${event.task_id}/resume?offset=${event.offset}`, { method: 'POST' }
+                );
+                if (!response.ok) {
+                    const data = await response.json().catch(() => ({}));
+                    displayMessage('assistant', `Error: ${data.detail || data.error || response.statusText}`, 'system');
+                    return;
+                }
+                await readEventStream(response, onEvent);
+                loadConversations();
+            } catch (error) {
+                displayMessage('assistant', `Network error: ${error.message}`, 'system');
+            }
+        });
+        notice.appendChild(resumeBtn);
+    }
+
     function displayMessage(role, content, model = '') {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${role}`;
@@ -367,11 +497,39 @@
         messageDiv.appendChild(contentDiv);
         chatMessages.appendChild(messageDiv);
         chatMessages.scrollTop = chatMessages.scrollHeight;
+        return contentDiv;
+    }
+
+    async function readEventStream(response, onEvent) {
+        // Minimal Server-Sent Events reader for fetch() responses
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                const dataLines = frame.split('\n')
+                    .filter(line => line.startsWith('data: '))
+                    .map(line => line.slice(6));
+                if (dataLines.length > 0) {
+                    onEvent(JSON.parse(dataLines.join('\n')));
+                }
+            }
+        }
     }
 
     function displayComparison(responses) {
         const container = document.createElement('div');
         container.className = 'comparison-container';
+        const columns = {};
 
         responses.forEach(resp => {
             const responseDiv = document.createElement('div');
@@ -384,6 +542,7 @@
             const content = document.createElement('div');
             content.className = 'response-content';
             content.textContent = resp.response;
+            columns[resp.model] = content;
 
             responseDiv.appendChild(modelLabel);
             responseDiv.appendChild(content);
@@ -392,6 +551,7 @@
 
         chatMessages.appendChild(container);
         chatMessages.scrollTop = chatMessages.scrollHeight;
+        return columns;
     }
 
     function showWelcomeMessage() {
@@ -1,22 +1,42 @@
-from fastapi import FastAPI
+import asyncio
+
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from backend.database import init_db
-from backend.conversation_store import (
-    add_message,
-    get_history,
-    list_conversations,
-    delete_conversation,
-    cleanup_old_conversations,
-)
+from fastapi.responses import FileResponse, StreamingResponse
+from backend.database import init_db, pool
+from backend import async_store
+from app.utils.metrics import MetricsMiddleware, monitor_event_loop
+from app.utils.retention import RETENTION_DAYS, retention
+from app.utils.tracing import TracingMiddleware
 
+from app.llm_clients import gemini_client
 from app.routes import router as api_router
+from app.relay_manager import relay_manager
 app = FastAPI()
 
+# Keeps the event-loop lag monitor and the retention schedule alive
+_background_tasks = set()
+
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     init_db()
+    _background_tasks.add(asyncio.create_task(monitor_event_loop()))
+    if RETENTION_DAYS > 0:
+        _background_tasks.add(asyncio.create_task(retention.schedule()))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in _background_tasks:
+        task.cancel()
+    await retention.shutdown()
+    # Save running generations as paused, so clients can resume them after a restart
+    await relay_manager.shutdown()
+    # Stop paying for cached Gemini contents nobody will use
+    await gemini_client.prompt_cache.shutdown()
+    # Commit any queued messages before closing the connections
+    await async_store.shutdown()
+    pool.close_all()
 
 # Allow your frontend (PyCharm's localhost port) to talk to the API
 origins = [
@@ -34,24 +54,71 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
 @app.get("/")
 def root():
     return {"message": "Multi-LLM Relay API is running."}
 
 @app.get("/conversations")
-def get_conversations():
-    """"List all conversations with metadata."""
+async def get_conversations(
+    limit: int | None = Query(None, ge=1, le=500),
+    before: str | None = None,
+    after: str | None = None,
+):
+    """"List conversations with metadata, newest first. Pass `limit` to page with `before`/`after` cursors."""
     try:
-        conversations = list_conversations()
-        return {"conversations": conversations}
+        if limit is None:
+            conversations = await async_store.list_conversations(before=before, after=after)
+            return {"conversations": conversations}
+        return await async_store.list_conversations_page(limit, before, after)
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/conversations/export")
+async def export_conversations(since: str | None = None, until: str | None = None, model: str | None = None):
+    """
+    Stream conversations and their messages as NDJSON (format in backend/transfer_store.py).
+    `since`/`until` filter on last activity, `model` on the models that answered.
+    """
+    return StreamingResponse(async_store.export_conversations(since, until, model),
+                             media_type="application/x-ndjson",
+                             headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'})
+
+@app.post("/conversations/import")
+async def import_conversations(
+    request: Request,
+    on_conflict: str = Query("skip", pattern="^(skip|append)$"),
+    defer_indexes: bool = False,
+):
+    """
+    Import an NDJSON export streamed in the request body. Conversations that
+    already exist are skipped (or appended to with on_conflict=append).
+    defer_indexes=true rebuilds the message and search indexes once at the
+    end: faster for big loads, but history reads are slow and /search misses
+    new messages until it finishes (the search rebuild covers every message).
+    """
+    return await async_store.import_conversations(request.stream(), on_conflict, defer_indexes)
+
+@app.get("/search")
+async def search(
+    q: str,
+    model: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+):
+    """Full-text search over all messages, best matches first. Page with `offset` = the previous `next_offset`."""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query is required")
+    return await async_store.search_messages(q, model, since, until, limit, offset)
+
 @app.delete("/conversations/{conversation_id}")
-def remove_conversation(conversation_id: str):
+async def remove_conversation(conversation_id: str):
     """Delete a specific conversation."""
     try:
-        deleted = delete_conversation(conversation_id)
+        deleted = await async_store.delete_conversation(conversation_id)
         if deleted:
             return {"message": f"Conversation {conversation_id} deleted"}
         else:
@@ -60,13 +127,16 @@ def remove_conversation(conversation_id: str):
         return {"error": str(e)}
 
 @app.post("/cleanup")
-def cleanup_conversations_endpoint(days_old: int = 30):
-    """Delete conversations older than specified days."""
-    try:
-        deleted_count = cleanup_old_conversations(days_old)
-        return {"message": f"Deleted {deleted_count} old conversations"}
-    except Exception as e:
-        return {"error": str(e)}
+async def cleanup_conversations_endpoint(days_old: int = Query(30, ge=0)):
+    """Start deleting conversations idle for more than `days_old` days, in the background."""
+    if not retention.start(days_old):
+        return {"message": "Cleanup already running", "status": retention.status()}
+    return {"message": "Cleanup started", "status": retention.status()}
+
+@app.get("/cleanup/status")
+async def cleanup_status():
+    """Progress of the current or last retention run."""
+    return retention.status()
 
 # Attach all routes from app/routes.py
 app.include_router(api_router)
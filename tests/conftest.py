@@ -0,0 +1,30 @@
+"""Every test runs on the fake providers and a fresh SQLite file, so no API keys or network are needed."""
+import os
+
+# Read at import time by the clients and fakes, so set before the app is imported
+os.environ["FAKE_PROVIDERS"] = "all"
+os.environ.setdefault("FAKE_LATENCY_MS", "20")
+os.environ.setdefault("FAKE_LATENCY_DIST", "fixed")
+
+import pytest  # noqa: E402
+
+from app.utils.response_cache import response_cache  # noqa: E402
+from backend import database  # noqa: E402
+from backend.history_cache import history_cache  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A migrated database in tmp_path, with empty caches in front of it."""
+    database.pool.close_all()
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "conversation.db")
+    database.init_db()
+    history_cache.clear()
+    response_cache.clear()
+    yield database
+    database.pool.close_all()
@@ -0,0 +1,41 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from main import app
+
+# Without `with`: the app's startup/shutdown would open and then close the shared store threads
+client = TestClient(app)
+
+
+def _events(response) -> list[dict]:
+    return [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+
+
+def test_streams_deltas_then_the_whole_answer(db):
+    response = client.post("/ask/stream", json={"prompt": "hello", "model": "gpt-4.1-mini", "cache": False})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response)
+    deltas = [event for event in events if event["type"] == "delta"]
+    assert deltas and events[-1]["type"] == "done"
+    assert "".join(event["text"] for event in deltas) == events[-1]["response"]
+    assert deltas[-1]["offset"] == len(events[-1]["response"])
+    assert events[-1]["task_id"] == response.headers["x-task-id"]
+
+
+def test_reconnect_replays_from_an_offset(db):
+    response = client.post("/ask/stream", json={"prompt": "hello", "model": "gpt-4.1-mini", "cache": False})
+    answer = _events(response)[-1]["response"]
+
+    replay = _events(client.get(f"/ask/stream/{response.headers['x-task-id']}", params={"offset": 5}))
+    assert "".join(event["text"] for event in replay if event["type"] == "delta") == answer[5:]
+
+
+def test_errors_are_plain_http_errors(db):
+    # The UI shows `detail` for non-2xx responses instead of reading them as an event stream
+    response = client.post("/ask/stream", json={"prompt": "  ", "model": "gpt-4.1-mini"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Prompt is required"}
+    assert client.get("/ask/stream/unknown").status_code == 404
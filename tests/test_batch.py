@@ -0,0 +1,68 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from app import routes
+from backend import async_store, conversation_store
+
+pytestmark = pytest.mark.anyio
+
+
+async def _start(batch_id: str, count: int):
+    request = routes.BatchRequest(batch_id=batch_id, concurrency=1,
+                                  items=[{"prompt": f"p{i}", "model": "gpt-4.1-mini", "conversation_id": f"c{i}"}
+                                         for i in range(count)])
+    return (await routes.ask_batch(request)).body_iterator
+
+
+async def _read_all(lines) -> list[dict]:
+    return [json.loads(line) async for line in lines]
+
+
+async def test_resume_runs_only_what_a_dropped_stream_left_pending(db):
+    lines = await _start("b", 4)
+    assert json.loads(await lines.__anext__())["pending"] == 4
+    first = json.loads(await lines.__anext__())
+    await lines.aclose()  # client went away after one result
+
+    info = await async_store.get_batch("b")
+    assert info["counts"] == {"ok": 1, "pending": 3}
+
+    resumed = await _read_all((await routes.resume_batch("b")).body_iterator)
+    assert resumed[0]["pending"] == 3
+    assert sorted(line["index"] for line in resumed[1:-1]) == sorted({0, 1, 2, 3} - {first["index"]})
+    assert resumed[-1] == {"batch_id": "b", "done": True, "counts": {"ok": 3}}
+
+    assert (await async_store.get_batch("b"))["counts"] == {"ok": 4}
+    # Each answered item is in its conversation exactly once
+    for i in range(4):
+        assert [m["role"] for m in conversation_store.get_history(f"c{i}")] == ["user", "assistant"]
+
+
+async def test_resume_while_running_is_refused(db):
+    lines = await _start("b", 3)
+    await lines.__anext__()
+
+    with pytest.raises(HTTPException) as refused:
+        await routes.resume_batch("b")
+    assert refused.value.status_code == 409
+
+    await _read_all(lines)
+    resumed = await _read_all((await routes.resume_batch("b")).body_iterator)
+    assert resumed[0]["pending"] == 0
+
+
+async def test_resume_can_replay_saved_results(db):
+    await _read_all(await _start("b", 2))
+
+    replay = routes.BatchResumeRequest(replay=True)
+    resumed = await _read_all((await routes.resume_batch("b", replay)).body_iterator)
+    assert sorted(line["index"] for line in resumed[1:-1]) == [0, 1]
+    assert all(line["status"] == "ok" for line in resumed[1:-1])
+
+
+async def test_unknown_batch(db):
+    with pytest.raises(HTTPException) as missing:
+        await routes.resume_batch("nope")
+    assert missing.value.status_code == 404
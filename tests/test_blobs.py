@@ -0,0 +1,50 @@
+from backend import blob_store, conversation_store
+
+BODY = "The same long answer, stored once however often it repeats. " * 4
+BIG_BODY = "Compressible text. " * 200
+
+
+def _blobs(db) -> list[tuple]:
+    conn = db.get_connection()
+    rows = [tuple(row) for row in conn.execute("SELECT id, refs, encoding FROM blobs ORDER BY id")]
+    conn.close()
+    return rows
+
+
+def test_identical_bodies_share_one_blob(db):
+    conversation_store.add_message("a", "assistant", BODY)
+    conversation_store.add_message("b", "assistant", BODY)
+    conversation_store.add_message("b", "user", "short stays inline")
+
+    assert [refs for _, refs, _ in _blobs(db)] == [2]
+    assert conversation_store.get_history("a")[0]["content"] == BODY
+
+
+def test_refcount_follows_deletes_and_the_last_one_removes_the_blob(db):
+    conversation_store.add_message("a", "assistant", BODY)
+    conversation_store.add_message("b", "assistant", BODY)
+
+    conversation_store.delete_conversation("a")
+    assert [refs for _, refs, _ in _blobs(db)] == [1]
+    assert conversation_store.get_history("b")[0]["content"] == BODY
+
+    conversation_store.delete_conversation("b")
+    assert _blobs(db) == []
+
+
+def test_updating_a_body_moves_its_reference(db):
+    conversation_store.add_message("a", "assistant", BODY)
+    conn = db.get_connection()
+    content, blob_id = blob_store.store(conn.cursor(), BIG_BODY)
+    conn.execute("UPDATE messages SET content = ?, blob_id = ?", (content, blob_id))
+    conn.commit()
+    conn.close()
+
+    assert [(refs, encoding) for _, refs, encoding in _blobs(db)] == [(1, blob_store.ZLIB)]
+    assert conversation_store.get_history("a", limit=1)[0]["content"] == BIG_BODY
+
+
+def test_search_reads_blob_bodies(db):
+    conversation_store.add_message("a", "assistant", BIG_BODY)
+    results = conversation_store.search_messages("compressible")["results"]
+    assert [result["conversation_id"] for result in results] == ["a"]
@@ -0,0 +1,38 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import conversation_store
+from main import app
+
+# Without `with`: the app's startup/shutdown would open and then close the shared store threads
+client = TestClient(app)
+
+
+@pytest.mark.parametrize("extra, detail", [
+    ({"deadline": "soon"}, "deadline must be a number"),
+    ({"deadline": 0}, "deadline must be greater than 0"),
+    ({"deadline": "nan"}, "deadline must be greater than 0"),
+    ({"min_responses": 0}, "min_responses must be greater than 0"),
+    ({"min_responses": 1.5}, "min_responses must be an integer"),
+    ({"min_responses": True}, "min_responses must be an integer"),
+    ({"return_after": -1}, "return_after must be greater than 0"),
+])
+def test_rejects_bad_limits_before_storing_anything(db, extra, detail):
+    response = client.post("/compare", json={"message": "hi", "models": ["gpt-4.1-mini"],
+                                             "conversation_id": "c", **extra})
+    assert response.status_code == 400
+    assert response.json()["detail"] == detail
+    assert conversation_store.get_history("c") == []
+
+
+def test_answers_from_every_model(db):
+    response = client.post("/compare", json={"message": "hi", "models": ["gpt-4.1-mini", "claude-3-5-haiku-20241022"],
+                                             "deadline": "10", "min_responses": 2})
+    assert response.status_code == 200
+    assert [r["status"] for r in response.json()["responses"]] == ["ok", "ok"]
+
+
+def test_models_past_the_deadline_time_out(db):
+    response = client.post("/compare", json={"message": "hi", "models": ["gpt-4.1-mini"], "deadline": 0.001})
+    assert response.status_code == 200
+    assert response.json()["responses"][0]["status"] == "timed_out"
@@ -0,0 +1,46 @@
+import pytest
+
+from app.utils.fuzzy_cache import FuzzyCache
+
+MODEL = "gpt-4.1-mini"
+
+
+@pytest.fixture
+def cache():
+    return FuzzyCache(threshold=0.8, max_entries=100, max_age=3600)
+
+
+def test_paraphrase_hits(cache):
+    cache.add(MODEL, "How do I remove duplicates from a list in Python?", "use dict.fromkeys")
+    assert cache.lookup(MODEL, "how do i REMOVE duplicates from a list in python") == "use dict.fromkeys"
+    assert cache.lookup(MODEL, "Please, how can I delete duplicates from a list in Python") == "use dict.fromkeys"
+
+
+@pytest.mark.parametrize("cached, query", [
+    ("how do I convert a string to an int in python", "how do I convert an int to a string in python"),
+    ("is postgres faster than mysql for writes", "is mysql faster than postgres for writes"),
+    ("migrate from flask to django", "migrate from django to flask"),
+    ("react vs vue: should I move from react to vue", "vue vs react: should I move from vue to react"),
+])
+def test_swapped_operands_miss(cache, cached, query):
+    cache.add(MODEL, cached, "answer")
+    assert cache.lookup(MODEL, query) is None
+
+
+def test_numbers_must_match(cache):
+    cache.add(MODEL, "is 1001 a prime number", "no")
+    assert cache.lookup(MODEL, "is 1009 a prime number") is None
+    assert cache.lookup(MODEL, "Is 1001 a prime number?") == "no"
+
+
+def test_entries_are_per_model(cache):
+    cache.add(MODEL, "explain python decorators", "answer")
+    assert cache.lookup("claude-3-5-sonnet-20241022", "explain python decorators") is None
+
+
+def test_evicts_oldest_over_capacity():
+    cache = FuzzyCache(max_entries=2, max_age=3600)
+    for topic in ("kubernetes ingress", "terraform modules", "postgres vacuum"):
+        cache.add(MODEL, f"how does {topic} work", topic)
+    assert cache.lookup(MODEL, "how does kubernetes ingress work") is None
+    assert cache.lookup(MODEL, "how does postgres vacuum work") == "postgres vacuum"
@@ -0,0 +1,84 @@
+import sqlite3
+
+from backend import blob_store, conversation_store, database
+
+# The schema before any migration, as the first release created it
+_V0_SCHEMA = """
+    CREATE TABLE conversations (
+        conversation_id TEXT PRIMARY KEY,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        model TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (conversation_id) REFERENCES conversations(conversation_id)
+    );
+"""
+
+LONG_ANSWER = "Paris is the capital of France. " * 8
+
+
+def _make_v0_database(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(_V0_SCHEMA)
+    conn.execute("INSERT INTO conversations (conversation_id, created_at) VALUES ('old', '2025-01-01 09:00:00')")
+    conn.execute("INSERT INTO conversations (conversation_id, created_at) VALUES ('empty', '2025-01-02 09:00:00')")
+    conn.executemany(
+        "INSERT INTO messages (conversation_id, role, content, model, timestamp) VALUES (?, ?, ?, ?, ?)",
+        [
+            ("old", "user", "What is the capital of France?", None, "2025-01-01T09:00:00"),
+            ("old", "assistant", LONG_ANSWER, "gpt-4", "2025-01-01T09:00:01"),
+            ("old", "user", "And of Italy?", None, "2025-01-01T09:01:00"),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_migrates_an_existing_database(tmp_path, monkeypatch):
+    database.pool.close_all()
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "conversation.db")
+    _make_v0_database(database.DB_PATH)
+
+    database.init_db()
+
+    conn = database.get_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
+
+    summary = {row["conversation_id"]: row for row in conn.execute("SELECT * FROM conversations")}
+    assert summary["old"]["message_count"] == 3
+    assert summary["old"]["last_model"] == "gpt-4"
+    # Stored local times were converted to UTC, and the summary follows the messages
+    newest = conn.execute("SELECT MAX(timestamp) FROM messages").fetchone()[0]
+    assert summary["old"]["last_message_at"] == newest
+    # Empty conversations get a cursor position too
+    assert summary["empty"]["message_count"] == 0
+    assert summary["empty"]["last_message_at"] == "2025-01-02T09:00:00"
+
+    # Long bodies moved to blobs, short ones stay inline; token counts backfilled
+    rows = conn.execute("SELECT content, blob_id, token_count FROM messages ORDER BY id").fetchall()
+    assert rows[1]["content"] == "" and rows[1]["blob_id"] is not None
+    assert rows[0]["blob_id"] is None
+    assert all(row["token_count"] for row in rows)
+    assert conn.execute("SELECT refs FROM blobs").fetchone()[0] == 1
+    conn.close()
+
+    assert conversation_store.get_history("old")[1] == {"role": "assistant", "content": LONG_ANSWER}
+    results = conversation_store.search_messages("capital")["results"]
+    assert {result["message_id"] for result in results} == {1, 2}
+    database.pool.close_all()
+
+
+def test_init_db_is_idempotent(db):
+    conversation_store.add_message("c", "user", "x" * blob_store.MIN_BYTES)
+    db.init_db()
+
+    conn = db.get_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
+    assert conn.execute("SELECT message_count FROM conversations").fetchone()[0] == 1
+    assert conn.execute("SELECT refs FROM blobs").fetchone()[0] == 1
+    conn.close()
@@ -0,0 +1,81 @@
+from backend import conversation_store
+from backend.history_cache import history_cache
+
+TIMESTAMP = "2026-01-01T00:00:00"
+
+
+def _add(conversation_id: str, count: int):
+    # One shared timestamp, as in a group commit: order must come from ids alone
+    conversation_store.add_messages([(conversation_id, "user", f"m{i}", None, TIMESTAMP) for i in range(1, count + 1)])
+
+
+def _contents(page):
+    return [message["content"] for message in page["messages"]]
+
+
+def test_history_pages_backwards_to_the_first_message(db):
+    _add("c", 5)
+
+    page = conversation_store.get_history_page("c", limit=2)
+    assert _contents(page) == ["m4", "m5"]
+    assert page["next_after"] is None
+
+    page = conversation_store.get_history_page("c", limit=2, before=page["next_before"])
+    assert _contents(page) == ["m2", "m3"]
+
+    page = conversation_store.get_history_page("c", limit=2, before=page["next_before"])
+    assert _contents(page) == ["m1"]
+    assert page["next_before"] is None
+    assert page["next_after"] is not None
+
+
+def test_history_page_that_ends_exactly_at_the_first_message(db):
+    _add("c", 4)
+    newest = conversation_store.get_history_page("c", limit=2)
+
+    page = conversation_store.get_history_page("c", limit=2, before=newest["next_before"])
+    assert _contents(page) == ["m1", "m2"]
+    assert page["next_before"] is None
+
+
+def test_history_pages_forwards_to_the_last_message(db):
+    _add("c", 5)
+    oldest = conversation_store.get_history_page("c", limit=1, before=2)
+    assert _contents(oldest) == ["m1"]
+
+    page = conversation_store.get_history_page("c", limit=2, after=oldest["next_after"])
+    assert _contents(page) == ["m2", "m3"]
+    page = conversation_store.get_history_page("c", limit=2, after=page["next_after"])
+    assert _contents(page) == ["m4", "m5"]
+    assert page["next_after"] is None
+
+
+def test_full_history_is_in_insert_order(db, monkeypatch):
+    # Timestamps can go backwards (clock changes, imports); order is still the insert order
+    conversation_store.add_messages([("c", "user", f"m{i}", None, f"2026-01-01T00:00:{60 - i:02d}")
+                                     for i in range(1, 21)])
+    expected = [f"m{i}" for i in range(1, 21)]
+    assert [m["content"] for m in conversation_store.get_history("c")] == expected
+
+    monkeypatch.setattr(history_cache, "enabled", False)
+    assert [m["content"] for m in conversation_store.get_history("c")] == expected
+
+
+def test_conversation_listing_breaks_timestamp_ties_by_id(db):
+    for conversation_id in "abcde":
+        _add(conversation_id, 1)
+
+    seen = []
+    page = conversation_store.list_conversations_page(limit=2)
+    pages = [page]
+    while page["next_before"]:
+        page = conversation_store.list_conversations_page(limit=2, before=page["next_before"])
+        pages.append(page)
+    for page in pages:
+        seen += [conversation["conversation_id"] for conversation in page["conversations"]]
+
+    assert seen == ["e", "d", "c", "b", "a"]
+    assert pages[-1]["next_before"] is None
+
+    back = conversation_store.list_conversations_page(limit=2, after=pages[-1]["next_after"])
+    assert [conversation["conversation_id"] for conversation in back["conversations"]] == ["c", "b"]
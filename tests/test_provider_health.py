@@ -0,0 +1,118 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils import provider_health, router
+from app.utils.metrics import CIRCUIT_TRANSITIONS, FAILOVERS
+from app.utils.provider_health import ProviderHealth
+
+COOLDOWN = 0.05
+
+
+@pytest.fixture
+def health(monkeypatch):
+    monkeypatch.setattr(provider_health, "FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(provider_health, "COOLDOWN_SECONDS", COOLDOWN)
+    health = ProviderHealth()
+    monkeypatch.setattr(router, "health", health)
+    return health
+
+
+def _transitions(provider: str, state: str) -> float:
+    return CIRCUIT_TRANSITIONS._values.get((provider, "m", state), 0)
+
+
+def _open(health, provider: str):
+    for _ in range(provider_health.FAILURE_THRESHOLD):
+        health.record_failure(provider, "m")
+
+
+def test_opens_after_consecutive_failures(health):
+    health.record_failure("p-open", "m")
+    health.record_success("p-open", "m", 0.1)  # resets the streak
+    health.record_failure("p-open", "m")
+    health.record_failure("p-open", "m")
+    assert health.acquire("p-open", "m")
+
+    health.record_failure("p-open", "m")
+    assert not health.acquire("p-open", "m")
+    assert not health.available("p-open", "m")
+    assert _transitions("p-open", "open") == 1
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success(health):
+    _open(health, "p-probe")
+    time.sleep(COOLDOWN)
+
+    assert health.available("p-probe", "m")
+    assert health.acquire("p-probe", "m")
+    assert not health.acquire("p-probe", "m")  # the probe slot is taken
+    assert _transitions("p-probe", "half_open") == 1
+
+    health.record_success("p-probe", "m", 0.1)
+    assert health.acquire("p-probe", "m") and health.acquire("p-probe", "m")
+    assert _transitions("p-probe", "closed") == 1
+
+
+def test_failed_probe_reopens(health):
+    _open(health, "p-reopen")
+    time.sleep(COOLDOWN)
+    assert health.acquire("p-reopen", "m")
+
+    health.record_failure("p-reopen", "m")
+    assert not health.acquire("p-reopen", "m")
+    assert _transitions("p-reopen", "open") == 2
+
+
+def test_lost_probe_frees_its_slot_after_another_cooldown(health):
+    _open(health, "p-lost")
+    time.sleep(COOLDOWN)
+    assert health.acquire("p-lost", "m")
+    time.sleep(COOLDOWN)
+    assert health.acquire("p-lost", "m")
+
+
+def test_latency_windows_are_separate(health, monkeypatch):
+    monkeypatch.setattr(provider_health, "HEDGE_MIN_SAMPLES", 1)
+    health.record_success("p-lat", "m", 2.0, ttft=0.1)
+    health.record_success("p-lat", "m", 3.0)  # non-streaming: no first-token time
+    assert health.p95("p-lat", "m", "ttft") == 0.1
+    assert health.p95("p-lat", "m") == 3.0
+
+
+def _adapter(name: str, answer: str | None = None):
+    calls = []
+
+    async def complete_chat(prompt, history, model, use_cache, conversation_id):
+        calls.append(model)
+        if answer is None:
+            raise RuntimeError(f"{name} down")
+        return answer
+
+    return SimpleNamespace(name=name, calls=calls, client=SimpleNamespace(complete_chat=complete_chat))
+
+
+@pytest.mark.anyio
+async def test_failover_moves_to_the_next_candidate_and_counts_it(health):
+    down, up = _adapter("f-down"), _adapter("f-up", "hello")
+    adapter, model, answer, error = await router.complete_with_failover(
+        "chain", [(down, "m"), (up, "m")], "hi", None, use_cache=False, hedge=False)
+
+    assert (adapter, answer, error) == (up, "hello", None)
+    assert FAILOVERS._values[("f-down", "m")] == 1
+
+
+@pytest.mark.anyio
+async def test_open_circuit_is_skipped_without_a_call(health):
+    down, up = _adapter("s-down"), _adapter("s-up", "hello")
+    _open(health, "s-down")
+
+    adapter, _, answer, _ = await router.complete_with_failover(
+        "chain", [(down, "m"), (up, "m")], "hi", None, use_cache=False, hedge=False)
+    assert adapter is up and down.calls == []
+
+    _open(health, "s-up")
+    adapter, _, _, _ = await router.complete_with_failover(
+        "chain", [(down, "m"), (up, "m")], "hi", None, use_cache=False, hedge=False)
+    assert adapter is None
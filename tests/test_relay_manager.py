@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from app.llm_clients import openai_client
+from app.relay_manager import PAUSED, RelayManager
+from backend import async_store, conversation_store
+
+pytestmark = pytest.mark.anyio
+
+PROMPT = "What is the capital of France?"
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Fake stream: a fresh call stalls after its first delta; a continuation finishes the answer."""
+    prefills = []
+
+    async def stream_chat(message, history, model, usage=None, conversation_id=None, prefill=None):
+        prefills.append(prefill)
+        if prefill is None:
+            yield "The capital "
+            await asyncio.Event().wait()
+        yield "is Paris."
+
+    monkeypatch.setattr(openai_client, "stream_chat", stream_chat)
+    return prefills
+
+
+async def _pause_after_first_delta(generation) -> dict:
+    events = generation.events(0)
+    assert (await events.__anext__())["text"] == "The capital "
+    generation.pause()
+    return [event async for event in events][-1]
+
+
+async def _finish(generation, offset: int) -> list[dict]:
+    return [event async for event in generation.events(offset)]
+
+
+async def test_resume_sends_the_partial_answer_as_prefill(db, upstream):
+    relay = RelayManager()
+    generation = await relay.start("gpt-4.1-mini", PROMPT, "c", use_cache=False)
+
+    paused = await _pause_after_first_delta(generation)
+    assert paused == {"type": "paused", "task_id": generation.task_id, "offset": len("The capital ")}
+
+    await relay.resume(generation)
+    events = await _finish(generation, paused["offset"])
+
+    assert upstream == [None, "The capital "]
+    assert [event["text"] for event in events if event["type"] == "delta"] == ["is Paris."]
+    assert events[-1]["type"] == "done"
+    assert events[-1]["response"] == "The capital is Paris."
+    await async_store.write_queue.flush()
+    assert conversation_store.get_history("c") == [
+        {"role": "user", "content": PROMPT},
+        {"role": "assistant", "content": "The capital is Paris."},
+    ]
+
+
+async def test_resume_after_restart_reads_the_saved_text(db, upstream):
+    before = RelayManager()
+    generation = await before.start("gpt-4.1-mini", PROMPT, None, use_cache=False)
+    events = generation.events(0)
+    await events.__anext__()
+    await before.shutdown()  # pauses and saves running generations
+    await events.aclose()
+
+    after = RelayManager()
+    reloaded = await after.get(generation.task_id)
+    assert reloaded.status == PAUSED
+    assert reloaded.route["model"] == "gpt-4.1-mini"
+
+    await after.resume(reloaded)
+    events = await _finish(reloaded, 0)
+    assert upstream == [None, "The capital "]
+    assert "".join(event["text"] for event in events if event["type"] == "delta") == "The capital is Paris."
+
+
+async def test_overlapping_resumes_start_one_continuation(db, upstream):
+    relay = RelayManager()
+    generation = await relay.start("gpt-4.1-mini", PROMPT, None, use_cache=False)
+    await _pause_after_first_delta(generation)
+
+    await asyncio.gather(relay.resume(generation), relay.resume(generation))
+    await _finish(generation, 0)
+    assert upstream == [None, "The capital "]
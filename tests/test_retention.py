@@ -0,0 +1,59 @@
+import pytest
+
+from app.utils.retention import RetentionWorker
+from backend import conversation_store, retention_store
+from backend.database import utc_now
+
+pytestmark = pytest.mark.anyio
+
+
+def _add(conversation_id: str, count: int, days_ago: float):
+    timestamp = utc_now(days_ago=days_ago)
+    conversation_store.add_messages([(conversation_id, "user", f"m{i}", None, timestamp) for i in range(count)])
+
+
+def _message_count(db, conversation_id: str):
+    conn = db.get_connection()
+    row = conn.execute("SELECT message_count FROM conversations WHERE conversation_id = ?",
+                       (conversation_id,)).fetchone()
+    conn.close()
+    return row and row[0]
+
+
+async def test_deletes_conversations_idle_past_the_cutoff(db, monkeypatch):
+    monkeypatch.setattr("app.utils.retention.PAUSE_SECONDS", 0)
+    _add("stale", 25, days_ago=1.1)
+    _add("fresh", 2, days_ago=0.9)
+    conversation_store.get_history("stale")  # cached
+
+    worker = RetentionWorker()
+    worker.batch_rows = 10
+    assert worker.start(1)
+    await worker._task
+
+    status = worker.status()
+    assert status["error"] is None
+    assert (status["conversations_deleted"], status["messages_deleted"]) == (1, 25)
+    assert conversation_store.get_history("stale") == []
+    assert [c["conversation_id"] for c in conversation_store.list_conversations()] == ["fresh"]
+
+
+def test_partial_delete_keeps_count_and_cache_in_step(db):
+    _add("c", 5, days_ago=10)
+    assert len(conversation_store.get_history("c")) == 5  # cached
+
+    deleted = retention_store.delete_messages(["c"], utc_now(days_ago=1), 3)
+
+    assert deleted == 3
+    assert _message_count(db, "c") == 2
+    assert len(conversation_store.get_history("c")) == 2
+
+
+def test_recently_active_conversation_is_left_alone(db):
+    _add("c", 3, days_ago=10)
+    cutoff = utc_now(days_ago=1)
+    picked = retention_store.stale_conversations(cutoff, 10)
+    _add("c", 1, days_ago=0)  # new message after it was picked
+
+    assert retention_store.delete_messages(picked, cutoff, 10) == 0
+    assert _message_count(db, "c") == 4
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from app.utils.response_cache import cached_completion
+from app.utils.singleflight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class Upstream:
+    """Counts calls; each call waits for `release` and then returns or raises."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.error = None
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return f"answer {self.calls}"
+
+
+async def test_followers_share_the_leaders_call():
+    flight, upstream = SingleFlight(), Upstream()
+    waiters = [asyncio.create_task(flight.do("k", upstream)) for _ in range(3)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    assert await asyncio.gather(*waiters) == ["answer 1"] * 3
+    assert upstream.calls == 1
+    assert flight.stats()["coalesced_calls"] == 2
+
+
+async def test_leader_failure_reaches_every_waiter_and_is_not_kept():
+    flight, upstream = SingleFlight(), Upstream()
+    upstream.error = RuntimeError("provider down")
+    waiters = [asyncio.create_task(flight.do("k", upstream)) for _ in range(3)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.stats()["in_flight"] == 0
+
+    # The next caller starts a fresh call rather than getting the old error
+    upstream.error = None
+    assert await flight.do("k", upstream) == "answer 2"
+
+
+async def test_cancelled_waiter_does_not_cancel_the_others():
+    flight, upstream = SingleFlight(), Upstream()
+    leader = asyncio.create_task(flight.do("k", upstream))
+    follower = asyncio.create_task(flight.do("k", upstream))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    await asyncio.sleep(0)
+    upstream.release.set()
+    assert await follower == "answer 1"
+    assert leader.cancelled()
+
+
+async def test_last_waiter_leaving_cancels_the_call():
+    flight, upstream = SingleFlight(), Upstream()
+    waiter = asyncio.create_task(flight.do("k", upstream))
+    await asyncio.sleep(0)
+    call = flight._inflight["k"]
+
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert call.task.cancelled()
+
+
+async def test_follower_times_out_on_its_own_deadline():
+    flight, upstream = SingleFlight(), Upstream()
+    leader = asyncio.create_task(flight.do("k", upstream))
+    await asyncio.sleep(0)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await flight.do("k", upstream, timeout=0.01)
+
+    upstream.release.set()
+    assert await leader == "answer 1"
+    assert upstream.calls == 1
+
+
+async def test_caller_does_not_join_a_leader_with_a_shorter_deadline():
+    flight, upstream = SingleFlight(), Upstream()
+    short = asyncio.create_task(flight.do("k", upstream, timeout=0.05))
+    await asyncio.sleep(0)
+    unbounded = asyncio.create_task(flight.do("k", upstream))
+    await asyncio.sleep(0.01)
+    assert upstream.calls == 2
+
+    with pytest.raises(asyncio.TimeoutError):
+        await short
+    upstream.release.set()
+    assert await unbounded == "answer 2"
+
+
+async def test_cached_completion_does_not_cache_a_failed_leader(db):
+    messages = [{"role": "user", "content": "hello"}]
+    upstream = Upstream()
+    upstream.error = RuntimeError("provider down")
+    upstream.release.set()
+    with pytest.raises(RuntimeError):
+        await cached_completion("gpt-4.1-mini", None, messages, upstream)
+
+    upstream.error = None
+    assert await cached_completion("gpt-4.1-mini", None, messages, upstream) == "answer 2"
+    assert await cached_completion("gpt-4.1-mini", None, messages, upstream) == "answer 2"
+    assert upstream.calls == 2
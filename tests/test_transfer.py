@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from backend import async_store, conversation_store
+from backend.database import pooled_connection
+from backend.history_cache import history_cache
+
+pytestmark = pytest.mark.anyio
+
+LONG_ANSWER = "A long answer that is stored as a blob. " * 40
+
+
+def _fill():
+    conversation_store.add_messages([
+        ("a", "user", "first question", None, "2026-01-01T10:00:00"),
+        ("a", "assistant", LONG_ANSWER, "gpt-4.1-mini", "2026-01-01T10:00:01"),
+        ("a", "user", "second question", None, "2026-01-01T10:05:00"),
+        ("b", "user", "hello", None, "2026-01-02T08:00:00"),
+        ("b", "assistant", "hi", "claude-3-5-haiku-20241022", "2026-01-02T08:00:01"),
+    ])
+    through = conversation_store._history_rows("a")[1]["id"]
+    conversation_store.save_summary("a", "asked two questions", through)
+    with pooled_connection() as conn:
+        conn.execute("INSERT INTO conversations (conversation_id, created_at, last_message_at) "
+                     "VALUES ('empty', '2026-01-03 00:00:00', '2026-01-03T00:00:00')")
+        conn.commit()
+
+
+def _snapshot():
+    conversations = conversation_store.list_conversations()
+    histories = {c["conversation_id"]: conversation_store.get_history(c["conversation_id"]) for c in conversations}
+    return conversations, histories
+
+
+def _without_ids(exported: bytes) -> list[dict]:
+    records = [json.loads(line) for line in exported.splitlines()]
+    for record in records:
+        record.pop("id", None)
+        record.pop("summary_through", None)
+    return records
+
+
+async def _export() -> bytes:
+    return "".join([chunk async for chunk in async_store.export_conversations()]).encode()
+
+
+async def _body(data: bytes, size: int = 7):
+    # Small chunks split lines (and UTF-8) anywhere, like a real request body
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def _use_new_database(db, tmp_path, monkeypatch, name: str):
+    db.pool.close_all()
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / name)
+    db.init_db()
+    history_cache.clear()
+
+
+@pytest.mark.parametrize("defer_indexes", [False, True])
+async def test_round_trip_into_an_empty_database(db, tmp_path, monkeypatch, defer_indexes):
+    _fill()
+    before = _snapshot()
+    exported = await _export()
+
+    _use_new_database(db, tmp_path, monkeypatch, "imported.db")
+    result = await async_store.import_conversations(_body(exported), defer_indexes=defer_indexes)
+
+    assert (result["conversations"], result["messages"], result["errors"]) == (3, 5, [])
+    assert _snapshot() == before
+    # The summary points at the same message under its new id
+    summary, unsummarized = conversation_store.get_unsummarized("a", 10 ** 9)
+    assert summary == "asked two questions"
+    assert [m["content"] for m in unsummarized] == ["second question"]
+    assert [r["conversation_id"] for r in conversation_store.search_messages("blob")["results"]] == ["a"]
+    # Exporting again gives the same records
+    assert _without_ids(await _export()) == _without_ids(exported)
+
+
+async def test_existing_conversations_are_skipped_or_appended(db):
+    _fill()
+    exported = await _export()
+
+    skipped = await async_store.import_conversations(_body(exported))
+    assert (skipped["skipped_conversations"], skipped["messages"]) == (3, 0)
+
+    appended = await async_store.import_conversations(_body(exported), on_conflict="append")
+    assert appended["messages"] == 5
+    counts = {c["conversation_id"]: c["message_count"] for c in conversation_store.list_conversations()}
+    assert counts == {"a": 6, "b": 4, "empty": 0}
+
+
+async def test_bad_lines_are_reported_and_skipped(db):
+    body = b'{"type": "conversation", "conversation_id": "c"}\nnot json\n' \
+           b'{"type": "message", "conversation_id": "c", "role": "user", "content": "kept"}\n' \
+           b'{"type": "message", "conversation_id": "c", "role": 5, "content": "bad role"}\n'
+    result = await async_store.import_conversations(_body(body))
+
+    assert [error["line"] for error in result["errors"]] == [2, 4]
+    assert conversation_store.get_history("c") == [{"role": "user", "content": "kept"}]